@@ -1,145 +1,452 @@
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, Response, request, jsonify, render_template
 from cgt_calculator import CGTCalculator
-from output_excel_writer import export_capital_gains_to_excel
+from results import RESULTS_FORMAT_VERSION, load_summary
 from werkzeug.utils import secure_filename
 import os
+import shutil
 import stripe
-from datetime import datetime, timedelta
 import uuid
-import sqlite3
-from contextlib import contextmanager
 import atexit
+from datetime import datetime, timedelta
+from functools import lru_cache, partial
+import zipfile
 from apscheduler.schedulers.background import BackgroundScheduler
+from session_store import SessionStore
+from calculation_pool import CalculationPool
+from compressed_files import COMPRESSED_SUFFIXES
+from csv_export import iter_results_csv_zip
+from downloads import OFFLOAD_MODES, ReportCache, file_etag, send_report
+from job_scheduler import JobScheduler, SchedulerFull, estimate_job
+from lp_solver import LPSolveError
+from market_data_api import uncached_symbols
+from memory_profile import MemoryProfile, profile_stage
+from planner import SellPlanner
+from reports import write_report
+from cleanup import run_cleanup
 
 app = Flask(__name__)
 
 # Configuration
 app.config["UPLOAD_FOLDER"] = "uploads"
 app.config["OUTPUT_FOLDER"] = "outputs"
-app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size
+app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size, compressed
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
 app.config["DATABASE"] = "sessions.db"
+app.config["BATCH_MAX_PORTFOLIOS"] = 50
+app.config["BATCH_MAX_UNZIPPED_SIZE"] = 64 * 1024 * 1024  # 64MB across a zip's files
+app.config["JOB_WORKERS"] = 2
+app.config["JOB_LARGE_WORKERS"] = 1
+app.config["JOB_LARGE_SECONDS"] = 30  # uploads estimated above this use the large lane
+app.config["JOB_MAX_LARGE_QUEUED"] = 4
+app.config["JOB_HEARTBEAT_SECONDS"] = 60  # how often a worker marks its jobs as alive
+app.config["JOB_STALE_SECONDS"] = 300  # queued or running jobs silent this long are failed
+# Every gunicorn worker (WEB_CONCURRENCY of them) runs its own calculation pool,
+# so the dyno's calculation processes and their memory are split between them
+WEB_CONCURRENCY = max(int(os.getenv("WEB_CONCURRENCY", 1)), 1)
+app.config["DYNO_CALCULATION_PROCESSES"] = int(os.getenv("DYNO_CALCULATION_PROCESSES", 3))
+app.config["DYNO_CALCULATION_MEMORY_MB"] = int(os.getenv("DYNO_CALCULATION_MEMORY_MB", 6144))
+app.config["CALCULATION_PROCESSES"] = max(
+    app.config["DYNO_CALCULATION_PROCESSES"] // WEB_CONCURRENCY, 1
+)
+app.config["CALCULATION_MAX_JOBS"] = 50  # jobs before a calculation process is replaced
+app.config["CALCULATION_MAX_RSS_MB"] = 1024  # resident memory after which it is replaced
+# Address space cap of each job
+app.config["CALCULATION_MEMORY_LIMIT_MB"] = app.config["DYNO_CALCULATION_MEMORY_MB"] // (
+    WEB_CONCURRENCY * app.config["CALCULATION_PROCESSES"]
+)
+# Record the memory of each upload's stages with its job, see memory_profile
+app.config["MEMORY_PROFILE"] = bool(os.getenv("MEMORY_PROFILE"))
+app.config["MEMORY_PROFILE_TOP_SITES_MB"] = 256  # dump allocation sites of stages above this
+# Let the web server send reports: "x-sendfile" (Apache, lighttpd) or
+# "x-accel-redirect" (nginx, with an internal location aliasing OUTPUT_FOLDER)
+app.config["DOWNLOAD_OFFLOAD"] = os.getenv("DOWNLOAD_OFFLOAD") or None
+app.config["DOWNLOAD_ACCEL_PREFIX"] = os.getenv("DOWNLOAD_ACCEL_PREFIX", "/protected-outputs/")
+app.config["DOWNLOAD_CACHE_FILE_BYTES"] = 2 * 1024 * 1024  # reports up to 2MB served from memory
+app.config["DOWNLOAD_CACHE_BYTES"] = 64 * 1024 * 1024  # across all cached reports
 
 # Stripe configuration
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+if os.getenv("STRIPE_API_BASE"):
+    # Point Stripe calls at a local stand-in, e.g. for load testing
+    stripe.api_base = os.getenv("STRIPE_API_BASE")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
 
-# Ensure folders exist
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-os.makedirs(app.config["OUTPUT_FOLDER"], exist_ok=True)
+# Set up in each web worker by create_app
+job_scheduler = None
+calculation_pool = None
+session_store = None
+report_cache = None
+scheduler = None
+
+
+def create_app(config=None):
+    """
+    Set up this worker process: the folders and session database, the
+    calculation pool, job scheduler and download cache, and the background
+    cleanup and job watching. Called once per gunicorn worker, as
+    gunicorn "app:create_app()". config overrides app.config, e.g. in tests.
+    """
+    global job_scheduler, calculation_pool, session_store
+    global report_cache, scheduler
+    app.config.update(config or {})
+    if app.config["DOWNLOAD_OFFLOAD"] not in (None, *OFFLOAD_MODES):
+        raise ValueError(f"DOWNLOAD_OFFLOAD must be one of {', '.join(OFFLOAD_MODES)}")
+
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    os.makedirs(app.config["OUTPUT_FOLDER"], exist_ok=True)
+
+    # Uploads are calculated in the background, smallest first
+    job_scheduler = JobScheduler(
+        workers=app.config["JOB_WORKERS"],
+        large_workers=app.config["JOB_LARGE_WORKERS"],
+        large_job_seconds=app.config["JOB_LARGE_SECONDS"],
+        max_large_queued=app.config["JOB_MAX_LARGE_QUEUED"],
+    )
 
-sqlite3.register_adapter(datetime, lambda val: val.isoformat())
+    # Solves and report writing run in warm processes outside the web worker
+    calculation_pool = CalculationPool(
+        processes=app.config["CALCULATION_PROCESSES"],
+        max_jobs=app.config["CALCULATION_MAX_JOBS"],
+        max_rss_mb=app.config["CALCULATION_MAX_RSS_MB"],
+        memory_limit_mb=app.config["CALCULATION_MEMORY_LIMIT_MB"],
+    )
 
+    session_store = SessionStore(app.config["DATABASE"])
+    session_store.init_schema()
 
-# Database setup
-def init_db():
-    """Initialize the database with the sessions table"""
-    with get_db() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id TEXT PRIMARY KEY,
-                excel_path TEXT NOT NULL,
-                excel_filename TEXT NOT NULL,
-                created_at TIMESTAMP NOT NULL
-            )
-        """)
-        conn.commit()
+    # Recently downloaded small reports, so repeated downloads skip the disk
+    report_cache = ReportCache(
+        app.config["DOWNLOAD_CACHE_FILE_BYTES"], app.config["DOWNLOAD_CACHE_BYTES"]
+    )
+
+    # Set up background scheduler for cleanup
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(func=cleanup_old_sessions, trigger="interval", hours=1)
+    scheduler.add_job(
+        func=watch_jobs, trigger="interval", seconds=app.config["JOB_HEARTBEAT_SECONDS"]
+    )
+    scheduler.start()
 
+    # Shutdown scheduler when app exits
+    atexit.register(scheduler.shutdown)
+    atexit.register(calculation_pool.shutdown)
 
-@contextmanager
-def get_db():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(app.config["DATABASE"])
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
+    return app
 
 
 def cleanup_old_sessions():
-    """Remove sessions older than 24 hours and their associated files"""
-    cutoff_time = datetime.now() - timedelta(hours=24)
-
-    with get_db() as conn:
-        # Get sessions to delete
-        cursor = conn.execute(
-            "SELECT session_id, excel_path FROM sessions WHERE created_at < ?",
-            (cutoff_time,),
-        )
-        old_sessions = cursor.fetchall()
+    """
+    Remove sessions older than 24 hours with their reports, and uploads orphaned
+    by crashed requests. Only one process across all workers sweeps at a time.
+    """
+    return run_cleanup(
+        session_store, app.config["UPLOAD_FOLDER"], app.config["OUTPUT_FOLDER"]
+    )
+
 
-        # Delete files and database records
-        for session in old_sessions:
-            excel_path = os.path.join(os.getcwd(), session["excel_path"])
-            if os.path.exists(excel_path):
-                try:
-                    os.remove(excel_path)
-                    print(f"Deleted old file: {excel_path}")
-                except Exception as e:
-                    print(f"Error deleting file {excel_path}: {e}")
+STALE_JOB_RESULT = {
+    "error": "The calculation was interrupted, please upload your trade history again"
+}
 
-        # Delete from database
-        conn.execute("DELETE FROM sessions WHERE created_at < ?", (cutoff_time,))
-        deleted_count = conn.total_changes
-        conn.commit()
 
-        if deleted_count > 0:
-            print(f"Cleaned up {deleted_count} old session(s)")
+def watch_jobs():
+    """
+    Mark this worker's queued and running jobs as alive, and fail jobs which no
+    worker has marked lately, as the worker holding them must have died
+    """
+    session_store.touch_jobs(job_scheduler.job_ids())
+    cutoff_time = datetime.now() - timedelta(seconds=app.config["JOB_STALE_SECONDS"])
+    failed = session_store.fail_stale_jobs(cutoff_time, STALE_JOB_RESULT)
+    if failed:
+        print(f"Failed {failed} job(s) left behind by a worker which stopped")
 
 
-def store_session(session_id, excel_path, excel_filename):
+def store_session(
+    session_id,
+    excel_path,
+    excel_filename,
+    results_path=None,
+    plan_path=None,
+    export_format="xlsx",
+):
     """Store session information in the database"""
-    with get_db() as conn:
-        conn.execute(
-            """INSERT INTO sessions (session_id, excel_path, excel_filename, created_at)
-               VALUES (?, ?, ?, ?)""",
-            (session_id, excel_path, excel_filename, datetime.now()),
-        )
-        conn.commit()
+    session_store.store(
+        session_id, excel_path, excel_filename, results_path, plan_path, export_format
+    )
 
 
 def get_session(session_id):
     """Retrieve session information from the database"""
-    with get_db() as conn:
-        cursor = conn.execute(
-            "SELECT * FROM sessions WHERE session_id = ?", (session_id,)
-        )
-        row = cursor.fetchone()
-        if row:
-            return {
-                "session_id": row["session_id"],
-                "excel_path": row["excel_path"],
-                "excel_filename": row["excel_filename"],
-                "created_at": row["created_at"],
-            }
-        return None
+    return session_store.get(session_id)
 
 
 def session_exists(session_id):
     """Check if a session exists in the database"""
-    with get_db() as conn:
-        cursor = conn.execute(
-            "SELECT COUNT(*) FROM sessions WHERE session_id = ?", (session_id,)
-        )
-        return cursor.fetchone()[0] > 0
+    return session_store.exists(session_id)
+
+
+PAYMENT_REQUIRED = "Payment is required to view this session's results"
 
 
 def allowed_file(filename):
-    extension = filename.rsplit(".", 1)[1].lower()
-    return "." in filename and (extension == "csv" or extension == "xlsx")
+    """CSV and XLSX trade histories, and CSVs gzipped or either zipped"""
+    filename = filename.lower()
+    return any(
+        filename.endswith(extension) and len(filename) > len(extension)
+        for extension in (".csv", ".xlsx", *COMPRESSED_SUFFIXES)
+    )
 
 
-# Initialize database
-init_db()
+def parse_target_fy(form):
+    """Optional financial year to file for, e.g. 2025 for 1 Jul 2024 - 30 Jun 2025"""
+    target_fy = form.get("target_fy", "").strip()
+    if not target_fy:
+        return None
+    if not target_fy.isdigit():
+        raise ValueError(f"Invalid target financial year: {target_fy}")
+    return int(target_fy)
+
+
+def parse_export_format(form):
+    """How the session's report is downloaded, an Excel workbook or a zip of CSVs"""
+    export_format = form.get("export_format", "").strip().lower() or "xlsx"
+    if export_format not in ("xlsx", "csv"):
+        raise ValueError(f"Invalid export format: {export_format}")
+    return export_format
+
+
+def generate_report(
+    calculator,
+    session_id,
+    allow_short_selling,
+    target_fy=None,
+    memory_profile=None,
+    export_format="xlsx",
+):
+    """
+    Calculate the optimal CGT of a calculator's trades in the calculation pool,
+    export the report and store the session. Returns the report, see write_report.
+    With a target_fy only the years up to it are calculated and only it is reported.
+    """
+    report = calculation_pool.submit(
+        write_report,
+        calculator,
+        session_id,
+        allow_short_selling,
+        app.config["OUTPUT_FOLDER"],
+        target_fy,
+        memory_profile,
+        export_format,
+    ).result()
+
+    # Store session info in database
+    store_session(
+        session_id,
+        report["excel_path"],
+        report["excel_filename"],
+        report["results_path"],
+        report["plan_path"],
+        export_format,
+    )
 
-# Set up background scheduler for cleanup
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=cleanup_old_sessions, trigger="interval", hours=1)
-scheduler.start()
+    return report
 
-# Shutdown scheduler when app exits
-atexit.register(lambda: scheduler.shutdown())
+
+def save_batch_uploads(files, batch_id):
+    """
+    Save every uploaded trade history of a batch, extracting zip archives.
+    Returns a list of (original filename, saved path) pairs.
+    """
+    saved = []
+    try:
+        for file in files:
+            filename = secure_filename(file.filename)
+            if filename.lower().endswith(".zip"):
+                with zipfile.ZipFile(file.stream) as archive:
+                    members = [
+                        info
+                        for info in archive.infolist()
+                        if not info.is_dir()
+                        and not info.filename.startswith("__MACOSX")
+                        and "." in os.path.basename(info.filename)
+                        and allowed_file(os.path.basename(info.filename))
+                    ]
+                    if (
+                        sum(info.file_size for info in members)
+                        > app.config["BATCH_MAX_UNZIPPED_SIZE"]
+                    ):
+                        raise ValueError(f"Archive {filename} is too large once unzipped")
+                    for info in members:
+                        member_name = secure_filename(os.path.basename(info.filename))
+                        path = os.path.join(
+                            app.config["UPLOAD_FOLDER"],
+                            f"{batch_id}_{len(saved)}_{member_name}",
+                        )
+                        with archive.open(info) as src, open(path, "wb") as dst:
+                            shutil.copyfileobj(src, dst)
+                        saved.append((member_name, path))
+            elif "." in filename and allowed_file(filename):
+                path = os.path.join(
+                    app.config["UPLOAD_FOLDER"], f"{batch_id}_{len(saved)}_{filename}"
+                )
+                file.save(path)
+                saved.append((filename, path))
+            else:
+                raise ValueError(
+                    f"Only CSV, XLSX, CSV.GZ and ZIP files are allowed: {file.filename}"
+                )
+    except Exception:
+        # Do not leave part of a rejected batch behind in the upload folder
+        for _, path in saved:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    return saved
+
+
+TOO_LARGE_MESSAGE = "The trade history is too large to calculate"
+
+
+def queue_portfolio(
+    filename, trade_history_path, allow_short_selling, target_fy=None, export_format="xlsx"
+):
+    """
+    Parse one portfolio of a batch and queue its calculation, returning its
+    entry for the batch response
+    """
+    portfolio = {"filename": filename}
+    memory_profile = None
+    if app.config["MEMORY_PROFILE"]:
+        memory_profile = MemoryProfile(app.config["MEMORY_PROFILE_TOP_SITES_MB"])
+    try:
+        calculator = CGTCalculator(
+            trade_history_path, handle_market_data=False, memory_profile=memory_profile
+        )
+    except ValueError as e:
+        portfolio.update({"status": "invalid", "parse_error": str(e)})
+        return portfolio
+    finally:
+        if os.path.exists(trade_history_path):
+            os.remove(trade_history_path)
+
+    try:
+        portfolio.update(
+            queue_report_job(
+                calculator,
+                str(uuid.uuid4()),
+                allow_short_selling,
+                target_fy,
+                memory_profile,
+                export_format,
+            )
+        )
+    except SchedulerFull as e:
+        portfolio.update({"status": "rejected", "error": str(e)})
+    return portfolio
+
+
+def queue_report_job(
+    calculator,
+    session_id,
+    allow_short_selling,
+    target_fy=None,
+    memory_profile=None,
+    export_format="xlsx",
+):
+    """
+    Size a parsed trade history's calculation and queue it as a job. Returns
+    the job to poll at /api/jobs/<job_id> with its estimated time to finish.
+    Raises SchedulerFull, having recorded the job as rejected, if it cannot be queued.
+    """
+    estimate = estimate_job(
+        calculator.trades_df,
+        len(uncached_symbols(calculator.trades_df["symbol"].unique())),
+        target_fy,
+    )
+    job_id = str(uuid.uuid4())
+    session_store.create_job(job_id, estimate.to_dict())
+    try:
+        lane, eta_seconds = job_scheduler.submit(
+            job_id,
+            estimate,
+            partial(
+                run_report_job,
+                job_id,
+                calculator,
+                session_id,
+                allow_short_selling,
+                target_fy,
+                memory_profile,
+                export_format,
+            ),
+        )
+    except SchedulerFull as e:
+        session_store.update_job(job_id, status="rejected", result={"error": str(e)})
+        raise
+    session_store.update_job(job_id, eta_seconds=eta_seconds)
+
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "lane": lane,
+        "eta_seconds": eta_seconds,
+        "estimate": estimate.to_dict(),
+        "status_url": f"/api/jobs/{job_id}",
+    }
+
+
+def run_report_job(
+    job_id,
+    calculator,
+    session_id,
+    allow_short_selling,
+    target_fy=None,
+    memory_profile=None,
+    export_format="xlsx",
+):
+    """Look up market data and generate the report of a queued upload, recording the outcome"""
+    session_store.update_job(job_id, status="running")
+    try:
+        with profile_stage(memory_profile, "market_data"):
+            calculator.handle_splits_and_ticker_changes()
+        report = generate_report(
+            calculator,
+            session_id,
+            allow_short_selling,
+            target_fy,
+            memory_profile,
+            export_format,
+        )
+        # The pool's process recorded the calculation's stages in its copy
+        memory_profile = report["memory_profile"]
+        status, result = "done", {
+            "success": True,
+            "message": "Your CGT report has been generated successfully!",
+            "session_id": session_id,
+            "summary": {
+                "years_processed": len(report["financial_years"]),
+                "financial_years": report["financial_years"],
+            },
+        }
+    except ValueError as e:
+        status, result = "failed", {"short_sell_warning": str(e)}
+    except MemoryError:
+        status, result = "failed", {"error": TOO_LARGE_MESSAGE}
+    except LPSolveError as e:
+        symbol_error, lp_error = str(e).split("\n", 1)
+        status, result = "failed", {"symbol_error": symbol_error, "lp_error": lp_error}
+    except Exception as e:
+        status, result = "failed", {"error": str(e)}
+
+    memory = None
+    if memory_profile is not None:
+        memory = memory_profile.to_dict()
+        print(
+            f"Job {job_id} memory: peak RSS {memory['rss_peak_mb']} MB, traced peak "
+            f"{memory['traced_peak_mb']} MB, {memory['solves']} solve(s)"
+        )
+    session_store.update_job(job_id, status=status, result=result, memory=memory)
 
 
 @app.route("/")
@@ -150,7 +457,10 @@ def index():
 
 @app.route("/api/upload", methods=["POST"])
 def upload_file():
-    """Handle CSV file upload and processing"""
+    """
+    Handle CSV file upload, queueing its calculation. Responds with the job to
+    poll at /api/jobs/<job_id> and its estimated time to finish.
+    """
     if "file" not in request.files:
         return jsonify({"error": "No file provided"}), 400
 
@@ -159,7 +469,9 @@ def upload_file():
         return jsonify({"error": "No file selected"}), 400
 
     if not allowed_file(file.filename):
-        return jsonify({"error": "Only CSV and XLSX files are allowed"}), 400
+        return jsonify(
+            {"error": "Only CSV and XLSX files, gzipped CSVs and zip files are allowed"}
+        ), 400
 
     allow_short_selling = (
         True
@@ -168,6 +480,12 @@ def upload_file():
         else False
     )
 
+    try:
+        target_fy = parse_target_fy(request.form)
+        export_format = parse_export_format(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     csv_path = None
     try:
         # Generate unique ID for this processing session
@@ -178,42 +496,33 @@ def upload_file():
         csv_path = os.path.join(app.config["UPLOAD_FOLDER"], f"{session_id}_{filename}")
         file.save(csv_path)
 
-        # Calculate the optimal capital gains tax for each financial year
+        memory_profile = None
+        if app.config["MEMORY_PROFILE"]:
+            memory_profile = MemoryProfile(app.config["MEMORY_PROFILE_TOP_SITES_MB"])
+
+        # Parse now so the job can be sized, market data is looked up when it runs
         try:
-            data_dict = CGTCalculator(csv_path).execute(allow_short_selling)
+            calculator = CGTCalculator(
+                csv_path, handle_market_data=False, memory_profile=memory_profile
+            )
         except ValueError as e:
-            return jsonify({"short_sell_warning": str(e)}), 300
-        except RuntimeError as e:
-            error_lines = str(e).split("\n")
-            return jsonify(
-                {
-                    "symbol_error": error_lines[0],
-                    "lp_error": error_lines[1],
-                }
-            ), 300
-
-        # Generate Excel file
-        excel_filename = f"cgt_report_{session_id}.xlsx"
-        excel_path = os.path.join(app.config["OUTPUT_FOLDER"], excel_filename)
-        export_capital_gains_to_excel(data_dict, excel_path)
-
-        # Store session info in database
-        store_session(session_id, excel_path, excel_filename)
+            return jsonify({"error": str(e)}), 400
+        finally:
+            os.remove(csv_path)
 
-        # Clean up CSV file
-        os.remove(csv_path)
+        try:
+            job = queue_report_job(
+                calculator,
+                session_id,
+                allow_short_selling,
+                target_fy,
+                memory_profile,
+                export_format,
+            )
+        except SchedulerFull as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "60"}
 
-        return jsonify(
-            {
-                "success": True,
-                "message": "Your CGT report has been generated successfully!",
-                "session_id": session_id,
-                "summary": {
-                    "years_processed": len(data_dict),
-                    "financial_years": list(int(year) for year in data_dict.keys()),
-                },
-            }
-        )
+        return jsonify(job), 202
 
     except Exception as e:
         # Clean up CSV file on error
@@ -222,6 +531,102 @@ def upload_file():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/jobs/<job_id>")
+def job_status(job_id):
+    """Status of an uploaded trade history's calculation, with its outcome once finished"""
+    job = session_store.get_job(job_id)
+
+    if not job:
+        return jsonify({"error": "Job not found or expired"}), 404
+
+    response = {"job_id": job_id, "status": job["status"], "estimate": job["estimate"]}
+    if job["status"] in ("queued", "running"):
+        eta_seconds = job_scheduler.eta(job_id)
+        if eta_seconds is None and job["eta_seconds"] is not None:
+            # Queued by another worker process, count down from its ETA
+            elapsed = datetime.now() - datetime.fromisoformat(job["created_at"])
+            eta_seconds = max(job["eta_seconds"] - elapsed.total_seconds(), 0.0)
+        response["eta_seconds"] = eta_seconds
+    if job["result"]:
+        response.update(job["result"])
+
+    return jsonify(response)
+
+
+@app.route("/api/upload-batch", methods=["POST"])
+def upload_batch():
+    """
+    Handle several trade histories (or zips of them) in one request, queueing
+    each portfolio's calculation as its own job as /api/upload does. Responds
+    with each portfolio's job to poll at /api/jobs/<job_id>, or why it was not
+    queued: a parse_error for files which could not be read, or an error when
+    the scheduler is full. Market data lookups are shared across the jobs.
+    """
+    files = [file for file in request.files.getlist("files") if file.filename]
+    if not files:
+        return jsonify({"error": "No files provided"}), 400
+
+    allow_short_selling = (
+        True
+        if "allow_short_selling" in request.form
+        and bool(request.form["allow_short_selling"])
+        else False
+    )
+
+    try:
+        target_fy = parse_target_fy(request.form)
+        export_format = parse_export_format(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    batch_id = str(uuid.uuid4())
+    try:
+        saved = save_batch_uploads(files, batch_id)
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not saved:
+        return jsonify({"error": "No CSV or XLSX files found"}), 400
+
+    if len(saved) > app.config["BATCH_MAX_PORTFOLIOS"]:
+        for _, path in saved:
+            os.remove(path)
+        return jsonify(
+            {
+                "error": f"At most {app.config['BATCH_MAX_PORTFOLIOS']} "
+                "portfolios can be processed per batch"
+            }
+        ), 400
+
+    portfolios = []
+    try:
+        for upload in saved:
+            portfolios.append(
+                queue_portfolio(*upload, allow_short_selling, target_fy, export_format)
+            )
+    finally:
+        # Uploads left unparsed after an unexpected failure
+        for _, path in saved:
+            if os.path.exists(path):
+                os.remove(path)
+
+    counts = {
+        status: sum(portfolio["status"] == status for portfolio in portfolios)
+        for status in ("queued", "invalid", "rejected")
+    }
+    response = {
+        "success": bool(counts["queued"]),
+        "batch_id": batch_id,
+        "portfolios": portfolios,
+        "summary": {"portfolios": len(portfolios), **counts},
+    }
+    if counts["queued"]:
+        return jsonify(response), 202
+    if counts["rejected"]:
+        return jsonify(response), 503, {"Retry-After": "60"}
+    return jsonify(response), 400
+
+
 @app.route("/api/create-payment-intent", methods=["POST"])
 def create_payment_intent():
     """Create a Stripe payment intent"""
@@ -264,7 +669,13 @@ def verify_payment():
         # Verify payment with Stripe
         payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
 
+        # An intent only pays for the session it was created for
+        if getattr(payment_intent.metadata, "session_id", None) != session_id:
+            return jsonify({"error": "Payment is for a different session"}), 400
+
         if payment_intent.status == "succeeded":
+            # Unlocks the session's download, summary and what-if plans
+            session_store.mark_paid(session_id)
             return jsonify(
                 {"success": True, "download_url": f"/api/download/{session_id}"}
             )
@@ -277,25 +688,129 @@ def verify_payment():
 
 @app.route("/api/download/<session_id>")
 def download_file(session_id):
-    """Download the generated Excel file"""
+    """
+    Download the generated Excel file of a paid session, or the zip of CSVs
+    streamed from its results. Both carry an ETag so repeated downloads get
+    304 Not Modified, and Excel files can be resumed with Range requests.
+    """
     session = get_session(session_id)
 
     if not session:
         return jsonify({"error": "File not found or session expired"}), 404
 
+    if not session["paid_at"]:
+        return jsonify({"error": PAYMENT_REQUIRED}), 402
+
+    if session["export_format"] == "csv":
+        results_path = os.path.join(os.getcwd(), session["results_path"])
+        try:
+            stat = os.stat(results_path)
+        except FileNotFoundError:
+            return jsonify({"error": "File not found"}), 404
+        response = Response(
+            iter_results_csv_zip(results_path),
+            mimetype="application/zip",
+            headers={
+                "Content-Disposition": f"attachment; filename={session['excel_filename']}"
+            },
+        )
+        # The zip is generated as it is sent, so its length is unknown and
+        # ranges are not offered, but the same results always zip alike
+        response.set_etag(f"{file_etag(stat)}-csv")
+        response.cache_control.no_cache = True
+        response.cache_control.private = True
+        return response.make_conditional(request)
+
     excel_path = os.path.join(os.getcwd(), session["excel_path"])
 
-    if not os.path.exists(excel_path):
+    try:
+        return send_report(
+            excel_path,
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            download_name=session["excel_filename"],
+            cache=report_cache,
+            offload=app.config["DOWNLOAD_OFFLOAD"],
+            output_folder=os.path.join(os.getcwd(), app.config["OUTPUT_FOLDER"]),
+            accel_prefix=app.config["DOWNLOAD_ACCEL_PREFIX"],
+        )
+    except FileNotFoundError:
         return jsonify({"error": "File not found"}), 404
 
-    return send_file(
-        excel_path,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        as_attachment=True,
-        download_name=session["excel_filename"],
+
+@app.route("/api/summary/<session_id>")
+def get_summary(session_id):
+    """Per financial year totals of a paid session, read from its results file"""
+    session = get_session(session_id)
+
+    if not session or not session["results_path"]:
+        return jsonify({"error": "Summary not found or session expired"}), 404
+
+    if not session["paid_at"]:
+        return jsonify({"error": PAYMENT_REQUIRED}), 402
+
+    results_path = os.path.join(os.getcwd(), session["results_path"])
+
+    if not os.path.exists(results_path):
+        return jsonify({"error": "Summary not found"}), 404
+
+    summary = load_summary(results_path)
+    return jsonify(
+        {
+            "session_id": session_id,
+            "format_version": RESULTS_FORMAT_VERSION,
+            "financial_years": [
+                {"financial_year": fy, **totals} for fy, totals in summary.items()
+            ],
+        }
     )
 
 
+@lru_cache(maxsize=32)
+def load_planner(plan_path):
+    """Planners of recent sessions stay loaded so repeated what-ifs skip the disk"""
+    return SellPlanner.load(plan_path)
+
+
+@app.route("/api/plan", methods=["POST"])
+def plan_sell():
+    """
+    Taxable capital gain of a paid session if some units of a symbol were sold
+    on a given date
+    """
+    data = request.json or {}
+    session = get_session(data.get("session_id", ""))
+
+    if not session or not session["plan_path"]:
+        return jsonify({"error": "Session not found or expired"}), 404
+
+    if not session["paid_at"]:
+        return jsonify({"error": PAYMENT_REQUIRED}), 402
+
+    plan_path = os.path.join(os.getcwd(), session["plan_path"])
+
+    if not os.path.exists(plan_path):
+        return jsonify({"error": "Session not found or expired"}), 404
+
+    try:
+        symbol = str(data["symbol"]).split(".")[0].upper()
+        quantity = float(data["quantity"])
+        sell_date = datetime.strptime(data["sell_date"], "%Y-%m-%d")
+        unit_price = float(data["unit_price"])
+    except (KeyError, TypeError, ValueError):
+        return jsonify(
+            {
+                "error": "symbol, quantity, sell_date (YYYY-MM-DD) and unit_price are required"
+            }
+        ), 400
+
+    try:
+        plan = load_planner(plan_path).plan(symbol, quantity, sell_date, unit_price)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"success": True, **plan})
+
+
 @app.route("/api/config")
 def get_config():
     """Get Stripe publishable key for frontend"""
@@ -307,8 +822,7 @@ def health_check():
     """Health check endpoint"""
     try:
         # Check database connection
-        with get_db() as conn:
-            conn.execute("SELECT 1")
+        session_store.ping()
         return jsonify({"status": "healthy", "database": "connected"}), 200
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
@@ -318,11 +832,17 @@ def health_check():
 def manual_cleanup():
     """Manually trigger cleanup (for admin use)"""
     try:
-        cleanup_old_sessions()
-        return jsonify({"success": True, "message": "Cleanup completed"}), 200
+        metrics = cleanup_old_sessions()
+        if metrics is None:
+            return jsonify(
+                {"success": True, "message": "Cleanup is being run by another worker"}
+            ), 200
+        return jsonify(
+            {"success": True, "message": "Cleanup completed", "metrics": metrics}
+        ), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
+    create_app().run(debug=True, port=5000)
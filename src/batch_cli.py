@@ -0,0 +1,285 @@
+"""
+Batch command line entry point for processing many trade histories at once.
+
+Run from the src directory, e.g.:
+    python batch_cli.py clients/ "archive/**/*.xlsx" --output-dir reports --workers 4
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import glob
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import sys
+import time
+
+from cgt_calculator import CGTCalculator, RunContext
+from lp_solver import SOLVER_METHODS, summarise_solve_log
+from market_data_api import set_market_data_state, shared_market_data_state
+from output_excel_writer import export_capital_gains_to_excel
+
+TRADE_HISTORY_EXTENSIONS = (".csv", ".xlsx", ".xls", ".csv.gz", ".zip")
+
+
+def find_trade_histories(inputs):
+    """Expand directories and glob patterns into a sorted list of trade history files"""
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+
+        for candidate in candidates:
+            if os.path.isfile(candidate) and candidate.lower().endswith(
+                TRADE_HISTORY_EXTENSIONS
+            ):
+                paths.add(os.path.abspath(candidate))
+
+    return sorted(paths)
+
+
+def _stem(path):
+    """File name without its trade history extension, e.g. trades for trades.csv.gz"""
+    name = os.path.basename(path)
+    for extension in TRADE_HISTORY_EXTENSIONS:
+        if name.lower().endswith(extension):
+            return name[: -len(extension)]
+    return Path(path).stem
+
+
+def assign_report_paths(trade_history_paths, output_dir):
+    """Map each input to a report path, keeping names unique when file stems collide"""
+    report_paths = {}
+    used_names = set()
+    for path in trade_history_paths:
+        stem = _stem(path)
+        name = f"{stem}_cgt_report.xlsx"
+        suffix = 1
+        while name in used_names:
+            suffix += 1
+            name = f"{stem}_{suffix}_cgt_report.xlsx"
+        used_names.add(name)
+        report_paths[path] = os.path.join(output_dir, name)
+
+    return report_paths
+
+
+def process_trade_history(
+    trade_history_path,
+    report_path,
+    allow_short_selling=False,
+    target_fy=None,
+    solver_options=None,
+):
+    """Calculate and export a single trade history, returning a record for the run summary"""
+    record = dict(file=trade_history_path, report=None, status="failed", error=None)
+    timings = {}
+    started = time.perf_counter()
+    try:
+        calculator = CGTCalculator(trade_history_path)
+        timings["parse_seconds"] = time.perf_counter() - started
+
+        stage_start = time.perf_counter()
+        context = RunContext()
+        try:
+            results_per_fy = calculator.execute(
+                allow_short_selling,
+                target_fy=target_fy,
+                solver_options=solver_options,
+                context=context,
+            )
+        finally:
+            timings["solve_seconds"] = time.perf_counter() - stage_start
+            record["solver"] = summarise_solve_log(context.solve_log)
+
+        stage_start = time.perf_counter()
+        export_capital_gains_to_excel(
+            results_per_fy,
+            report_path,
+            [target_fy] if target_fy in results_per_fy else None,
+        )
+        timings["export_seconds"] = time.perf_counter() - stage_start
+
+        record.update(
+            report=report_path,
+            status="ok",
+            financial_years=[int(fy) for fy in results_per_fy.keys()],
+        )
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+
+    timings["total_seconds"] = time.perf_counter() - started
+    record["timings"] = timings
+    return record
+
+
+def run_batch(
+    trade_history_paths,
+    output_dir,
+    workers=None,
+    allow_short_selling=False,
+    target_fy=None,
+    solver_options=None,
+    require_splits=False,
+):
+    """
+    Process trade histories across a bounded process pool.
+    All workers share one split cache and Alpha Vantage rate limit, so each symbol
+    is looked up at most once per run and requests never exceed the configured rate.
+    With require_splits, a file with a symbol whose splits stay rate limited fails
+    rather than being calculated without them.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    report_paths = assign_report_paths(trade_history_paths, output_dir)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(trade_history_paths) or 1))
+
+    started_at = datetime.now()
+    started = time.perf_counter()
+    records = []
+    with multiprocessing.Manager() as manager:
+        market_data_state = shared_market_data_state(manager)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=set_market_data_state,
+            initargs=(market_data_state, require_splits),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    process_trade_history,
+                    path,
+                    report_paths[path],
+                    allow_short_selling,
+                    target_fy,
+                    solver_options,
+                ): path
+                for path in trade_history_paths
+            }
+            for future in as_completed(futures):
+                record = future.result()
+                print(
+                    f"[{record['status']}] {record['file']} "
+                    f"({record['timings']['total_seconds']:.2f}s)"
+                )
+                records.append(record)
+
+        cached_symbols = len(market_data_state[0])
+
+    records.sort(key=lambda record: record["file"])
+    failed = [record for record in records if record["status"] != "ok"]
+    return dict(
+        started_at=started_at.isoformat(),
+        wall_seconds=time.perf_counter() - started,
+        workers=workers,
+        files_processed=len(records),
+        succeeded=len(records) - len(failed),
+        failed=len(failed),
+        cached_split_symbols=cached_symbols,
+        files=records,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Calculate CGT reports for many trade history files in parallel."
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="Directories or glob patterns of .csv, .xlsx, .xls, .csv.gz or .zip "
+        "trade histories",
+    )
+    parser.add_argument(
+        "--output-dir", default="reports", help="Directory to write reports into"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Maximum number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--allow-short-selling",
+        action="store_true",
+        help="Calculate short sold symbols instead of failing the file",
+    )
+    parser.add_argument(
+        "--target-fy",
+        type=int,
+        default=None,
+        help="Only calculate up to and report this financial year, e.g. 2025",
+    )
+    parser.add_argument(
+        "--solver-method",
+        choices=SOLVER_METHODS,
+        default="highs",
+        help="HiGHS variant used for every LP (default: highs chooses)",
+    )
+    parser.add_argument(
+        "--no-presolve", action="store_true", help="Turn off the HiGHS presolve"
+    )
+    parser.add_argument(
+        "--no-decompose",
+        action="store_true",
+        help="Solve each symbol year as one LP rather than its independent parts",
+    )
+    parser.add_argument(
+        "--time-limit",
+        type=float,
+        default=None,
+        help="Seconds allowed per LP solve before the file fails",
+    )
+    parser.add_argument(
+        "--require-splits",
+        action="store_true",
+        help="Fail files whose stock splits cannot be looked up because of the "
+        "Alpha Vantage rate limit, rather than calculating them without splits",
+    )
+    parser.add_argument(
+        "--summary",
+        default=None,
+        help="Path of the JSON run summary (default: <output-dir>/run_summary.json)",
+    )
+    args = parser.parse_args(argv)
+
+    trade_history_paths = find_trade_histories(args.inputs)
+    if not trade_history_paths:
+        print("No trade history files found")
+        return 1
+
+    solver_options = dict(method=args.solver_method)
+    if args.no_presolve:
+        solver_options["presolve"] = False
+    if args.no_decompose:
+        solver_options["decompose"] = False
+    if args.time_limit is not None:
+        solver_options["time_limit"] = args.time_limit
+
+    summary = run_batch(
+        trade_history_paths,
+        args.output_dir,
+        args.workers,
+        args.allow_short_selling,
+        args.target_fy,
+        solver_options,
+        args.require_splits,
+    )
+
+    summary_path = args.summary or os.path.join(args.output_dir, "run_summary.json")
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(
+        f"Processed {summary['files_processed']} file(s) in "
+        f"{summary['wall_seconds']:.2f}s with {summary['workers']} worker(s): "
+        f"{summary['succeeded']} succeeded, {summary['failed']} failed. "
+        f"Summary written to '{summary_path}'"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Compare solving a symbol year as one LP against solving its independent parts.
+
+Builds the model of an active trader who goes in and out of one symbol many
+times in a year, then solves it whole, decomposed, and decomposed on threads,
+printing solve time, LP sizes and whether the optimal gains agree. Run from the
+src directory:
+    python -m benchmarks.bench_decomposition --round-trips 50
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from fixed_point import to_units
+from lp_solver import build_symbol_year_model, solve_symbol_year_model
+
+SETTINGS = {
+    "one LP": dict(decompose=False),
+    "decomposed": None,
+    "decomposed, 4 threads": dict(workers=4),
+}
+
+
+def synthetic_model(round_trips, trades_per_trip, seed=0):
+    """Buys and sells of round trips which each end flat, within one year"""
+    rng = np.random.default_rng(seed)
+    buys, sells = [], []
+    trade_date = pd.Timestamp("2023-07-01")
+    price = 50.0
+    for _ in range(round_trips):
+        held = 0
+        for _ in range(trades_per_trip):
+            trade_date += pd.Timedelta(hours=rng.integers(1, 24))
+            price *= rng.uniform(0.97, 1.03)
+            if held and rng.random() < 0.4:
+                quantity = int(rng.integers(1, held + 1))
+                held -= quantity
+                sells.append([len(buys) + len(sells), trade_date, quantity, price])
+            else:
+                quantity = int(rng.integers(1, 100))
+                held += quantity
+                buys.append([len(buys) + len(sells), trade_date, quantity, price])
+        if held:
+            trade_date += pd.Timedelta(hours=1)
+            sells.append([len(buys) + len(sells), trade_date, held, price])
+
+    buys = pd.DataFrame(buys, columns=["id", "trade_date", "qty_avail", "unit_price"])
+    sells = pd.DataFrame(sells, columns=["id", "trade_date", "quantity", "unit_price"])
+    buys["qty_avail"] = to_units(buys["qty_avail"])
+    sells["quantity"] = to_units(sells["quantity"])
+    return build_symbol_year_model(buys, sells)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--round-trips", type=int, default=50)
+    parser.add_argument("--trades-per-trip", type=int, default=10)
+    args = parser.parse_args()
+
+    model = synthetic_model(args.round_trips, args.trades_per_trip)
+    print(
+        f"{len(model.buys)} buys, {len(model.sells)} sells, {len(model.gain)} matches\n"
+        f"  {'':<24}{'ms':>9}{'LPs':>6}{'columns':>10}{'largest':>9}"
+    )
+
+    baseline = None
+    for name, solver_options in SETTINGS.items():
+        started = time.perf_counter()
+        result = solve_symbol_year_model(model, "SYM", solver_options)
+        elapsed = time.perf_counter() - started
+        diagnostics = result["diagnostics"]
+        taxable = result["short_term"] + 0.5 * result["long_term"]
+        baseline = taxable if baseline is None else baseline
+        print(
+            f"  {name:<24}{elapsed * 1000:>9.1f}{diagnostics['components']:>6}"
+            f"{diagnostics['columns']:>10}{diagnostics['largest_component_columns']:>9}"
+            f"  {'same' if math.isclose(taxable, baseline, rel_tol=1e-9, abs_tol=1e-6) else 'DIFFERENT'} optimum"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark time and peak memory of reading a large CSV trade history.
+
+Reads the same file with different chunk sizes. A chunk as large as the file
+matches reading it whole, smaller chunks bound the peak to the chunk size plus
+the compact normalised trades. Run from the src directory:
+    python -m benchmarks.bench_ingestion --rows 500000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from cgt_calculator import CGTCalculator
+
+
+class IngestOnlyCalculator(CGTCalculator):
+    """Parse and normalise only, without looking up market data"""
+
+    def __init__(self, trade_history_csv_path, csv_chunk_rows):
+        self.csv_chunk_rows = csv_chunk_rows
+        self._initialise_trades_df(
+            self._parse_trade_history_file(trade_history_csv_path)
+        )
+
+
+def write_synthetic_history(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    quantity = rng.integers(1, 5000, rows)
+    pd.DataFrame(
+        {
+            "trade_date": pd.Series(
+                pd.Timestamp("2010-07-01")
+                + pd.to_timedelta(rng.integers(0, 5000, rows), unit="D")
+            ).dt.strftime("%d/%m/%Y"),
+            "Confirmation No.": rng.integers(10_000_000, 99_999_999, rows),
+            "symbol": np.char.add(
+                np.char.add("SYM", rng.integers(0, 2000, rows).astype(str)), ".ASX"
+            ),
+            "quantity": quantity,
+            "side": rng.choice(["Buy", "Sell"], rows),
+            "Avg. price": rng.uniform(0.5, 200, rows).round(3),
+            "Fees": 19.95,
+            "transaction_amount": np.char.add(
+                "$", (quantity * rng.uniform(0.5, 200, rows)).round(2).astype(str)
+            ),
+        }
+    ).to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument(
+        "--chunk-rows", type=int, nargs="+", default=[10_000, 50_000, 200_000]
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.csv")
+        write_synthetic_history(path, args.rows)
+        print(
+            f"{args.rows:,} rows, {os.path.getsize(path) / 2**20:.1f} MB on disk\n"
+            f"  {'chunk rows':>12}{'seconds':>10}{'peak MB':>10}{'result MB':>11}"
+        )
+
+        for chunk_rows in [args.rows, *args.chunk_rows]:
+            tracemalloc.start()
+            started = time.perf_counter()
+            trades_df = IngestOnlyCalculator(path, chunk_rows).trades_df
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"  {chunk_rows:>12,}{elapsed:>10.2f}{peak / 2**20:>10.1f}"
+                f"{trades_df.memory_usage(deep=True).sum() / 2**20:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
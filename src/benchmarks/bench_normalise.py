@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of trade normalisation on a 100k row history.
+
+Compares CGTCalculator._normalise_trades with the previous per row
+implementation (apply for the FY, list comprehensions for symbols and ids,
+string round trip for amounts) and checks both give the same trades once the
+legacy float quantities and amounts are converted to units and cents.
+Run from the src directory:
+    python -m benchmarks.bench_normalise --rows 100000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from cgt_calculator import CGTCalculator
+from fixed_point import to_cents, to_units
+
+
+def synthetic_trades(rows, numeric_amounts, seed=0):
+    rng = np.random.default_rng(seed)
+    quantity = rng.integers(1, 5000, rows).astype(float)
+    amount = (quantity * rng.uniform(0.5, 200, rows)).round(2)
+    return pd.DataFrame(
+        {
+            "Symbol": np.char.add(
+                np.char.add("SYM", rng.integers(0, 2000, rows).astype(str)), ".ASX"
+            ),
+            "Side": rng.choice(["Buy", "Sell"], rows),
+            "Trade_Date": pd.Series(
+                pd.Timestamp("2010-07-01")
+                + pd.to_timedelta(rng.integers(0, 5000, rows), unit="D")
+            ).dt.strftime("%d/%m/%Y"),
+            "Quantity": quantity,
+            "Transaction_Amount": amount
+            if numeric_amounts
+            else np.char.add("$", amount.astype(str)),
+        }
+    )
+
+
+def legacy_normalise(trades_df):
+    trades_df = trades_df.copy()
+    trades_df.columns = [c.strip().lower() for c in trades_df.columns]
+    trades_df["side"] = trades_df["side"].astype(str).str.upper()
+    trades_df["symbol"] = [str(s).split(".")[0].upper() for s in trades_df["symbol"]]
+    trades_df["trade_date"] = pd.to_datetime(trades_df["trade_date"], dayfirst=True)
+    trades_df["quantity"] = trades_df["quantity"].astype(float).abs()
+    trades_df["transaction_amount"] = (
+        trades_df["transaction_amount"].astype(str).str.replace("$", "", regex=False)
+    )
+    trades_df["transaction_amount"] = trades_df["transaction_amount"].astype(float).abs()
+    trades_df["fy"] = (
+        trades_df["trade_date"]
+        .apply(lambda d: d.year + 1 if d.month >= 7 else d.year)
+        .astype(int)
+    )
+    trades_df["id"] = [i for i in range(len(trades_df["trade_date"]))]
+    return trades_df
+
+
+def best_of(repeats, func, *args):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    calculator = CGTCalculator.__new__(CGTCalculator)
+    for numeric_amounts in (False, True):
+        trades_df = synthetic_trades(args.rows, numeric_amounts)
+        label = "numeric amounts" if numeric_amounts else "'$' string amounts"
+
+        legacy, legacy_seconds = best_of(args.repeats, legacy_normalise, trades_df)
+        vectorised, vectorised_seconds = best_of(
+            args.repeats, lambda df: calculator._normalise_trades(df.copy(), 0), trades_df
+        )
+
+        # The legacy implementation kept float shares and dollars
+        legacy = legacy.assign(
+            quantity=to_units(legacy["quantity"]),
+            transaction_amount=to_cents(legacy["transaction_amount"]),
+        )
+        columns = ["symbol", "side", "trade_date", "quantity", "transaction_amount", "fy", "id"]
+        assert legacy[columns].astype(str).equals(vectorised[columns].astype(str))
+        print(
+            f"{args.rows:,} rows with {label}: legacy {legacy_seconds * 1000:.1f} ms, "
+            f"vectorised {vectorised_seconds * 1000:.1f} ms "
+            f"({legacy_seconds / vectorised_seconds:.1f}x faster)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Benchmark the CommSec and NabTrade parsers on large multi-account exports.
+
+Compares the vectorised transforms in CGTCalculator with the previous
+merge / per code change implementations, checking both give the same trades.
+Run from the src directory:
+    python -m benchmarks.bench_parsers --rows 200000 --accounts 4
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from cgt_calculator import CGTCalculator
+
+
+def synthetic_commsec_export(rows, accounts, seed=0):
+    """
+    Several CommSec account exports combined into one frame. Each account numbers
+    its references independently, so references repeat across accounts.
+    """
+    rng = np.random.default_rng(seed)
+    rows_per_account = rows // accounts
+    frames = []
+    for _ in range(accounts):
+        n = rows_per_account
+        is_trade = rng.random(n) < 0.7
+        side = rng.choice(["B", "S"], n)
+        quantity = rng.integers(1, 5000, n)
+        symbol = np.char.add("SYM", rng.integers(0, 500, n).astype(str))
+        price = rng.uniform(0.5, 200, n).round(4)
+        details = np.where(
+            is_trade,
+            pd.Series(side).str.cat(
+                [pd.Series(quantity.astype(str)), pd.Series(symbol)], sep=" "
+            )
+            + " @ "
+            + pd.Series(price.astype(str)),
+            "Direct Credit 123456 DIVIDEND",
+        )
+        amount = (quantity * price).round(2)
+        frames.append(
+            pd.DataFrame(
+                {
+                    "Date": pd.Series(
+                        pd.Timestamp("2015-07-01")
+                        + pd.to_timedelta(rng.integers(0, 3650, n), unit="D")
+                    ).dt.strftime("%d/%m/%Y"),
+                    "Reference": np.char.add("C", np.arange(n).astype(str)),
+                    "Details": details,
+                    "Debit($)": np.where(side == "B", amount, np.nan),
+                    "Credit($)": np.where(side == "S", amount, np.nan),
+                    "Balance($)": rng.uniform(0, 1e5, n).round(2),
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def synthetic_nabtrade_sheet(rows, code_changes, seed=0):
+    rng = np.random.default_rng(seed)
+    movement_type = rng.choice(
+        ["BUY", "SELL", "DIVIDEND", "TRANSFER"], rows, p=[0.45, 0.35, 0.15, 0.05]
+    ).astype(object)
+    code = np.char.add("C", rng.integers(0, 300, rows).astype(str)).astype(object)
+    # CHANGE_SECURITY_CODE movements come as (old code, new code) row pairs
+    change_rows = rng.choice(np.arange(1, rows // 2), code_changes, replace=False) * 2
+    for i, row in enumerate(sorted(change_rows)):
+        movement_type[row - 1] = movement_type[row] = "CHANGE_SECURITY_CODE"
+        code[row] = f"N{i}"
+    quantity = rng.integers(1, 5000, rows)
+    return pd.DataFrame(
+        {
+            "Movement Type": movement_type,
+            "Code": code,
+            "Date": pd.Series(
+                pd.Timestamp("2015-07-01")
+                + pd.to_timedelta(rng.integers(0, 3650, rows), unit="D")
+            ).dt.strftime("%d/%m/%Y"),
+            "Quantity": quantity,
+            "Settlement Amount (AUD)": (quantity * rng.uniform(0.5, 200, rows)).round(2),
+            "Brokerage": rng.uniform(0, 30, rows).round(2),
+            "Narrative": "Settlement",
+        }
+    )
+
+
+def legacy_commsec_transform(trades_df):
+    new_columns = trades_df["Details"].str.split(" ", expand=True, n=3)
+    new_columns["Reference"] = trades_df["Reference"]
+    new_columns.columns = ["side", "quantity", "symbol", "at_price", "Reference"]
+    new_columns["side"] = new_columns["side"].replace({"B": "BUY", "S": "SELL"})
+    new_columns = new_columns[new_columns["side"].isin(["BUY", "SELL"])]
+    trades_df = pd.merge(new_columns, trades_df, on="Reference", how="left")
+    trades_df["transaction_amount"] = trades_df["Debit($)"].where(
+        trades_df["Debit($)"].notna(), trades_df["Credit($)"]
+    )
+    trades_df = trades_df.rename(columns={"Date": "trade_date"})
+    return trades_df[["side", "symbol", "trade_date", "quantity", "transaction_amount"]]
+
+
+def legacy_nabtrade_transform(df):
+    df = df.copy()
+    df["Movement Type"] = df["Movement Type"].astype(str)
+    df["Code"] = df["Code"].astype(str)
+    ticker_change_idx = df.index[df["Movement Type"] == "CHANGE_SECURITY_CODE"].tolist()
+    i = 1
+    while i <= len(ticker_change_idx):
+        row_index = ticker_change_idx[i]
+        df["Code"] = df["Code"].replace(
+            {df.loc[row_index - 1, "Code"]: df.loc[row_index, "Code"]}
+        )
+        i += 2
+    df = df[(df["Movement Type"] == "BUY") | (df["Movement Type"] == "SELL")]
+    df = df.rename(
+        columns={
+            "Movement Type": "side",
+            "Code": "symbol",
+            "Date": "trade_date",
+            "Quantity": "quantity",
+            "Settlement Amount (AUD)": "transaction_amount",
+        }
+    )
+    return df[["side", "symbol", "trade_date", "quantity", "transaction_amount"]]
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def report(name, elapsed, peak, rows_out):
+    print(
+        f"  {name:<12}{elapsed * 1000:>10.1f} ms{peak / 2**20:>10.1f} MB peak"
+        f"{rows_out:>12,} trades"
+    )
+
+
+def same_trades(a, b):
+    a = a.reset_index(drop=True).astype(str)
+    b = b.reset_index(drop=True).astype(str)
+    return a.equals(b)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--code-changes", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"CommSec: {args.rows:,} rows across {args.accounts} accounts")
+    commsec_df = synthetic_commsec_export(args.rows, args.accounts)
+    vectorised, elapsed, peak = measure(
+        CGTCalculator._transform_commsec_history, commsec_df
+    )
+    report("vectorised", elapsed, peak, len(vectorised))
+    # The legacy merge multiplies rows whenever references repeat across accounts
+    legacy, elapsed, peak = measure(legacy_commsec_transform, commsec_df)
+    report("legacy", elapsed, peak, len(legacy))
+
+    single_account = commsec_df.iloc[: args.rows // args.accounts]
+    assert same_trades(
+        CGTCalculator._transform_commsec_history(single_account),
+        legacy_commsec_transform(single_account),
+    ), "CommSec transforms disagree on an export with unique references"
+
+    print(
+        f"\nNabTrade: 2 sheets of {args.rows // 2:,} rows "
+        f"with {args.code_changes} code changes each"
+    )
+    sheets = [
+        synthetic_nabtrade_sheet(args.rows // 2, args.code_changes, seed)
+        for seed in range(2)
+    ]
+
+    def vectorised_nabtrade(sheets):
+        return pd.concat(
+            [CGTCalculator._transform_nabtrade_sheet(df) for df in sheets],
+            ignore_index=True,
+        )
+
+    def legacy_nabtrade(sheets):
+        trades_df = pd.DataFrame()
+        for df in sheets:
+            trades_df = pd.concat(
+                [trades_df, legacy_nabtrade_transform(df)], ignore_index=True
+            )
+        return trades_df
+
+    vectorised, elapsed, peak = measure(vectorised_nabtrade, sheets)
+    report("vectorised", elapsed, peak, len(vectorised))
+    legacy, elapsed, peak = measure(legacy_nabtrade, sheets)
+    report("legacy", elapsed, peak, len(legacy))
+    assert same_trades(vectorised, legacy), "NabTrade transforms disagree"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Benchmark session store latency under concurrent load.
+
+Compares the pooled WAL SessionStore against opening a fresh connection per call
+on a default rollback journal database, which is what the app previously did.
+Run from the src directory:
+    python -m benchmarks.bench_session_store --threads 16 --operations 500
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+
+from session_store import SessionStore
+
+
+class ConnectPerCallStore:
+    """The previous access pattern: a new connection for every helper call"""
+
+    def __init__(self, database):
+        self.database = database
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                excel_path TEXT NOT NULL,
+                excel_filename TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+    def store(self, session_id, excel_path, excel_filename):
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO sessions VALUES (?, ?, ?, ?)",
+            (session_id, excel_path, excel_filename, datetime.now()),
+        )
+        conn.commit()
+        conn.close()
+
+    def get(self, session_id):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT * FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def exists(self, session_id):
+        conn = self._connect()
+        count = conn.execute(
+            "SELECT COUNT(*) FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+        conn.close()
+        return count > 0
+
+    def expired(self, cutoff_time):
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT session_id, excel_path FROM sessions WHERE created_at < ?",
+            (cutoff_time,),
+        ).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+
+def run_workload(store, threads, operations, prefill):
+    """
+    Each thread mixes the request pattern of the app: one insert (upload)
+    followed by existence checks (payment) and reads (download).
+    """
+    known_ids = [str(uuid.uuid4()) for _ in range(prefill)]
+    for session_id in known_ids:
+        store.store(session_id, f"outputs/{session_id}.xlsx", f"{session_id}.xlsx")
+
+    latencies = {"store": [], "exists": [], "get": [], "expired": []}
+    lock = threading.Lock()
+
+    def worker(worker_index):
+        local = {name: [] for name in latencies}
+        for i in range(operations):
+            session_id = str(uuid.uuid4())
+            started = time.perf_counter()
+            store.store(session_id, f"outputs/{session_id}.xlsx", f"{session_id}.xlsx")
+            local["store"].append(time.perf_counter() - started)
+
+            for _ in range(2):
+                started = time.perf_counter()
+                store.exists(known_ids[(worker_index + i) % len(known_ids)])
+                local["exists"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            store.get(session_id)
+            local["get"].append(time.perf_counter() - started)
+
+            if i % 50 == 0:
+                started = time.perf_counter()
+                store.expired(datetime.now() - timedelta(hours=24))
+                local["expired"].append(time.perf_counter() - started)
+
+        with lock:
+            for name, values in local.items():
+                latencies[name].extend(values)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+
+    return elapsed, latencies
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(name, elapsed, latencies):
+    total_ops = sum(len(values) for values in latencies.values())
+    print(f"\n{name}: {total_ops} operations in {elapsed:.2f}s "
+          f"({total_ops / elapsed:,.0f} ops/s)")
+    print(f"  {'operation':<10}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for operation, values in latencies.items():
+        if not values:
+            continue
+        print(
+            f"  {operation:<10}{len(values):>8}"
+            f"{statistics.mean(values) * 1000:>10.3f}"
+            f"{percentile(values, 0.5) * 1000:>10.3f}"
+            f"{percentile(values, 0.99) * 1000:>10.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--operations", type=int, default=300)
+    parser.add_argument("--prefill", type=int, default=10_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = [
+            ("connect per call", ConnectPerCallStore(os.path.join(tmp, "baseline.db"))),
+            ("SessionStore (pooled, WAL)", SessionStore(os.path.join(tmp, "pooled.db"))),
+        ]
+        for name, store in stores:
+            store.init_schema()
+            elapsed, latencies = run_workload(
+                store, args.threads, args.operations, args.prefill
+            )
+            report(name, elapsed, latencies)
+
+
+if __name__ == "__main__":
+    main()
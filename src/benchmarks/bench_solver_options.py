@@ -0,0 +1,69 @@
+"""
+Compare HiGHS solver settings on a trade history.
+
+Solves every symbol and year of the history under each setting, printing total
+solve time and iterations, the slowest solves, and whether the results match
+the default setting. Splits and ticker changes are not looked up. Run from the
+src directory:
+    python -m benchmarks.bench_solver_options path/to/trade_history.csv
+"""
+
+import argparse
+import math
+from pathlib import Path
+
+from benchmarks.bench_ingestion import IngestOnlyCalculator
+from cgt_calculator import CGTCalculator, RunContext
+from lp_solver import summarise_solve_log
+
+SETTINGS = {
+    "default": None,
+    "dual simplex": dict(method="highs-ds"),
+    "dual simplex, no presolve": dict(method="highs-ds", presolve=False),
+    "interior point": dict(method="highs-ipm"),
+    "interior point, no presolve": dict(method="highs-ipm", presolve=False),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "trade_history",
+        nargs="?",
+        default=str(Path(__file__).parent.parent / "test" / "trade_history_test.csv"),
+    )
+    parser.add_argument("--slowest", type=int, default=3)
+    args = parser.parse_args()
+
+    baseline = None
+    for name, solver_options in SETTINGS.items():
+        calculator = IngestOnlyCalculator(args.trade_history, CGTCalculator.csv_chunk_rows)
+        context = RunContext()
+        results_per_fy = calculator.execute(
+            allow_short_selling=True, solver_options=solver_options, context=context
+        )
+        taxable = {
+            fy: results_per_fy[fy]["taxable_capital_gain"] for fy in results_per_fy
+        }
+        baseline = baseline or taxable
+        same = taxable.keys() == baseline.keys() and all(
+            math.isclose(taxable[fy], baseline[fy], rel_tol=1e-9, abs_tol=1e-6)
+            for fy in taxable
+        )
+        summary = summarise_solve_log(context.solve_log, args.slowest)
+
+        print(
+            f"{name:<28}{summary['solves']:>5} solves{summary['solve_seconds'] * 1000:>9.1f} ms"
+            f"{summary['iterations']:>7} iterations  "
+            f"{'same results' if same else 'DIFFERENT results'}"
+        )
+        for entry in summary["slowest"]:
+            print(
+                f"    FY{entry['fy']} {entry['symbol']:<8}{entry['solve_seconds'] * 1000:>7.1f} ms"
+                f"{entry['iterations']:>5} it  {entry['rows']}x{entry['columns']}, "
+                f"{entry['nonzeros']} nonzeros"
+            )
+
+
+if __name__ == "__main__":
+    main()
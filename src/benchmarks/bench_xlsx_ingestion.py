@@ -0,0 +1,108 @@
+"""
+Benchmark time and peak memory of reading a large multi-year NabTrade export.
+
+Compares reading the whole first sheet and then the two movement sheets with
+pd.read_excel, as before, with streaming only the used columns of the movement
+sheets with openpyxl, checking both give the same trades. Run from the src directory:
+    python -m benchmarks.bench_xlsx_ingestion --rows 100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+import xlsxwriter
+
+from benchmarks.bench_parsers import synthetic_nabtrade_sheet
+from cgt_calculator import CGTCalculator
+
+
+def write_synthetic_nabtrade_export(path, rows, code_changes, seed=0):
+    """
+    A NabTrade workbook, with its account and holdings sheets ahead of two
+    movement sheets of rows // 2 movements each, every sheet under a title row
+    """
+    workbook = xlsxwriter.Workbook(path)
+    date_format = workbook.add_format({"num_format": "dd/mm/yyyy"})
+
+    def add_sheet(df):
+        sheet = workbook.add_worksheet()
+        sheet.write_row(0, 0, ["Transaction history"])
+        sheet.write_row(1, 0, list(df.columns))
+        for i, row in enumerate(df.itertuples(index=False), start=2):
+            for j, value in enumerate(row):
+                if isinstance(value, pd.Timestamp):
+                    sheet.write_datetime(i, j, value.to_pydatetime(), date_format)
+                else:
+                    sheet.write(i, j, value)
+
+    accounts = pd.DataFrame(
+        {"Account Name": ["NABTRADE SHARE TRADING"] * 10, "Balance": range(10)}
+    )
+    for _ in range(3):
+        add_sheet(accounts)
+    for sheet_seed in range(seed, seed + 2):
+        movements = synthetic_nabtrade_sheet(rows // 2, code_changes, sheet_seed)
+        movements["Date"] = pd.to_datetime(movements["Date"], dayfirst=True)
+        add_sheet(movements)
+    workbook.close()
+
+
+class LegacyXlsxCalculator(CGTCalculator):
+    """Reads workbooks with pd.read_excel, as before streaming"""
+
+    def _parse_trade_history_file(self, trade_history_path):
+        trades_df = pd.read_excel(trade_history_path, sheet_name=0, skiprows=1)
+        if "Account Name" in trades_df.columns:
+            col_upper = trades_df["Account Name"].dropna().astype(str).str.upper()
+            if col_upper.str.contains("NABTRADE", regex=False).any():
+                trades_df = self._parse_nabtrade_history_file(trade_history_path)
+        yield trades_df.dropna(axis=0)
+
+
+def measure(calculator_class, path):
+    started = time.perf_counter()
+    calculator = calculator_class(path, handle_market_data=False)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    calculator_class(path, handle_market_data=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return calculator.trades_df, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--code-changes", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "nabtrade.xlsx")
+        write_synthetic_nabtrade_export(path, args.rows, args.code_changes)
+        print(
+            f"NabTrade export: {args.rows:,} movements over 2 sheets, "
+            f"{os.path.getsize(path) / 2**20:.1f} MB"
+        )
+
+        results = {}
+        for name, calculator_class in [
+            ("read_excel", LegacyXlsxCalculator),
+            ("streamed", CGTCalculator),
+        ]:
+            trades_df, elapsed, peak = measure(calculator_class, path)
+            results[name] = trades_df
+            print(
+                f"  {name:<12}{elapsed * 1000:>10.1f} ms{peak / 2**20:>10.1f} MB peak"
+                f"{len(trades_df):>12,} trades"
+            )
+
+        pd.testing.assert_frame_equal(results["streamed"], results["read_excel"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+A pool of calculation processes kept apart from the web workers.
+
+Processes are forked from a forkserver which has already imported pandas,
+scipy with HiGHS and the calculator's modules, including the ticker change
+data, so a new process starts warm. A process retires after max_jobs jobs, or
+once its resident memory passes max_rss_mb as it fragments after large LPs, and
+a fresh one is forked in its place. Jobs run under an address space limit of
+memory_limit_mb, so one huge upload fails with a MemoryError instead of taking
+the dyno down.
+
+As with any multiprocessing pool, scripts using it must guard their entry point
+with `if __name__ == "__main__"`, as new processes import the main module.
+"""
+
+from collections import deque
+from concurrent.futures import Future
+import itertools
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import pickle
+import resource
+import threading
+
+
+class CalculationCrashed(Exception):
+    """The process running a job exited before finishing it"""
+
+
+PRELOAD_MODULES = [
+    "numpy",
+    "pandas",
+    "scipy.optimize",
+    "scipy.sparse.csgraph",
+    "openpyxl",
+    "cgt_calculator",
+    "lp_solver",
+    "market_data_api",
+    "reports",
+]
+
+
+def _rss_mb():
+    """Resident memory of this process, or its peak where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _worker(connection, max_jobs, max_rss_mb, memory_limit_mb):
+    if memory_limit_mb:
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_mb * 2**20, hard_limit))
+
+    for jobs_done in itertools.count(1):
+        try:
+            function, args = connection.recv()
+        except EOFError:
+            return  # the pool shut down
+        try:
+            outcome = (True, function(*args))
+        except Exception as e:
+            outcome = (False, e)
+        try:
+            payload = pickle.dumps(outcome)
+        except Exception as e:
+            payload = pickle.dumps((False, RuntimeError(f"Unpicklable job outcome: {e}")))
+
+        retiring = (
+            jobs_done >= max_jobs
+            or (max_rss_mb is not None and _rss_mb() > max_rss_mb)
+            or isinstance(outcome[1], MemoryError)
+        )
+        connection.send((retiring, payload))
+        if retiring:
+            return
+
+
+class _Worker:
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.future = None  # of the job it is running
+
+
+class CalculationPool:
+    """
+    Runs functions in pre-forked processes, returning a Future for each.
+    Functions and their arguments are pickled, so functions must be importable.
+    Processes are only started on the first submit.
+    """
+
+    def __init__(
+        self,
+        processes=2,
+        max_jobs=50,
+        max_rss_mb=1024,
+        memory_limit_mb=2048,
+        preload=PRELOAD_MODULES,
+    ):
+        self.processes = processes
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.memory_limit_mb = memory_limit_mb
+        self.preload = list(preload)
+        self.retired = 0  # processes replaced, whether retired or crashed
+        self._lock = threading.Lock()
+        self._pending = deque()  # (future, function, args) waiting for a process
+        self._workers = []
+        self._context = None
+        self._closed = False
+
+    def submit(self, function, *args):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The calculation pool has shut down")
+            if self._context is None:
+                self._start()
+            self._pending.append((future, function, args))
+            self._dispatch()
+        return future
+
+    def pids(self):
+        with self._lock:
+            return sorted(worker.process.pid for worker in self._workers)
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.connection.close()
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+    def _start(self):
+        self._context = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload(self.preload)
+        for _ in range(self.processes):
+            self._spawn()
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def _spawn(self):
+        connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker,
+            args=(child_connection, self.max_jobs, self.max_rss_mb, self.memory_limit_mb),
+            daemon=True,
+        )
+        process.start()
+        child_connection.close()
+        self._workers.append(_Worker(process, connection))
+
+    def _dispatch(self):
+        """Hand pending jobs to idle processes, called holding the lock"""
+        for worker in self._workers:
+            if not self._pending:
+                return
+            if worker.future is not None:
+                continue
+            future, function, args = self._pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                worker.connection.send((function, args))
+            except Exception as e:
+                # Unpicklable arguments, or the process has just died
+                future.set_exception(e)
+                continue
+            worker.future = future
+
+    def _collect(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                ready = {worker.connection: worker for worker in self._workers}
+                ready.update({worker.process.sentinel: worker for worker in self._workers})
+            try:
+                handles = wait(list(ready), timeout=1)
+            except OSError:
+                continue  # shutting down
+            for worker in {ready[handle] for handle in handles}:
+                self._finish(worker)
+
+    def _finish(self, worker):
+        """Resolve the job a process has finished, or died running, and replace it if it exited"""
+        try:
+            retiring, payload = worker.connection.recv()
+            succeeded, value = pickle.loads(payload)
+        except (EOFError, OSError):
+            worker.process.join()
+            retiring, succeeded = True, False
+            value = CalculationCrashed(
+                f"Calculation process exited with code {worker.process.exitcode}"
+            )
+
+        with self._lock:
+            future, worker.future = worker.future, None
+            if retiring and worker in self._workers:
+                self._workers.remove(worker)
+                worker.connection.close()
+                worker.process.join()
+                self.retired += 1
+                if not self._closed:
+                    self._spawn()
+            self._dispatch()
+
+        if future is None:
+            return
+        if succeeded:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
@@ -1,25 +1,126 @@
+from dataclasses import dataclass, field
+from functools import partial
+import hashlib
+import os
 from pathlib import Path
+import shutil
+import numpy as np
+import openpyxl
 import pandas as pd
-from lp_solver import minimise_tax_for_symbol_year
+from compressed_files import COMPRESSED_SUFFIXES, open_decompressed
+from fixed_point import QUANTITY_SCALE, to_cents, to_shares, to_units, unit_price
+from lp_solver import build_symbol_year_model, solve_symbol_year_model
 from market_data_api import handle_splits_and_ticker_changes
+from memory_profile import profile_stage
 from output_excel_writer import export_capital_gains_to_excel
+from results import BuySellPairs, CalculationResults, LazyBuySellPairs
 from test.test_helpers import mock_handle_splits_and_ticker_changes
 
 
+COMMSEC_COLUMNS = {
+    "Date",
+    "Reference",
+    "Details",
+    "Debit($)",
+    "Credit($)",
+    "Balance($)",
+}
+COMMSEC_TRADE_PATTERN = r"^(?P<side>[BS]) (?P<quantity>\S+) (?P<symbol>\S+)"
+NABTRADE_COLUMNS = [
+    "Movement Type",
+    "Code",
+    "Date",
+    "Quantity",
+    "Settlement Amount (AUD)",
+]
+TRADE_COLUMNS = {
+    "symbol",
+    "side",
+    "trade_date",
+    "quantity",
+    "transaction_amount",
+}
+
+
+def summarise_financial_year(fy_results):
+    """Fill in a financial year's totals from its short term, long term and loss"""
+    fy_results["total_capital_gain"] = fy_results["short_term"] + fy_results["long_term"]
+    # CGT discount is long term gain minus remaining loss multiplied by 0.5
+    fy_results["capital_gain_discount"] = 0.5 * max(fy_results["long_term"] - max(fy_results["loss"] - fy_results["short_term"], 0), 0)
+    # Taxable gain includes raw gain, subtracted loss, subtracted CGT discount, and then short sell gain on top
+    fy_results["taxable_capital_gain"] = max(fy_results["short_term"] - fy_results["loss"], 0) + fy_results["capital_gain_discount"]
+    carried_loss = max(fy_results["loss"] - fy_results["total_capital_gain"], 0)
+    # Finally, subtract any unapplied carried losses, only applies when losses are larger than raw gain, so taxable gain becomes negative (carry forward)
+    fy_results["taxable_capital_gain"] -= carried_loss
+
+
+@dataclass
+class RunContext:
+    """
+    State of one execute run. Runs never share it, so several can execute
+    over the same calculator on different threads.
+    """
+
+    used_buy_trades: dict = field(default_factory=dict)  # key: buy id, value: units used
+    solve_log: list = field(default_factory=list)  # diagnostics of each LP solve
+    planning_state: dict = None  # the final year's models and results, see SellPlanner
+    short_sells: pd.DataFrame = None  # see _find_short_sells
+    memory_profile: object = None  # a MemoryProfile to record each solve in
+    # When given, each symbol's pairs builder is put on it as ("symbol", fy, symbol,
+    # builder) once solved, and each year's totals as ("year", fy, totals). The
+    # builders are then only held by the queue's reader, not by the results.
+    results_queue: object = None
+
+
 class CGTCalculator:
-    nabtrade = False
+    # CSV and XLSX histories are read and normalised this many rows at a time
+    csv_chunk_rows = 50_000
+    # Compressed uploads may not expand beyond this, see compressed_files
+    max_decompressed_bytes = 160 * 1024 * 1024
 
-    def __init__(self, trade_history_csv_path: str):
-        self.trades_df = self._parse_trade_history_file(trade_history_csv_path)
-        self._initialise_trades_df()
-        handle_splits_and_ticker_changes(self.trades_df, self.nabtrade)
+    def __init__(
+        self, trade_history_csv_path: str, handle_market_data=True, memory_profile=None
+    ):
+        """
+        With handle_market_data False the trades are only parsed, and splits and
+        ticker changes are applied later with handle_splits_and_ticker_changes.
+        Parsing and market data are recorded as stages of memory_profile, if given.
+        """
+        self.nabtrade = False
+        with profile_stage(memory_profile, "parse"):
+            self._initialise_trades_df(
+                self._parse_trade_history_file(trade_history_csv_path)
+            )
+        if handle_market_data:
+            with profile_stage(memory_profile, "market_data"):
+                self.handle_splits_and_ticker_changes()
+
+    def handle_splits_and_ticker_changes(self):
+        # Adjust a copy, so runs already reading the trades are not affected
+        trades_df = self.trades_df.copy()
+        handle_splits_and_ticker_changes(trades_df, self.nabtrade)
+        self.trades_df = trades_df
         # # While not having an alphavantage subscription
         # mock_handle_splits_and_ticker_changes(self.trades_df)
 
-    def _parse_trade_history_file(self, trade_history_path) -> pd.DataFrame:
-        if trade_history_path.endswith(".csv"):
-            trades_df = pd.read_csv(trade_history_path)
-        elif trade_history_path.endswith((".xlsx", ".xls")):
+    def _parse_trade_history_file(self, trade_history_path):
+        """
+        Yield the trades of a history file as DataFrames in the generic format.
+        CSV and XLSX files are streamed in chunks so they are never loaded whole,
+        and so are CSVs in .csv.gz files and histories in zip files.
+        """
+        # Suffixes match in any case, as uploads such as TRADES.CSV.GZ are allowed
+        name = trade_history_path.lower()
+        if name.endswith(COMPRESSED_SUFFIXES):
+            yield from self._read_compressed_trade_chunks(trade_history_path)
+            return
+        elif name.endswith(".csv"):
+            yield from self._read_csv_trade_chunks(trade_history_path)
+            return
+        elif name.endswith(".xlsx"):
+            yield from self._read_xlsx_trade_chunks(trade_history_path)
+            return
+        elif name.endswith(".xls"):
             trades_df = pd.read_excel(trade_history_path, sheet_name=0, skiprows=1)
         else:
             raise ValueError(
@@ -29,179 +130,405 @@ class CGTCalculator:
             )
 
         # Verify if these transaction are from commsec
-        commsec_cols = {
-            "Date",
-            "Reference",
-            "Details",
-            "Debit($)",
-            "Credit($)",
-            "Balance($)",
-        }
-        if not commsec_cols - set(trades_df.columns):
-            new_columns = trades_df["Details"].str.split(" ", expand=True, n=3)
-            new_columns["Reference"] = trades_df["Reference"]
-            new_columns.columns = ["side", "quantity", "symbol", "at_price", "Reference"]
-            new_columns["side"] = new_columns["side"].replace({"B": "BUY", "S": "SELL"})
-            # Filter out non buys and sells
-            new_columns = new_columns[new_columns["side"].isin(["BUY", "SELL"])]
-            trades_df = pd.merge(new_columns, trades_df, on='Reference', how='left')
-
-            trades_df["transaction_amount"] = trades_df["Debit($)"].where(
-                trades_df["Debit($)"].notna(), trades_df["Credit($)"]
-            )
-            trades_df = trades_df.rename(columns={"Date": "trade_date"})
-
-            trades_df = trades_df[
-                ["side", "symbol", "trade_date", "quantity", "transaction_amount"]
-            ]
+        if not COMMSEC_COLUMNS - set(trades_df.columns):
+            trades_df = self._transform_commsec_history(trades_df)
 
         # Verify if these transaction are from nabtrade
         elif "Account Name" in trades_df.columns:
             col_upper = trades_df["Account Name"].dropna().astype(str).str.upper()
-            for value in col_upper.values:
-                if "NABTRADE" in value:
-                    trades_df = self._parse_nabtrade_history_file(trade_history_path)
-                    break
+            if col_upper.str.contains("NABTRADE", regex=False).any():
+                trades_df = self._parse_nabtrade_history_file(trade_history_path)
 
-        trades_df = trades_df.dropna(axis=0)
-        return trades_df
+        yield trades_df.dropna(axis=0)
+
+    def _read_compressed_trade_chunks(self, compressed_path):
+        """
+        Decompress a .csv.gz or zipped history while it is read. A zipped XLSX
+        is first decompressed next to it, as workbooks are read by seeking.
+        """
+        open_history = partial(
+            open_decompressed, compressed_path, self.max_decompressed_bytes
+        )
+        xlsx_path = f"{compressed_path}.xlsx"
+        try:
+            with open_history() as (name, f):
+                if name.lower().endswith(".xlsx"):
+                    with open(xlsx_path, "wb") as xlsx:
+                        shutil.copyfileobj(f, xlsx, 1024 * 1024)
+            if name.lower().endswith(".xlsx"):
+                yield from self._read_xlsx_trade_chunks(xlsx_path)
+            else:
+                yield from self._read_csv_trade_chunks(open_history)
+        finally:
+            if os.path.exists(xlsx_path):
+                os.remove(xlsx_path)
+
+    def _read_csv_trade_chunks(self, trade_history):
+        """
+        Read only the columns that are used, with explicit dtypes, one chunk at a time.
+        Amounts are read as strings as they may contain "$". The history is a path,
+        or a function opening it as a (name, binary file) context manager.
+        """
+        if callable(trade_history):
+            with trade_history() as (_, f):
+                header = pd.read_csv(f, nrows=0).columns
+            with trade_history() as (_, f):
+                yield from self._read_csv_columns(f, header)
+        else:
+            header = pd.read_csv(trade_history, nrows=0).columns
+            yield from self._read_csv_columns(trade_history, header)
+
+    def _read_csv_columns(self, trade_history, header):
+        """Chunks of a CSV path or file whose header has already been read"""
+        # Verify if these transaction are from commsec
+        if not COMMSEC_COLUMNS - set(header):
+            chunks = pd.read_csv(
+                trade_history,
+                usecols=["Date", "Details", "Debit($)", "Credit($)"],
+                dtype=str,
+                chunksize=self.csv_chunk_rows,
+            )
+            for chunk in chunks:
+                yield self._transform_commsec_history(chunk).dropna(axis=0)
+            return
+
+        columns = [c for c in header if c.strip().lower() in TRADE_COLUMNS]
+        chunks = pd.read_csv(
+            trade_history,
+            usecols=columns,
+            dtype={
+                c: "float64" if c.strip().lower() == "quantity" else str
+                for c in columns
+            },
+            chunksize=self.csv_chunk_rows,
+        )
+        for chunk in chunks:
+            yield chunk.dropna(axis=0)
+
+    def _read_xlsx_trade_chunks(self, trade_history_path):
+        """
+        Stream a workbook's rows with openpyxl, reading only the columns that are
+        used. The layout is told from header rows alone, and sheets that are not
+        needed are never parsed. Headers are on the second row, as in the exports.
+        """
+        workbook = openpyxl.load_workbook(trade_history_path, read_only=True, data_only=True)
+        try:
+            sheets = workbook.worksheets
+            header = self._xlsx_header(sheets[0])
+
+            # Verify if these transaction are from commsec
+            if not COMMSEC_COLUMNS - set(header):
+                chunks = self._read_xlsx_columns(
+                    sheets[0],
+                    header,
+                    ["Date", "Details", "Debit($)", "Credit($)"],
+                    self.csv_chunk_rows,
+                )
+                for chunk in chunks:
+                    yield self._transform_commsec_history(chunk).dropna(axis=0)
+
+            # Verify if these transaction are from nabtrade, its trades are on sheets 4 and 5
+            elif "Account Name" in header and len(sheets) >= 5 and all(
+                not set(NABTRADE_COLUMNS) - set(self._xlsx_header(sheet))
+                for sheet in sheets[3:5]
+            ):
+                self.nabtrade = True
+                for sheet in sheets[3:5]:
+                    # Code changes chain down a whole sheet, so it is read at once
+                    (trades_df,) = self._read_xlsx_columns(
+                        sheet, self._xlsx_header(sheet), NABTRADE_COLUMNS
+                    )
+                    yield self._transform_nabtrade_sheet(trades_df).dropna(axis=0)
+
+            else:
+                columns = [
+                    c for c in header if c is not None and c.strip().lower() in TRADE_COLUMNS
+                ]
+                for chunk in self._read_xlsx_columns(
+                    sheets[0], header, columns, self.csv_chunk_rows
+                ):
+                    yield chunk.dropna(axis=0)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def _xlsx_header(sheet):
+        """The column names on the second row of a sheet"""
+        for row in sheet.iter_rows(min_row=2, max_row=2, values_only=True):
+            return [None if value is None else str(value) for value in row]
+        return []
+
+    @staticmethod
+    def _read_xlsx_columns(sheet, header, columns, chunk_rows=None):
+        """
+        Yield DataFrames of the given columns of the rows below a sheet's header,
+        chunk_rows at a time or all at once, and at least one even if it is empty.
+        Only the cells from the first to the last given column are read.
+        """
+        positions = [header.index(column) for column in columns]
+        first = min(positions, default=0)
+        offsets = [position - first for position in positions]
+        rows = sheet.iter_rows(
+            min_row=3,
+            min_col=first + 1,
+            max_col=max(positions, default=0) + 1,
+            values_only=True,
+        )
+
+        chunk = []
+        yielded = False
+        for row in rows:
+            chunk.append([row[offset] for offset in offsets])
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+                yielded = True
+        if chunk or not yielded:
+            yield pd.DataFrame(chunk, columns=columns)
+
+    @staticmethod
+    def _transform_commsec_history(commsec_df) -> pd.DataFrame:
+        """
+        Extract trades from the Details column of a CommSec transaction export,
+        e.g. "B 100 CBA @ 95.500000". Rows stay aligned on the original index so
+        duplicate references across accounts cannot multiply rows.
+        """
+        details = commsec_df["Details"].astype(str).str.extract(COMMSEC_TRADE_PATTERN)
+        # Filter out non buys and sells
+        trades = details["side"].notna()
+        commsec_df = commsec_df[trades]
+
+        return pd.DataFrame(
+            {
+                "side": details.loc[trades, "side"].map({"B": "BUY", "S": "SELL"}),
+                "symbol": details.loc[trades, "symbol"],
+                "trade_date": commsec_df["Date"],
+                "quantity": details.loc[trades, "quantity"],
+                "transaction_amount": commsec_df["Debit($)"].where(
+                    commsec_df["Debit($)"].notna(), commsec_df["Credit($)"]
+                ),
+            }
+        )
 
     def _parse_nabtrade_history_file(self, trade_history_path) -> pd.DataFrame:
         self.nabtrade = True
         trades = pd.read_excel(trade_history_path, sheet_name=[3, 4], skiprows=1)
-        trades_df = pd.DataFrame()
         # TODO: Apply stock splits here and skip later for nabtrade
-        for df in trades.values():
-            # Apply ticker chanes
-            df["Movement Type"] = df["Movement Type"].astype(str)
-            df["Code"] = df["Code"].astype(str)
-            ticker_change_idx = df.index[
-                df["Movement Type"] == "CHANGE_SECURITY_CODE"
-            ].tolist()
-            i = 1
-            while i <= len(ticker_change_idx):
-                row_index = ticker_change_idx[i]
-                df["Code"] = df["Code"].replace(
-                    {df.loc[row_index - 1, "Code"]: df.loc[row_index, "Code"]}
-                )
-                i += 2
-
-            # Filter out values and rename
-            df = df[(df["Movement Type"] == "BUY") | (df["Movement Type"] == "SELL")]
-            df = df.rename(
-                columns={
-                    "Movement Type": "side",
-                    "Code": "symbol",
-                    "Date": "trade_date",
-                    "Quantity": "quantity",
-                    "Settlement Amount (AUD)": "transaction_amount",
-                }
+        return pd.concat(
+            [self._transform_nabtrade_sheet(df) for df in trades.values()],
+            ignore_index=True,
+        )
+
+    @staticmethod
+    def _nabtrade_code_changes(movement_types, codes):
+        """
+        Build one old code -> new code mapping from CHANGE_SECURITY_CODE movements,
+        which come in pairs of rows (old code, new code). Later changes chain onto
+        earlier ones exactly as if each pair was applied to the column in turn.
+        """
+        change_positions = np.flatnonzero(movement_types == "CHANGE_SECURITY_CODE")
+        code_changes = {}
+        for new_position in change_positions[1::2]:
+            old_code = code_changes.get(codes[new_position - 1], codes[new_position - 1])
+            new_code = code_changes.get(codes[new_position], codes[new_position])
+            if old_code == new_code:
+                continue
+            for code in [*code_changes, old_code]:
+                if code_changes.get(code, code) == old_code:
+                    code_changes[code] = new_code
+
+        return code_changes
+
+    @classmethod
+    def _transform_nabtrade_sheet(cls, df) -> pd.DataFrame:
+        movement_types = df["Movement Type"].astype(str)
+        codes = df["Code"].astype(str)
+        code_changes = cls._nabtrade_code_changes(
+            movement_types.to_numpy(), codes.to_numpy()
+        )
+
+        # Filter out values and rename
+        trades = movement_types.isin(["BUY", "SELL"])
+        codes = codes[trades]
+        return pd.DataFrame(
+            {
+                "side": movement_types[trades],
+                # Apply ticker changes
+                "symbol": codes.map(code_changes).fillna(codes)
+                if code_changes
+                else codes,
+                "trade_date": df.loc[trades, "Date"],
+                "quantity": df.loc[trades, "Quantity"],
+                "transaction_amount": df.loc[trades, "Settlement Amount (AUD)"],
+            }
+        )
+
+    def _initialise_trades_df(self, trade_chunks):
+        """
+        Normalise each chunk of trades as it is read and append it to the trades
+        store, so only the compact normalised columns are kept for the whole file.
+        """
+        normalised_chunks = []
+        next_id = 0
+        for chunk in trade_chunks:
+            chunk = self._normalise_trades(chunk, next_id)
+            next_id += len(chunk)
+            normalised_chunks.append(chunk)
+
+        if not normalised_chunks:
+            normalised_chunks.append(
+                self._normalise_trades(pd.DataFrame(columns=sorted(TRADE_COLUMNS)), 0)
             )
-            df = df[["side", "symbol", "trade_date", "quantity", "transaction_amount"]]
-            trades_df = pd.concat([trades_df, df], ignore_index=True)
 
-        return trades_df
+        # Chunks only share a categorical dtype once they share categories
+        for column in ("side", "symbol"):
+            categories = sorted(
+                set().union(*(chunk[column].cat.categories for chunk in normalised_chunks))
+            )
+            for chunk in normalised_chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+
+        self.trades_df = pd.concat(normalised_chunks, ignore_index=True)
 
-    def _initialise_trades_df(self):
+    def _normalise_trades(self, trades_df, id_offset):
         # Normalise columns
-        self.trades_df.columns = [c.strip().lower() for c in self.trades_df.columns]
-        required_cols = {
-            "symbol",
-            "side",
-            "trade_date",
-            "quantity",
-            "transaction_amount",
-        }
-        missing_cols = required_cols - set(self.trades_df.columns)
+        trades_df.columns = [c.strip().lower() for c in trades_df.columns]
+        missing_cols = TRADE_COLUMNS - set(trades_df.columns)
         if missing_cols:
             raise ValueError(f"Missing required columns: {missing_cols}")
 
+        trades_df = trades_df[
+            ["symbol", "side", "trade_date", "quantity", "transaction_amount"]
+        ].copy()
+
         # parse and transform data
-        self.trades_df["side"] = self.trades_df["side"].astype(str).str.upper()
+        trades_df["side"] = self._transform_unique_values(
+            trades_df["side"], lambda side: side.upper()
+        )
 
         # remove appended exchange name (e.g .NYSE)
-        self.trades_df["symbol"] = [
-            str(s).split(".")[0].upper() for s in self.trades_df["symbol"]
-        ]
-
-        self.trades_df["trade_date"] = pd.to_datetime(
-            self.trades_df["trade_date"], dayfirst=True
+        trades_df["symbol"] = self._transform_unique_values(
+            trades_df["symbol"], lambda symbol: symbol.split(".")[0].upper()
         )
 
-        self.trades_df["quantity"] = self.trades_df["quantity"].astype(float).abs()
+        if not pd.api.types.is_datetime64_any_dtype(trades_df["trade_date"]):
+            # Histories repeat the same dates many times, so only parse each once
+            date_codes, unique_dates = pd.factorize(trades_df["trade_date"])
+            trades_df["trade_date"] = (
+                pd.to_datetime(pd.Series(unique_dates), dayfirst=True)
+                .to_numpy()
+                .take(date_codes)
+            )
 
-        self.trades_df["transaction_amount"] = (
-            self.trades_df["transaction_amount"]
-            .astype(str)
-            .str.replace("$", "", regex=False)
-        )
-        self.trades_df["transaction_amount"] = (
-            self.trades_df["transaction_amount"].astype(float).abs()
-        )
+        # Quantities are held as integer units and amounts as integer cents
+        shares = trades_df["quantity"].astype(float).abs()
+        trades_df["quantity"] = to_units(shares)
+        too_small = (trades_df["quantity"] == 0) & (shares > 0)
+        if too_small.any():
+            raise ValueError(
+                f"Quantity {shares[too_small].iloc[0]:g} is too small, quantities "
+                f"must be at least {1 / QUANTITY_SCALE:g}"
+            )
 
-        self.trades_df["fy"] = (
-            self.trades_df["trade_date"].apply(self._au_fin_year).astype(int)
-        )
+        amounts = trades_df["transaction_amount"]
+        if not pd.api.types.is_numeric_dtype(amounts):
+            amounts = amounts.astype(str).str.replace("$", "", regex=False)
+        trades_df["transaction_amount"] = to_cents(amounts.astype(float).abs())
 
-        self.trades_df["id"] = [i for i in range(len(self.trades_df["trade_date"]))]
+        # FY runs 1 Jul–30 Jun; FY label is the year ending (e.g., 30/06/2025 -> 2025)
+        trade_dates = trades_df["trade_date"].dt
+        trades_df["fy"] = (trade_dates.year + (trade_dates.month >= 7)).astype(np.int16)
 
-    def _au_fin_year(self, transaction_date):
-        # FY runs 1 Jul–30 Jun; FY label is the year ending (e.g., 30/06/2025 -> "2025")
-        return (
-            transaction_date.year + 1
-            if transaction_date.month >= 7
-            else transaction_date.year
+        trades_df["id"] = np.arange(id_offset, id_offset + len(trades_df), dtype=np.int32)
+
+        return trades_df
+
+    @staticmethod
+    def _transform_unique_values(column, transform):
+        """
+        Apply a string transform once per distinct value rather than per row,
+        returning the result as a categorical.
+        """
+        codes, uniques = pd.factorize(column.astype(str))
+        transformed_codes, categories = pd.factorize(
+            np.array([transform(value) for value in uniques], dtype=object)
         )
+        if len(transformed_codes):
+            codes = transformed_codes.take(codes)
+        return pd.Categorical.from_codes(codes, categories=categories.astype(str))
 
-    def _calculate_short_sell_gain(
-        self, sell_df, qty_difference, sell_buy_pairs_for_symbol
-    ):
+    @staticmethod
+    def _find_short_sells(trades_df, last_fy=None):
         """
-        Modify sell df to not include short selling on symbol and return gain from short selling.
+        Find short selling up to last_fy with one cumulative position scan per
+        symbol, before any LP is built. Holdings carried into a year are the
+        running sum of buys less sells floored at zero, and whatever a year sells
+        beyond them is short sold, taken from that year's cheapest sells first.
+        Returns the short sold part of each affected sell as a DataFrame with
+        columns [symbol, fy, id, trade_date, quantity, unit_price, gain] in
+        allocation order. Quantities are in units, see fixed_point.
         """
-        sorted_sells_df = sell_df.sort_values(by="unit_price")
-        short_sell_gain = 0
-        for _, sell_trade in sorted_sells_df.iterrows():
-            row_index = sell_df[sell_df["id"] == sell_trade["id"]].index[0]
-            if sell_trade["quantity"] >= qty_difference:
-                sell_df.loc[row_index, "quantity"] -= qty_difference
-                short_sell_gain += qty_difference * sell_trade["unit_price"]
-
-                # Add short sell to output
-                sell_buy_pairs_for_symbol.append(
-                    (
-                        None,
-                        sell_trade["trade_date"],
-                        qty_difference,
-                        sell_trade["unit_price"],
-                    )
-                )
+        if last_fy is not None:
+            trades_df = trades_df[trades_df["fy"] <= last_fy]
+        is_sell = (trades_df["side"] == "SELL").to_numpy()
+        quantity = trades_df["quantity"].to_numpy(dtype=np.int64)
+        net = np.where(trades_df["side"] == "BUY", quantity, 0) - np.where(
+            is_sell, quantity, 0
+        )
 
-                return short_sell_gain
+        net_per_year = (
+            pd.DataFrame(
+                dict(symbol=trades_df["symbol"], fy=trades_df["fy"], net=net)
+            )
+            .groupby(["symbol", "fy"], observed=True, sort=True)["net"]
+            .sum()
+        )
+        # With S the running sum of net units, holdings are S - min(0, min S),
+        # so the units short sold to date are max(0, -min S)
+        running = net_per_year.groupby(level="symbol").cumsum()
+        short_to_date = (-running.groupby(level="symbol").cummin()).clip(lower=0)
+        shortfall = short_to_date - short_to_date.groupby(level="symbol").shift(
+            fill_value=0
+        )
+        shortfall = shortfall[shortfall > 0].rename("shortfall").reset_index()
 
-            else:
-                sell_df.loc[row_index, "quantity"] = 0
-                qty_difference -= sell_trade["quantity"]
-                short_sell_gain += sell_trade["quantity"] * sell_trade["unit_price"]
-
-                # Add short sell to output
-                sell_buy_pairs_for_symbol.append(
-                    (
-                        None,
-                        sell_trade["trade_date"],
-                        sell_trade["quantity"],
-                        sell_trade["unit_price"],
-                    )
-                )
+        sells = trades_df.loc[
+            is_sell & (quantity > 0),
+            ["symbol", "fy", "id", "trade_date", "quantity", "transaction_amount"],
+        ]
+        sells = (
+            sells.assign(
+                symbol=sells["symbol"].astype(str),
+                unit_price=unit_price(sells["transaction_amount"], sells["quantity"]),
+            )
+            .drop(columns="transaction_amount")
+            .merge(shortfall.astype(dict(symbol=str)), on=["symbol", "fy"])
+        )
+        sells = sells.sort_values(["symbol", "fy", "unit_price"], kind="stable")
 
-        return short_sell_gain
+        sold_before = (
+            sells.groupby(["symbol", "fy"], sort=False)["quantity"].cumsum()
+            - sells["quantity"]
+        )
+        sells["quantity"] = np.clip(
+            sells["shortfall"] - sold_before, 0, sells["quantity"]
+        )
+        sells = sells[sells["quantity"] > 0].drop(columns="shortfall")
+        sells["gain"] = to_shares(sells["quantity"]) * sells["unit_price"]
+        return sells.reset_index(drop=True)
 
-    def _extract_trades(self, trades_df, used_buy_trades={}):
+    @staticmethod
+    def _extract_trades(trades_df, used_buy_trades=None):
+        """
+        Rows of [id, trade_date, quantity, unit_price] for the trades with units
+        left, less the units already used as recorded in used_buy_trades
+        """
+        if used_buy_trades is None:
+            used_buy_trades = {}
         trades = []
         for _, trade in trades_df.iterrows():
             trade_id = trade["id"]
             trade_date = trade["trade_date"]
-            unit_price = trade["transaction_amount"] / trade["quantity"]
 
             if trade_id in used_buy_trades:
                 quantity = trade["quantity"] - used_buy_trades[trade_id]
@@ -212,17 +539,112 @@ class CGTCalculator:
             if quantity <= 0:
                 continue
 
-            trades.append([trade_id, trade_date, quantity, unit_price])
+            trades.append(
+                [
+                    trade_id,
+                    trade_date,
+                    quantity,
+                    float(unit_price(trade["transaction_amount"], trade["quantity"])),
+                ]
+            )
 
         return trades
 
-    def execute(self, allow_short_selling=False):
-        used_buy_trades = {}  # key is id and value is quantity used
-        results_per_fy = {}
-        for fy in sorted(self.trades_df["fy"].unique()):
-            results_per_fy[fy] = dict(
-                # key: symbol, value: list of tuples
-                buy_and_sell_pairs={},
+    @staticmethod
+    def _build_pairs(short_sells_df, solution, trade_dates_by_id):
+        """BuySellPairs of one symbol and year from its short sells and LP solution"""
+        pairs = []
+        if short_sells_df is not None:
+            pairs.append(
+                BuySellPairs.from_columns(
+                    buy_date=np.full(len(short_sells_df), np.datetime64("NaT")),
+                    sell_date=short_sells_df["trade_date"],
+                    quantity=to_shares(short_sells_df["quantity"]),
+                    per_unit_gain=short_sells_df["unit_price"],
+                )
+            )
+        if solution is not None:
+            buy_ids, sell_ids, quantities, per_unit_gains = solution
+            pairs.append(
+                BuySellPairs.from_columns(
+                    buy_date=trade_dates_by_id[buy_ids],
+                    sell_date=trade_dates_by_id[sell_ids],
+                    quantity=to_shares(quantities),
+                    per_unit_gain=per_unit_gains,
+                )
+            )
+        return BuySellPairs.concat(pairs)
+
+    def fingerprint(self):
+        """
+        Hash of the normalised trades, usable as a cache key for results. Units,
+        cents and dates are integers, so it is identical across runs and machines.
+        """
+        digest = hashlib.sha256(f"quantity_scale={QUANTITY_SCALE}".encode())
+        for column in ("symbol", "side"):
+            digest.update("\x1f".join(self.trades_df[column].astype(str)).encode())
+            digest.update(b"\x1e")
+        digest.update(
+            self.trades_df["trade_date"].to_numpy(dtype="datetime64[ns]").tobytes()
+        )
+        for column in ("quantity", "transaction_amount"):
+            digest.update(self.trades_df[column].to_numpy(dtype="<i8").tobytes())
+        return digest.hexdigest()
+
+    def execute(
+        self, allow_short_selling=False, target_fy=None, solver_options=None, context=None
+    ):
+        """
+        Optimise the capital gains of every financial year up to target_fy, or of
+        all years in the trade history. Later years never affect earlier ones,
+        so they are not processed.
+        solver_options are passed to every LP solve (see solve_symbol_year_model),
+        and the diagnostics of each solve are collected in the run's solve_log.
+        Each solve is a stage of the context's memory_profile, if it has one, and
+        results are put on its results_queue as they finish, if it has one, in
+        which case the returned results hold the totals but no pairs.
+        The run's state, its solve_log, planning_state and short_sells, is kept
+        in context. Callers reading it pass their own, a new RunContext is used
+        otherwise. Nothing of a run is kept on the calculator.
+        """
+        context = RunContext() if context is None else context
+        trades_df = self.trades_df
+        used_buy_trades = context.used_buy_trades
+        # Trade dates looked up by trade id when reporting pairs
+        trade_dates_by_id = np.empty(
+            int(trades_df["id"].max()) + 1 if len(trades_df) else 0,
+            dtype="datetime64[ns]",
+        )
+        trade_dates_by_id[trades_df["id"].to_numpy()] = trades_df[
+            "trade_date"
+        ].to_numpy(dtype="datetime64[ns]")
+
+        financial_years = sorted(int(fy) for fy in trades_df["fy"].unique())
+        if target_fy is not None:
+            financial_years = [fy for fy in financial_years if fy <= target_fy]
+        final_fy = financial_years[-1] if financial_years else None
+        context.planning_state = dict(fy=final_fy, symbols={}, totals=None)
+
+        # Short selling is found for all years at once, so it is reported
+        # without solving any LP
+        context.short_sells = self._find_short_sells(trades_df, final_fy)
+        if not allow_short_selling and not context.short_sells.empty:
+            raise ValueError(
+                "Short selling detected on symbols: "
+                f"{', '.join(sorted(context.short_sells['symbol'].unique()))}"
+            )
+        short_sells_by_year = {
+            (int(fy), symbol): short_sells_df
+            for (fy, symbol), short_sells_df in context.short_sells.groupby(
+                ["fy", "symbol"], sort=False
+            )
+        }
+
+        results_per_fy = CalculationResults(summarise_financial_year)
+        for fy in financial_years:
+            fy_results = dict(
+                # key: symbol, value: BuySellPairs, built when first read
+                buy_and_sell_pairs=LazyBuySellPairs(),
                 short_term=0,
                 long_term=0,
                 total_capital_gain=0,
@@ -232,17 +654,16 @@ class CGTCalculator:
                 taxable_capital_gain=0,
             )
 
-            short_sell_symbols = []
-            for symbol in sorted(self.trades_df["symbol"].unique()):
-                buy_trades_df = self.trades_df[
-                    (self.trades_df["symbol"] == symbol)
-                    & (self.trades_df["side"] == "BUY")
-                    & (self.trades_df["fy"] <= fy)
+            for symbol in sorted(trades_df["symbol"].unique()):
+                buy_trades_df = trades_df[
+                    (trades_df["symbol"] == symbol)
+                    & (trades_df["side"] == "BUY")
+                    & (trades_df["fy"] <= fy)
                 ]
-                sell_trades_df = self.trades_df[
-                    (self.trades_df["symbol"] == symbol)
-                    & (self.trades_df["side"] == "SELL")
-                    & (self.trades_df["fy"] == fy)
+                sell_trades_df = trades_df[
+                    (trades_df["symbol"] == symbol)
+                    & (trades_df["side"] == "SELL")
+                    & (trades_df["fy"] == fy)
                 ]
 
                 buy_trades = self._extract_trades(buy_trades_df, used_buy_trades)
@@ -256,69 +677,78 @@ class CGTCalculator:
                     sell_trades, columns=["id", "trade_date", "quantity", "unit_price"]
                 )
 
-                # Check if the user is short selling on the symbol
+                # Leave the short sold units out of the LP
+                short_sells_df = short_sells_by_year.get((fy, symbol))
                 short_sell_gain = 0
-                total_sell_qty = solver_sells_df["quantity"].sum()
-                total_buy_qty = solver_buys_df["qty_avail"].sum()
-                if total_buy_qty < total_sell_qty:
-                    short_sell_symbols.append(symbol)
-                    results_per_fy[fy]["buy_and_sell_pairs"][symbol] = []
-                    short_sell_gain = self._calculate_short_sell_gain(
-                        solver_sells_df,
-                        total_sell_qty - total_buy_qty,
-                        results_per_fy[fy]["buy_and_sell_pairs"][symbol],
+                if short_sells_df is not None:
+                    short_units = short_sells_df.set_index("id")["quantity"]
+                    solver_sells_df["quantity"] -= (
+                        solver_sells_df["id"].map(short_units).fillna(0).astype(np.int64)
                     )
+                    short_sell_gain = short_sells_df["gain"].sum()
 
                 # Solve
-                result = minimise_tax_for_symbol_year(
-                    solver_buys_df, solver_sells_df, symbol
-                )
+                with profile_stage(context.memory_profile, "solve", fy=fy, symbol=symbol):
+                    model = build_symbol_year_model(solver_buys_df, solver_sells_df)
+                    result = solve_symbol_year_model(model, symbol, solver_options)
+                if result["diagnostics"] is not None:
+                    context.solve_log.append(
+                        dict(fy=fy, symbol=symbol, **result["diagnostics"])
+                    )
+                if fy == final_fy:
+                    # Kept so that what-if sells can be planned against this year
+                    context.planning_state["symbols"][symbol] = dict(
+                        model=model, result=result, short_sell_gain=short_sell_gain
+                    )
 
                 solution_df = result["x"]
-                for _, sol_row in solution_df.iterrows():
+                solution = None
+                if not solution_df.empty:
+                    solution = (
+                        solution_df["buy_id"].to_numpy(dtype=np.int64),
+                        solution_df["sell_id"].to_numpy(dtype=np.int64),
+                        solution_df["quantity"].to_numpy(dtype=np.int64),
+                        solution_df["per_unit_gain"].to_numpy(dtype=np.float64),
+                    )
+
                     # Mark as used so that units from this buy are not reused
-                    used_buy_trades[sol_row["buy_id"]] += sol_row["quantity"]
-
-                    # Extract data from trades df to populate result
-                    buy_date = self.trades_df[
-                        self.trades_df["id"] == sol_row["buy_id"]
-                    ]["trade_date"].iloc[0]
-                    sell_date = self.trades_df[
-                        self.trades_df["id"] == sol_row["sell_id"]
-                    ]["trade_date"].iloc[0]
-                    qty_sold = int(sol_row["quantity"])
-                    per_unit_gain = sol_row["per_unit_gain"]
-
-                    if symbol in results_per_fy[fy]["buy_and_sell_pairs"]:
-                        results_per_fy[fy]["buy_and_sell_pairs"][symbol].append(
-                            (buy_date, sell_date, qty_sold, per_unit_gain)
-                        )
+                    for buy_id, quantity in zip(solution[0].tolist(), solution[2].tolist()):
+                        used_buy_trades[buy_id] += quantity
+
+                if short_sells_df is not None or solution is not None:
+                    build_pairs = partial(
+                        self._build_pairs,
+                        short_sells_df,
+                        solution,
+                        trade_dates_by_id,
+                    )
+                    if context.results_queue is not None:
+                        context.results_queue.put(("symbol", fy, symbol, build_pairs))
                     else:
-                        results_per_fy[fy]["buy_and_sell_pairs"][symbol] = [
-                            (buy_date, sell_date, qty_sold, per_unit_gain)
-                        ]
-
-                results_per_fy[fy]["short_term"] += (result["short_term"] + short_sell_gain)
-                results_per_fy[fy]["long_term"] += result["long_term"]
-                results_per_fy[fy]["loss"] += result["loss"]
-                results_per_fy[fy]["short_sell_gain"] += short_sell_gain
-
-            if not allow_short_selling and short_sell_symbols:
-                raise ValueError(
-                    f"Short selling detected on symbols: {', '.join(short_sell_symbols)}"
-                )
-                
-            results_per_fy[fy]["total_capital_gain"] = results_per_fy[fy]["short_term"] + results_per_fy[fy]["long_term"]
-            # CGT discount is long term gain minus remaining loss multiplied by 0.5
-            results_per_fy[fy]["capital_gain_discount"] = 0.5 * max(results_per_fy[fy]["long_term"] - max(results_per_fy[fy]["loss"] - results_per_fy[fy]["short_term"], 0), 0)
-            # Taxable gain includes raw gain, subtracted loss, subtracted CGT discount, and then short sell gain on top
-            results_per_fy[fy]["taxable_capital_gain"] = max(results_per_fy[fy]["short_term"] - results_per_fy[fy]["loss"], 0) + results_per_fy[fy]["capital_gain_discount"]
-            carried_loss = max(results_per_fy[fy]["loss"] - results_per_fy[fy]["total_capital_gain"], 0)
-            # Finally, subtract any unapplied carried losses, only applies when losses are larger than raw gain, so taxable gain becomes negative (carry forward)
-            results_per_fy[fy]["taxable_capital_gain"] -= carried_loss
+                        fy_results["buy_and_sell_pairs"].add(symbol, build_pairs)
+
+                fy_results["short_term"] += (result["short_term"] + short_sell_gain)
+                fy_results["long_term"] += result["long_term"]
+                fy_results["loss"] += result["loss"]
+                fy_results["short_sell_gain"] += short_sell_gain
+
+            results_per_fy.add_year(fy, fy_results)
+            if context.results_queue is not None:
+                context.results_queue.put(("year", fy, self._year_totals(results_per_fy, fy)))
+
+        if final_fy is not None:
+            context.planning_state["totals"] = self._year_totals(results_per_fy, final_fy)
 
         return results_per_fy
 
+    @staticmethod
+    def _year_totals(results_per_fy, fy):
+        return {
+            key: value
+            for key, value in results_per_fy[fy].items()
+            if key != "buy_and_sell_pairs"
+        }
+
 
 if __name__ == "__main__":
     results_per_fy = CGTCalculator(
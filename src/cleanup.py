@@ -0,0 +1,132 @@
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+CLEANUP_LEASE_NAME = "cleanup"
+
+
+def lease_holder():
+    """Identifies this process when competing for the cleanup lease"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _remove_file(path, metrics):
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    except OSError as e:
+        print(f"Error deleting file {path}: {e}")
+        metrics["errors"] += 1
+        return
+    metrics["files_deleted"] += 1
+    metrics["bytes_reclaimed"] += size
+
+
+def sweep_expired_sessions(store, max_age, batch_size=500):
+    """
+    Delete expired sessions with their reports, results and planner files, one
+    batch of sessions at a time
+    """
+    started = time.perf_counter()
+    metrics = dict(sessions_deleted=0, files_deleted=0, bytes_reclaimed=0, errors=0)
+    cutoff_time = datetime.now() - max_age
+
+    while True:
+        old_sessions = store.expired(cutoff_time, limit=batch_size)
+        if not old_sessions:
+            break
+
+        for session in old_sessions:
+            for path_column in ("excel_path", "results_path", "plan_path"):
+                if session[path_column]:
+                    _remove_file(os.path.join(os.getcwd(), session[path_column]), metrics)
+        metrics["sessions_deleted"] += store.delete(
+            session["session_id"] for session in old_sessions
+        )
+
+        if len(old_sessions) < batch_size:
+            break
+
+    metrics["seconds"] = time.perf_counter() - started
+    return metrics
+
+
+def sweep_stale_files(folder, max_age, batch_size=500):
+    """
+    Delete files in folder last modified before max_age ago, e.g. uploads left
+    behind by a worker which crashed mid request.
+    """
+    started = time.perf_counter()
+    metrics = dict(files_deleted=0, bytes_reclaimed=0, errors=0)
+    cutoff_timestamp = time.time() - max_age.total_seconds()
+
+    batch = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            try:
+                if not entry.is_file() or entry.stat().st_mtime >= cutoff_timestamp:
+                    continue
+            except FileNotFoundError:
+                continue
+            batch.append(entry.path)
+            if len(batch) >= batch_size:
+                for path in batch:
+                    _remove_file(path, metrics)
+                batch = []
+    for path in batch:
+        _remove_file(path, metrics)
+
+    metrics["seconds"] = time.perf_counter() - started
+    return metrics
+
+
+def run_cleanup(
+    store,
+    upload_folder,
+    output_folder,
+    session_max_age=timedelta(hours=24),
+    upload_max_age=timedelta(hours=1),
+    lease_ttl=timedelta(minutes=30),
+    batch_size=500,
+):
+    """
+    Sweep expired sessions and jobs, orphaned uploads and stale reports.
+    Only the process holding the cleanup lease sweeps, every other process
+    returns None so concurrent workers never race over the same rows and files.
+    """
+    holder = lease_holder()
+    if not store.acquire_lease(CLEANUP_LEASE_NAME, holder, lease_ttl.total_seconds()):
+        return None
+
+    started = time.perf_counter()
+    sessions = sweep_expired_sessions(store, session_max_age, batch_size)
+    jobs_deleted = store.delete_jobs_before(datetime.now() - session_max_age)
+    uploads = sweep_stale_files(upload_folder, upload_max_age, batch_size)
+    # Reports whose session row was never stored or already removed
+    outputs = sweep_stale_files(
+        output_folder, session_max_age + timedelta(hours=1), batch_size
+    )
+
+    metrics = dict(
+        holder=holder,
+        sessions=sessions,
+        jobs_deleted=jobs_deleted,
+        uploads=uploads,
+        outputs=outputs,
+        files_deleted=sessions["files_deleted"]
+        + uploads["files_deleted"]
+        + outputs["files_deleted"],
+        bytes_reclaimed=sessions["bytes_reclaimed"]
+        + uploads["bytes_reclaimed"]
+        + outputs["bytes_reclaimed"],
+        seconds=time.perf_counter() - started,
+    )
+    print(
+        f"Cleanup removed {sessions['sessions_deleted']} session(s) and "
+        f"{metrics['files_deleted']} file(s), reclaiming "
+        f"{metrics['bytes_reclaimed']} bytes in {metrics['seconds']:.3f}s"
+    )
+    return metrics
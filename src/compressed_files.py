@@ -0,0 +1,93 @@
+"""
+Read trade histories uploaded compressed, as .csv.gz or as a zip holding one
+CSV or XLSX, decompressing them as they are read. Reading fails with a
+ValueError once more than max_bytes have come out, so a small upload cannot
+expand without bound.
+"""
+
+import gzip
+import io
+import os
+import zipfile
+import zlib
+from contextlib import contextmanager
+
+COMPRESSED_SUFFIXES = (".csv.gz", ".zip")
+ARCHIVED_SUFFIXES = (".csv", ".xlsx")
+
+
+def _too_large(name, max_bytes):
+    return f"{name} is larger than {max_bytes / 2**20:g}MB once decompressed"
+
+
+class _CappedReader(io.RawIOBase):
+    """Reads a decompressing stream, failing once it gives more than max_bytes"""
+
+    def __init__(self, stream, max_bytes, name):
+        self._stream = stream
+        self._max_bytes = max_bytes
+        self._name = name
+        self._read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        try:
+            n = self._stream.readinto(b)
+        except (OSError, EOFError, zlib.error, zipfile.BadZipFile) as e:
+            raise ValueError(f"{self._name} could not be decompressed: {e}") from e
+        self._read += n
+        if self._read > self._max_bytes:
+            raise ValueError(_too_large(self._name, self._max_bytes))
+        return n
+
+    def close(self):
+        self._stream.close()
+        super().close()
+
+
+def _archived_member(archive, path):
+    """The one trade history of a zip, ignoring directories and macOS metadata"""
+    members = [
+        info
+        for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX")
+        and info.filename.lower().endswith(ARCHIVED_SUFFIXES)
+    ]
+    if len(members) != 1:
+        raise ValueError(
+            f"{os.path.basename(path)} must hold exactly one CSV or XLSX trade "
+            f"history, found {len(members)}"
+        )
+    return members[0]
+
+
+@contextmanager
+def open_decompressed(path, max_bytes):
+    """
+    Yield the name of the trade history in a .csv.gz or .zip file and a binary
+    stream decompressing it
+    """
+    if path.lower().endswith(".gz"):
+        name = os.path.basename(path)[: -len(".gz")]
+        stream = _CappedReader(gzip.open(path, "rb"), max_bytes, name)
+        with io.BufferedReader(stream) as f:
+            yield name, f
+        return
+
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"{os.path.basename(path)} is not a valid zip file") from e
+    with archive:
+        info = _archived_member(archive, path)
+        name = os.path.basename(info.filename)
+        # The declared size rejects most bombs before anything is decompressed
+        if info.file_size > max_bytes:
+            raise ValueError(_too_large(name, max_bytes))
+        stream = _CappedReader(archive.open(info), max_bytes, name)
+        with io.BufferedReader(stream) as f:
+            yield name, f
+
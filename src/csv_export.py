@@ -0,0 +1,93 @@
+"""
+Export a session's results as a zip of CSVs, one per financial year, generated
+while it is sent. The pairs are memory-mapped from the results file and written
+a batch of rows at a time, so neither the CSVs nor the zip is ever held whole.
+"""
+
+import csv
+import io
+import os
+import time
+import zipfile
+
+import pandas as pd
+
+from results import load_pair_years, load_results
+
+CSV_HEADER = ["symbol", "buy_date", "sell_date", "sold_quantity", "per_unit_gain"]
+# In the order of the Excel report's summary
+SUMMARY_LABELS = {
+    "total_capital_gain": "Total Capital Gain",
+    "loss": "Loss",
+    "capital_gain_discount": "Capital Gains Discount",
+    "taxable_capital_gain": "Taxable Capital Gain",
+}
+
+
+class _Chunks(io.RawIOBase):
+    """An unseekable sink keeping what is written until it is taken"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _pairs_frame(symbol, pairs, start, end):
+    return pd.DataFrame(
+        {
+            "symbol": symbol,
+            # Short sells have no buy
+            "buy_date": pd.Series(pairs.buy_date[start:end])
+            .dt.strftime("%Y-%m-%d")
+            .fillna(""),
+            "sell_date": pd.Series(pairs.sell_date[start:end]).dt.strftime("%Y-%m-%d"),
+            "sold_quantity": pairs.quantity[start:end],
+            "per_unit_gain": pairs.per_unit_gain[start:end],
+        }
+    )
+
+
+def iter_results_csv_zip(results_path, batch_rows=50_000):
+    """
+    Yield the bytes of a zip holding cgt_<fy>.csv for each financial year whose
+    pairs are in the results file: its pairs, then its summary rows below a blank row
+    """
+    results_per_fy = load_results(results_path, mmap=True)
+    # Members are dated by the results file, so the same results always zip to
+    # the same bytes and the download's ETag holds
+    date_time = time.localtime(os.path.getmtime(results_path))[:6]
+    sink = _Chunks()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for fy in load_pair_years(results_path):
+            fy_results = results_per_fy[fy]
+            member_info = zipfile.ZipInfo(f"cgt_{fy}.csv", date_time=date_time)
+            member_info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(member_info, "w") as member, io.TextIOWrapper(
+                member, encoding="utf-8", newline=""
+            ) as text:
+                writer = csv.writer(text)
+                writer.writerow(CSV_HEADER)
+                for symbol, pairs in fy_results["buy_and_sell_pairs"].items():
+                    for start in range(0, len(pairs.quantity), batch_rows):
+                        _pairs_frame(symbol, pairs, start, start + batch_rows).to_csv(
+                            text, header=False, index=False
+                        )
+                        text.flush()
+                        yield sink.take()
+
+                writer.writerow([])
+                for field, label in SUMMARY_LABELS.items():
+                    writer.writerow([label, fy_results[field]])
+            yield sink.take()
+    yield sink.take()
@@ -0,0 +1,125 @@
+"""
+Serve report files with validators, so repeated downloads are answered with
+304 Not Modified and interrupted ones can resume with a Range request. Small
+reports are served from memory, and the web server can be left to send the
+file itself with X-Sendfile or X-Accel-Redirect.
+"""
+
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+from werkzeug.utils import send_file
+
+OFFLOAD_MODES = ("x-sendfile", "x-accel-redirect")
+
+
+def file_etag(stat):
+    """
+    Strong ETag of a file from its modification time and size, formatted as
+    nginx formats its own so offloaded and proxied downloads validate alike.
+    Reports are written once and never modified in place.
+    """
+    return f"{int(stat.st_mtime):x}-{stat.st_size:x}"
+
+
+class ReportCache:
+    """
+    Contents of recently downloaded small files, least recently used evicted
+    first. Entries are keyed by path, modification time and size so a file
+    replaced on disk is read again.
+    """
+
+    def __init__(self, max_file_bytes, max_total_bytes):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def cacheable(self, stat):
+        return stat.st_size <= self.max_file_bytes
+
+    def get(self, path, stat):
+        """The file's contents, read from disk if not cached"""
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self._total_bytes += len(data)
+            while self._total_bytes > self.max_total_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+        return data
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _accel_redirect(path, stat, mimetype, download_name, output_folder, accel_prefix):
+    """Hand the file to nginx, which answers conditional and Range requests itself"""
+    relative_path = os.path.relpath(path, output_folder)
+    response = current_app.response_class(mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+    response.set_etag(file_etag(stat))
+    response.last_modified = stat.st_mtime
+    response = response.make_conditional(request.environ)
+    if response.status_code != 304:
+        response.headers["X-Accel-Redirect"] = accel_prefix.rstrip("/") + "/" + relative_path
+    return response
+
+
+def send_report(
+    path,
+    mimetype,
+    download_name,
+    cache=None,
+    offload=None,
+    output_folder=None,
+    accel_prefix="/protected-outputs/",
+):
+    """
+    Response sending the file at path as an attachment with an ETag, answering
+    If-None-Match and Range requests. With offload the web server sends the
+    file instead: "x-sendfile" passes it the absolute path, "x-accel-redirect"
+    the path below output_folder under nginx's internal accel_prefix location.
+    Otherwise files the cache accepts are sent from memory. Raises
+    FileNotFoundError when the file is gone.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+
+    if offload == "x-accel-redirect":
+        return _accel_redirect(
+            path, stat, mimetype, download_name, output_folder, accel_prefix
+        )
+
+    if offload is None and cache is not None and cache.cacheable(stat):
+        path_or_file = io.BytesIO(cache.get(path, stat))
+    else:
+        path_or_file = path
+
+    response = send_file(
+        path_or_file,
+        request.environ,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=download_name,
+        etag=file_etag(stat),
+        last_modified=stat.st_mtime,
+        use_x_sendfile=offload == "x-sendfile",
+        response_class=current_app.response_class,
+    )
+    response.cache_control.private = True
+    return response
@@ -0,0 +1,36 @@
+"""
+Fixed-point representation of trade quantities and amounts.
+
+Quantities are held as integer units of 1/QUANTITY_SCALE of a share, so that
+fractional shares and split adjustments stay exact, and amounts as integer
+cents. The scale keeps 8 decimal places, enough for crypto such as bitcoin. Convert back to shares and dollars only when reporting.
+"""
+
+import numpy as np
+
+QUANTITY_SCALE = 100_000_000  # units per share, 8 decimal places as for bitcoin
+
+
+def to_units(shares):
+    return np.rint(np.asarray(shares, dtype=np.float64) * QUANTITY_SCALE).astype(
+        np.int64
+    )
+
+
+def to_cents(dollars):
+    return np.rint(np.asarray(dollars, dtype=np.float64) * 100).astype(np.int64)
+
+
+def to_shares(units):
+    return np.asarray(units, dtype=np.float64) / QUANTITY_SCALE
+
+
+def unit_price(amount_cents, units):
+    """
+    Dollars per share of a trade of units for amount_cents. Raises ValueError
+    for trades without units, whose price is undefined.
+    """
+    units = np.asarray(units)
+    if (units <= 0).any():
+        raise ValueError("Trades need a positive quantity to be priced")
+    return (np.asarray(amount_cents) / 100) / to_shares(units)
@@ -0,0 +1,183 @@
+"""
+Size estimates of report calculations and a shortest-job-first scheduler.
+
+A trade history is estimated right after parsing, before any market data lookup
+or LP. Small jobs then run first on a shared lane, while jobs estimated above a
+threshold go to a separate lane with its own worker and a bounded queue, so one
+very large history does not hold up everyone else. Queued jobs age, so a steady
+stream of small jobs cannot starve a medium one.
+"""
+
+from dataclasses import asdict, dataclass
+import heapq
+import itertools
+import threading
+import time
+
+from market_data_api import REQUEST_INTERVAL_SECONDS
+
+# Rough costs measured on the test trade history
+SECONDS_PER_SYMBOL_YEAR = 0.005  # selecting a symbol's trades for a year
+SECONDS_PER_SOLVE = 0.003
+SECONDS_PER_LP_EDGE = 0.00005
+SECONDS_PER_MARKET_DATA_LOOKUP = 0.5 + REQUEST_INTERVAL_SECONDS
+
+
+@dataclass(frozen=True)
+class JobEstimate:
+    trades: int
+    symbols: int
+    financial_years: int
+    solves: int  # symbol years with sells, each solving an LP
+    lp_edges: int  # upper bound on LP variables: buys to date times the year's sells
+    uncached_symbols: int  # symbols needing an Alpha Vantage request
+    seconds: float
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def estimate_job(trades_df, uncached_symbols=0, target_fy=None):
+    """Estimate the work of calculating a normalised trades DataFrame"""
+    if target_fy is not None:
+        trades_df = trades_df[trades_df["fy"] <= target_fy]
+
+    counts = (
+        trades_df.groupby(["symbol", "fy", "side"], observed=True)
+        .size()
+        .unstack("side", fill_value=0)
+        .reindex(columns=["BUY", "SELL"], fill_value=0)
+    )
+    buys_to_date = counts["BUY"].groupby(level="symbol").cumsum()
+    lp_edges = int((buys_to_date * counts["SELL"]).sum())
+    solves = int((counts["SELL"] > 0).sum())
+    symbols = int(trades_df["symbol"].nunique())
+    financial_years = int(trades_df["fy"].nunique())
+
+    seconds = (
+        symbols * financial_years * SECONDS_PER_SYMBOL_YEAR
+        + solves * SECONDS_PER_SOLVE
+        + lp_edges * SECONDS_PER_LP_EDGE
+        + uncached_symbols * SECONDS_PER_MARKET_DATA_LOOKUP
+    )
+    return JobEstimate(
+        trades=len(trades_df),
+        symbols=symbols,
+        financial_years=financial_years,
+        solves=solves,
+        lp_edges=lp_edges,
+        uncached_symbols=int(uncached_symbols),
+        seconds=seconds,
+    )
+
+
+class SchedulerFull(Exception):
+    pass
+
+
+class _Lane:
+    def __init__(self, name, workers, max_queued=None):
+        self.name = name
+        self.workers = workers
+        self.max_queued = max_queued
+        # heap of (priority, sequence, estimated seconds, job id, function)
+        self.queue = []
+        self.running = {}  # key: job id, value: (estimated seconds, start time)
+        self.threads = []
+
+
+class JobScheduler:
+    """
+    Runs submitted jobs on worker threads, shortest estimated job first.
+    Jobs estimated above large_job_seconds run on a separate lane whose queue
+    holds at most max_large_queued jobs. Every second a job waits takes aging
+    seconds off its estimate when ordering the queue.
+    """
+
+    def __init__(
+        self,
+        workers=2,
+        large_workers=1,
+        large_job_seconds=30.0,
+        max_large_queued=4,
+        aging=1.0,
+    ):
+        self.large_job_seconds = large_job_seconds
+        self.aging = aging
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._small = _Lane("small", workers)
+        self._large = _Lane("large", large_workers, max_large_queued)
+
+    def _lane(self, estimate):
+        return self._large if estimate.seconds > self.large_job_seconds else self._small
+
+    def submit(self, job_id, estimate, function):
+        """
+        Queue function to run as job_id, returning its lane and ETA in seconds.
+        Raises SchedulerFull when the large lane's queue is full.
+        """
+        with self._condition:
+            lane = self._lane(estimate)
+            if lane.max_queued is not None and len(lane.queue) >= lane.max_queued:
+                raise SchedulerFull(
+                    "Too many large trade histories are queued, please try again later"
+                )
+            # All queued jobs age alike, so ordering by estimate plus submission
+            # time weighted by aging ranks them as their aged estimates would
+            priority = estimate.seconds + time.monotonic() * self.aging
+            entry = (priority, next(self._sequence), estimate.seconds, job_id, function)
+            heapq.heappush(lane.queue, entry)
+            eta = self._eta(lane, entry)
+            if len(lane.threads) < lane.workers:
+                thread = threading.Thread(target=self._work, args=(lane,), daemon=True)
+                thread.start()
+                lane.threads.append(thread)
+            self._condition.notify_all()
+        return lane.name, eta
+
+    def eta(self, job_id):
+        """Seconds until job_id is expected to finish, None when it is not here"""
+        with self._condition:
+            for lane in (self._small, self._large):
+                if job_id in lane.running:
+                    seconds, started = lane.running[job_id]
+                    return max(seconds - (time.monotonic() - started), 0.0)
+                for entry in lane.queue:
+                    if entry[3] == job_id:
+                        return self._eta(lane, entry)
+        return None
+
+    def job_ids(self):
+        """Ids of the jobs queued or running here"""
+        with self._condition:
+            return [
+                job_id
+                for lane in (self._small, self._large)
+                for job_id in [*lane.running, *(entry[3] for entry in lane.queue)]
+            ]
+
+    def _eta(self, lane, entry):
+        """Queued work ahead of entry spread over the lane's workers, plus its own"""
+        now = time.monotonic()
+        running = sum(
+            max(seconds - (now - started), 0.0)
+            for seconds, started in lane.running.values()
+        )
+        ahead = sum(other[2] for other in lane.queue if other[:2] < entry[:2])
+        return (running + ahead) / lane.workers + entry[2]
+
+    def _work(self, lane):
+        while True:
+            with self._condition:
+                while not lane.queue:
+                    self._condition.wait()
+                _, _, seconds, job_id, function = heapq.heappop(lane.queue)
+                lane.running[job_id] = (seconds, time.monotonic())
+            try:
+                function()
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+            finally:
+                with self._condition:
+                    del lane.running[job_id]
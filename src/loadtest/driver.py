@@ -0,0 +1,227 @@
+"""
+Replay concurrent upload -> pay -> download flows against a running app.
+
+Start the stubs and the app as described in loadtest/stub_servers.py, then run
+from the src directory:
+    python -m loadtest.driver --app-url http://127.0.0.1:8000 \
+        --stripe-url http://127.0.0.1:8102 --flows 200 --concurrency 16
+"""
+
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import io
+import json
+import random
+import threading
+import time
+
+import requests
+
+
+def synthetic_trade_history(seed, symbols=10, trades_per_symbol=20):
+    """
+    CSV in the generic upload format. Every symbol is bought before it is sold
+    and never sold short, so the calculation always succeeds.
+    """
+    rng = random.Random(seed)
+    rows = ["trade_date,symbol,side,quantity,transaction_amount"]
+    for symbol_index in range(symbols):
+        symbol = f"S{seed % 997:03d}{symbol_index:02d}"
+        trade_date = date(2018, 7, 1) + timedelta(days=rng.randint(0, 365))
+        position = 0
+        price = rng.uniform(5, 200)
+        for _ in range(trades_per_symbol):
+            trade_date += timedelta(days=rng.randint(1, 60))
+            price *= rng.uniform(0.9, 1.12)
+            if position and rng.random() < 0.4:
+                quantity = rng.randint(1, position)
+                side = "SELL"
+                position -= quantity
+            else:
+                quantity = rng.randint(10, 500)
+                side = "BUY"
+                position += quantity
+            rows.append(
+                f"{trade_date.day}/{trade_date.month}/{trade_date.year},{symbol}.ASX,"
+                f"{side},{quantity},{quantity * price + 19.95:.2f}"
+            )
+    return "\n".join(rows).encode()
+
+
+class Recorder:
+    """Thread safe collection of per endpoint latencies and errors"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def call(self, endpoint, method, url, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = requests.request(method, url, timeout=300, **kwargs)
+            ok = response.status_code in expected
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - started
+
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+        return response if ok else None
+
+
+def run_flow(recorder, app_url, stripe_url, seed, symbols, trades_per_symbol):
+    """One customer: upload, create and confirm a payment, verify it and download"""
+    csv_bytes = synthetic_trade_history(seed, symbols, trades_per_symbol)
+    response = recorder.call(
+        "upload",
+        "POST",
+        f"{app_url}/api/upload",
+        expected=(202,),
+        files={"file": (f"history_{seed}.csv", io.BytesIO(csv_bytes), "text/csv")},
+    )
+    if response is None:
+        return False
+
+    # The calculation is queued, poll until it finishes
+    job_id = response.json()["job_id"]
+    queued = time.perf_counter()
+    job = response.json()
+    while job["status"] in ("queued", "running"):
+        time.sleep(0.2)
+        response = recorder.call("job-status", "GET", f"{app_url}/api/jobs/{job_id}")
+        if response is None:
+            return False
+        job = response.json()
+    with recorder.lock:
+        recorder.latencies["job"].append(time.perf_counter() - queued)
+        if job["status"] != "done":
+            recorder.errors["job"] += 1
+    if job["status"] != "done":
+        return False
+    session_id = job["session_id"]
+
+    response = recorder.call(
+        "create-payment-intent",
+        "POST",
+        f"{app_url}/api/create-payment-intent",
+        json={"session_id": session_id},
+    )
+    if response is None:
+        return False
+    payment_intent_id = response.json()["clientSecret"].split("_secret_")[0]
+
+    # Stands in for the browser confirming payment with Stripe.js
+    if (
+        recorder.call(
+            "stripe-confirm",
+            "POST",
+            f"{stripe_url}/v1/payment_intents/{payment_intent_id}/confirm",
+        )
+        is None
+    ):
+        return False
+
+    response = recorder.call(
+        "verify-payment",
+        "POST",
+        f"{app_url}/api/verify-payment",
+        json={"payment_intent_id": payment_intent_id, "session_id": session_id},
+    )
+    if response is None:
+        return False
+
+    response = recorder.call(
+        "download", "GET", f"{app_url}{response.json()['download_url']}"
+    )
+    return response is not None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarise(recorder, elapsed, flows, completed_flows):
+    endpoints = {}
+    for endpoint, latencies in recorder.latencies.items():
+        endpoints[endpoint] = dict(
+            requests=len(latencies),
+            errors=recorder.errors[endpoint],
+            error_rate=recorder.errors[endpoint] / len(latencies),
+            throughput_per_second=len(latencies) / elapsed,
+            p50_ms=percentile(latencies, 0.5) * 1000,
+            p99_ms=percentile(latencies, 0.99) * 1000,
+        )
+    return dict(
+        elapsed_seconds=elapsed,
+        flows=flows,
+        completed_flows=completed_flows,
+        flows_per_second=completed_flows / elapsed,
+        endpoints=endpoints,
+    )
+
+
+def print_summary(summary):
+    print(
+        f"\n{summary['completed_flows']}/{summary['flows']} flows completed in "
+        f"{summary['elapsed_seconds']:.2f}s ({summary['flows_per_second']:.2f} flows/s)"
+    )
+    print(
+        f"  {'endpoint':<24}{'requests':>9}{'req/s':>9}{'errors':>8}"
+        f"{'err %':>8}{'p50 ms':>10}{'p99 ms':>10}"
+    )
+    for endpoint, stats in summary["endpoints"].items():
+        print(
+            f"  {endpoint:<24}{stats['requests']:>9}"
+            f"{stats['throughput_per_second']:>9.2f}{stats['errors']:>8}"
+            f"{stats['error_rate'] * 100:>8.1f}"
+            f"{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay concurrent upload, payment and download flows."
+    )
+    parser.add_argument("--app-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--stripe-url", default="http://127.0.0.1:8102")
+    parser.add_argument("--flows", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--symbols", type=int, default=10)
+    parser.add_argument("--trades-per-symbol", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the summary to this JSON file")
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(
+            executor.map(
+                lambda flow: run_flow(
+                    recorder,
+                    args.app_url.rstrip("/"),
+                    args.stripe_url.rstrip("/"),
+                    args.seed + flow,
+                    args.symbols,
+                    args.trades_per_symbol,
+                ),
+                range(args.flows),
+            )
+        )
+    elapsed = time.perf_counter() - started
+
+    summary = summarise(recorder, elapsed, args.flows, sum(outcomes))
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
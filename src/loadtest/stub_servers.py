@@ -0,0 +1,195 @@
+"""
+Local stand-ins for the Alpha Vantage and Stripe APIs used by the app.
+
+Run from the src directory:
+    python -m loadtest.stub_servers --alpha-vantage-port 8101 --stripe-port 8102
+
+then start the app pointed at them:
+    ALPHAVANTAGE_BASE_URL=http://127.0.0.1:8101 ALPHAVANTAGE_REQUEST_INTERVAL=0 \\
+    STRIPE_API_BASE=http://127.0.0.1:8102 STRIPE_SECRET_KEY=sk_test_stub \\
+    gunicorn --chdir src "app:create_app()"
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import uuid
+import zlib
+
+
+def stub_splits(symbol):
+    """Deterministic split history, roughly one in four symbols has had a split"""
+    seed = zlib.crc32(symbol.encode())
+    if seed % 4:
+        return {"symbol": symbol, "data": []}
+    year = 2015 + seed % 10
+    return {
+        "symbol": symbol,
+        "data": [
+            {
+                "effective_date": f"{year}-0{1 + seed % 9}-15",
+                "split_factor": f"{2 + seed % 3}.0000",
+            }
+        ],
+    }
+
+
+def stub_overview(symbol):
+    return {
+        "Symbol": symbol,
+        "AssetType": "Common Stock",
+        "Name": f"{symbol} Stub Corp",
+        "Exchange": "NYSE",
+        "Currency": "USD",
+        "Country": "USA",
+    }
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    latency_seconds = 0.0
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_form(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return parse_qs(self.rfile.read(length).decode()) if length else {}
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AlphaVantageHandler(_StubHandler):
+    """Serves the SPLITS and OVERVIEW functions of /query"""
+
+    def do_GET(self):
+        time.sleep(self.latency_seconds)
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        symbol = params.get("symbol", "")
+        if url.path != "/query" or not symbol:
+            self._send_json(404, {"Error Message": "Invalid API call"})
+        elif params.get("function") == "SPLITS":
+            self._send_json(200, stub_splits(symbol))
+        elif params.get("function") == "OVERVIEW":
+            self._send_json(200, stub_overview(symbol))
+        else:
+            self._send_json(404, {"Error Message": "Invalid API call"})
+
+
+class StripeHandler(_StubHandler):
+    """
+    Serves PaymentIntent create, retrieve and confirm.
+    Confirm stands in for the browser completing payment with Stripe.js.
+    """
+
+    payment_intents = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        time.sleep(self.latency_seconds)
+        parts = urlparse(self.path).path.strip("/").split("/")
+        form = self._read_form()
+
+        if parts == ["v1", "payment_intents"]:
+            intent_id = f"pi_{uuid.uuid4().hex[:24]}"
+            intent = {
+                "id": intent_id,
+                "object": "payment_intent",
+                "amount": int(form.get("amount", ["0"])[0]),
+                "currency": form.get("currency", ["aud"])[0],
+                "client_secret": f"{intent_id}_secret_{uuid.uuid4().hex[:24]}",
+                "metadata": {
+                    key[len("metadata[") : -1]: values[0]
+                    for key, values in form.items()
+                    if key.startswith("metadata[")
+                },
+                "status": "requires_payment_method",
+            }
+            with self.lock:
+                self.payment_intents[intent_id] = intent
+            self._send_json(200, intent)
+        elif len(parts) == 4 and parts[:2] == ["v1", "payment_intents"] and parts[3] == "confirm":
+            with self.lock:
+                intent = self.payment_intents.get(parts[2])
+                if intent:
+                    intent["status"] = "succeeded"
+            self._send_stripe_intent(intent, parts[2])
+        else:
+            self._send_json(404, {"error": {"message": "Unrecognized request URL"}})
+
+    def do_GET(self):
+        time.sleep(self.latency_seconds)
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) == 3 and parts[:2] == ["v1", "payment_intents"]:
+            with self.lock:
+                intent = self.payment_intents.get(parts[2])
+            self._send_stripe_intent(intent, parts[2])
+        else:
+            self._send_json(404, {"error": {"message": "Unrecognized request URL"}})
+
+    def _send_stripe_intent(self, intent, intent_id):
+        if intent is None:
+            self._send_json(
+                404,
+                {
+                    "error": {
+                        "type": "invalid_request_error",
+                        "message": f"No such payment_intent: '{intent_id}'",
+                    }
+                },
+            )
+        else:
+            self._send_json(200, intent)
+
+
+def start_stub_server(handler_class, port, latency_seconds=0.0, host="127.0.0.1"):
+    """Start a stub server on a daemon thread and return it, port 0 picks a free port"""
+    handler = type(
+        handler_class.__name__, (handler_class,), {"latency_seconds": latency_seconds}
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-ins for Alpha Vantage and Stripe."
+    )
+    parser.add_argument("--alpha-vantage-port", type=int, default=8101)
+    parser.add_argument("--stripe-port", type=int, default=8102)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=50.0,
+        help="Delay added to every response to mimic the network",
+    )
+    args = parser.parse_args()
+
+    latency_seconds = args.latency_ms / 1000
+    alpha_vantage = start_stub_server(
+        AlphaVantageHandler, args.alpha_vantage_port, latency_seconds
+    )
+    stripe_server = start_stub_server(StripeHandler, args.stripe_port, latency_seconds)
+    print(f"Alpha Vantage stub on http://127.0.0.1:{alpha_vantage.server_port}")
+    print(f"Stripe stub on http://127.0.0.1:{stripe_server.server_port}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        alpha_vantage.shutdown()
+        stripe_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,168 +1,447 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import time
+
 import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 from scipy.optimize import linprog
 import pandas as pd
 
+from fixed_point import QUANTITY_SCALE, to_shares
+
+
+class LPSolveError(RuntimeError):
+    """A symbol year's LP had no optimal solution, e.g. as more was sold than held"""
+
+    def __init__(self, symbol, message):
+        super().__init__(symbol, message)
+        self.symbol = symbol
+        self.message = message
+
+    def __str__(self):
+        return (
+            f"LP did not solve successfully for symbol: {self.symbol}\n"
+            f"Error Message: {self.message}"
+        )
+
 
 def is_long_term(buy_date, sell_date):
     # ATO requires >12 months: exclude both acquisition day and CGT event day.
     return (sell_date - buy_date).days > 365
 
 
-def minimise_tax_for_symbol_year(buys, sells, symbol):
+@dataclass(frozen=True, eq=False)
+class SymbolYearModel:
+    """
+    The LP of one symbol in one financial year: its buy parcels and sells, and
+    the eligible (buy, sell) matches which are the LP's variables. Matches are
+    ordered by sell, then by buy.
+    """
+
+    buys: pd.DataFrame  # columns [id, trade_date, qty_avail, unit_price]
+    sells: pd.DataFrame  # columns [id, trade_date, quantity, unit_price]
+    # Quantities are integer units (see fixed_point), unit prices dollars per share
+    edge_buy: np.ndarray  # position in buys of each match
+    edge_sell: np.ndarray  # position in sells of each match
+    gain: np.ndarray  # per-share raw gain of each match
+    long_term: np.ndarray
+
+
+def _match_sells(buys, sells, sell_offset=0):
+    """Vectorised eligibility of every buy for every sell"""
+    buy_dates = buys["trade_date"].to_numpy(dtype="datetime64[ns]")
+    sell_dates = sells["trade_date"].to_numpy(dtype="datetime64[ns]")
+    eligible = (
+        (buy_dates[np.newaxis, :] <= sell_dates[:, np.newaxis])
+        & (buys["qty_avail"].to_numpy(dtype=np.int64) > 0)[np.newaxis, :]
+        & (sells["quantity"].to_numpy(dtype=np.int64) > 0)[:, np.newaxis]
+    )
+    edge_sell, edge_buy = np.nonzero(eligible)
+    gain = (
+        sells["unit_price"].to_numpy(dtype=np.float64)[edge_sell]
+        - buys["unit_price"].to_numpy(dtype=np.float64)[edge_buy]
+    )
+    held_days = (sell_dates[edge_sell] - buy_dates[edge_buy]) // np.timedelta64(1, "D")
+    return edge_buy, edge_sell + sell_offset, gain, held_days > 365
+
+
+def build_symbol_year_model(buys, sells):
     """
     buys: DataFrame with columns [id, trade_date, qty_avail, unit_price] for parcels with buy_date <= latest sell
     sells: DataFrame with columns [id, trade_date, quantity, unit_price]
-    Returns dict with optimal taxable gain and breakdown, plus parcel assignments.
+    Quantities are integer units, unit prices dollars per share.
     """
+    buys = buys.reset_index(drop=True)
+    sells = sells.reset_index(drop=True)
+    edge_buy, edge_sell, gain, long_term = _match_sells(buys, sells)
+    return SymbolYearModel(buys, sells, edge_buy, edge_sell, gain, long_term)
+
+
+def add_sell(model, sell_id, trade_date, quantity, unit_price):
+    """
+    Extend a model with one more sell, matching only the new sell against the
+    buys. Gives the same LP as building the model with the sell appended.
+    """
+    sell = pd.DataFrame(
+        [[sell_id, pd.Timestamp(trade_date), int(quantity), float(unit_price)]],
+        columns=["id", "trade_date", "quantity", "unit_price"],
+    )
+    edge_buy, edge_sell, gain, long_term = _match_sells(
+        model.buys, sell, sell_offset=len(model.sells)
+    )
+    return SymbolYearModel(
+        model.buys,
+        pd.concat([model.sells, sell], ignore_index=True),
+        np.concatenate([model.edge_buy, edge_buy]),
+        np.concatenate([model.edge_sell, edge_sell]),
+        np.concatenate([model.gain, gain]),
+        np.concatenate([model.long_term, long_term]),
+    )
 
-    if sells.empty:
-        return dict(
-            short_term=0.0,
-            long_term=0.0,
-            loss=0.0,
-            x=pd.DataFrame(columns=["buy_id", "sell_id", "quantity"]),
-        )
 
-    # Build edge list (eligible matches)
-    edges = []
-    for _, sell_row in sells.iterrows():
-        for _, buy_row in buys.iterrows():
-            if (
-                buy_row["trade_date"] <= sell_row["trade_date"]
-                and buy_row["qty_avail"] > 0
-                and sell_row["quantity"] > 0
-            ):
-                gain = (
-                    sell_row["unit_price"] - buy_row["unit_price"]
-                )  # per-share raw gain
-                long_term = is_long_term(buy_row["trade_date"], sell_row["trade_date"])
-                edges.append((buy_row["id"], sell_row["id"], gain, long_term))
-
-    # Index mapping
-    buy_ids = list(buys["id"])
-    sell_ids = list(sells["id"])
+# linprog methods: HiGHS choosing for itself, its dual simplex, or its interior point
+SOLVER_METHODS = ("highs", "highs-ds", "highs-ipm")
+
+# Matchings with the same A' + 0.5 B' can still differ in loss, and in how their
+# gain splits between short and long term, which changes the year's taxable gain
+# once losses are netted. Ties are broken towards more loss, then towards short
+# term gains, which losses offset before the discount, so every solve, whole or
+# decomposed, lands on the same totals. Each tie break is solved over the optimal
+# matchings of the objective before it: matches with a reduced cost above the
+# tolerance are fixed at zero and buys whose capacity has a dual are used up,
+# which leaves exactly the optimal face (complementary slackness) and keeps its
+# vertices integral. HiGHS's dual feasibility tolerance is 1e-7, so ties closer
+# than that per share are treated as ties.
+DUAL_TOLERANCE = 1e-7
+
+
+def _sparse_rows(row_blocks, shape):
+    """Assemble a sparse matrix from (row, col, value) blocks, dropping zeros"""
+    rows, cols, values = (np.concatenate(parts) for parts in zip(*row_blocks))
+    nonzero = values != 0
+    return sparse.csc_array(
+        (values[nonzero], (rows[nonzero], cols[nonzero])), shape=shape
+    )
+
+
+def _flat_position_segments(model):
+    """
+    Number the stretches between dates on which the running position of the
+    model's buys and sells is flat. Sells up to a flat date use up every buy
+    before it, so later sells can only match buys of their own stretch.
+    Returns the segment of each buy and of each sell.
+    """
+    num_buys = len(model.buys)
+    dates = np.concatenate(
+        [
+            model.buys["trade_date"].to_numpy(dtype="datetime64[ns]"),
+            model.sells["trade_date"].to_numpy(dtype="datetime64[ns]"),
+        ]
+    )
+    deltas = np.concatenate(
+        [
+            model.buys["qty_avail"].to_numpy(dtype=np.int64),
+            -model.sells["quantity"].to_numpy(dtype=np.int64),
+        ]
+    )
+    is_sell = np.arange(len(dates)) >= num_buys
+    # Buys count towards sells on the same date
+    order = np.lexsort((is_sell, dates))
+    sorted_dates = dates[order]
+    last_of_date = np.append(sorted_dates[1:] != sorted_dates[:-1], True)
+    flat = (np.cumsum(deltas[order]) == 0) & last_of_date
+    segments = np.empty(len(dates), dtype=np.int64)
+    segments[order] = np.concatenate([[0], np.cumsum(flat[:-1])])
+    return segments[:num_buys], segments[num_buys:]
+
+
+def _components(model):
+    """
+    Split a model into independent LPs: matches across flat position dates are
+    dropped, then the buys and sells left connected by matches form each LP.
+    Yields the positions of each component's buys, sells and matches.
+    """
+    num_buys = len(model.buys)
+    num_sells = len(model.sells)
+    buy_segments, sell_segments = _flat_position_segments(model)
+    edges = np.flatnonzero(
+        buy_segments[model.edge_buy] == sell_segments[model.edge_sell]
+    )
+    graph = sparse.coo_array(
+        (
+            np.ones(len(edges)),
+            (model.edge_buy[edges], num_buys + model.edge_sell[edges]),
+        ),
+        shape=(num_buys + num_sells, num_buys + num_sells),
+    )
+    num_components, labels = connected_components(graph, directed=False)
+
+    def group(position_labels):
+        """Positions with each label, in increasing order"""
+        order = np.argsort(position_labels, kind="stable")
+        bounds = np.searchsorted(position_labels[order], np.arange(num_components + 1))
+        return [order[bounds[c] : bounds[c + 1]] for c in range(num_components)]
+
+    buys = group(labels[:num_buys])
+    sells = group(labels[num_buys:])
+    component_edges = group(labels[model.edge_buy[edges]])
+    for component in range(num_components):
+        yield buys[component], sells[component], edges[component_edges[component]]
+
+
+def _solve_lp(model, buys, sells, edges, symbol, method, options):
+    """
+    Solve the LP over the given buys, sells and matches of a model.
+    Returns the units of each match and the diagnostics of the solve.
+    """
+    edge_buy = np.searchsorted(buys, model.edge_buy[edges])
+    edge_sell = np.searchsorted(sells, model.edge_sell[edges])
+    gain = model.gain[edges]
+    long_term = model.long_term[edges]
 
     # Variable order: x_e for each edge e, then A_prime, R, B_prime
     num_edges = len(edges)
+    num_buys = len(buys)
+    num_sells = len(sells)
     Ap_idx, Lp_idx, Bp_idx = num_edges, num_edges + 1, num_edges + 2
-    c = np.zeros(num_edges + 3)
-    c[Ap_idx] = 1.0
-    c[Bp_idx] = 0.5  # minimise A' + 0.5 B'
 
-    bounds = [(0, None)] * (num_edges + 3)  # x_e >=0; A',R,B' >=0
+    def objective(A_prime, L_prime, B_prime):
+        c = np.zeros(num_edges + 3)
+        c[[Ap_idx, Lp_idx, Bp_idx]] = A_prime, L_prime, B_prime
+        return c
 
-    # Equality constraints: for each sell, sum x_e = qty
-    # Ensures that the sum of buy units linked to a sell equals the sell quantity
-    A_eq = []
-    b_eq = []
-    for sell_id_1 in sell_ids:
-        row = np.zeros(num_edges + 3)
-        for k, (_, sell_id_2, _, _) in enumerate(edges):
-            if sell_id_2 == sell_id_1:
-                row[k] = 1.0
-        A_eq.append(row)
-        quantity = float(sells.loc[sells["id"] == sell_id_1, "quantity"].values[0])
-        b_eq.append(quantity)
+    bounds = np.zeros((num_edges + 3, 2))  # x_e >=0; A',R,B' >=0
+    bounds[:, 1] = np.inf
 
-    # Inequalities:
-    A_ub = []
-    b_ub = []
-
-    # (1) Buy capacities: sum_j x_ij <= qty_i
-    # Ensures that the sum of sell units linked to a buy doesn't exceed the buy quantity
-    for buy_id_1 in buy_ids:
-        row = np.zeros(num_edges + 3)
-        for k, (buy_id_2, _, _, _) in enumerate(edges):
-            if buy_id_2 == buy_id_1:
-                row[k] = 1.0
-        cap = float(buys.loc[buys["id"] == buy_id_1, "qty_avail"].values[0])
-        A_ub.append(row)
-        b_ub.append(cap)
-
-    # Helper to build linear forms for A, B, L
+    # Linear forms for A, B, L
     # A: sum over ST & g>0 of g*x
     # B: sum over LT & g>0 of g*x
     # L: sum over g<=0 of (-g)*x
-    A_row = np.zeros(num_edges + 3)
-    B_row = np.zeros(num_edges + 3)
-    L_row = np.zeros(num_edges + 3)
-    for k, (_, _, gain, long_term) in enumerate(edges):
-        if gain > 0:
-            if long_term:
-                B_row[k] = gain
-            else:
-                A_row[k] = gain
-        else:
-            L_row[k] = -gain  # positive number
-
-    # Must be nagetive because upper bound cannot be infinity
-    A_ub.append(-A_row)
-    b_ub.append(0.0)
-    A_ub.append(-B_row)
-    b_ub.append(0.0)
-    A_ub.append(-L_row)
-    b_ub.append(0.0)
-
-    # Rows which contain solution variables
-    A_prime_row = np.zeros(num_edges + 3)
-    A_prime_row[Ap_idx] = 1
-    B_prime_row = np.zeros(num_edges + 3)
-    B_prime_row[Bp_idx] = 1
-    L_prime_row = np.zeros(num_edges + 3)
-    L_prime_row[Lp_idx] = 1
-
-    # Enforcing that the result is stored in the solution variable
-    A_eq.append(A_prime_row - A_row)
-    b_eq.append(0)
-
-    A_eq.append(B_prime_row - B_row)
-    b_eq.append(0)
-
-    A_eq.append(L_prime_row - L_row)
-    b_eq.append(0)
-
-    A_ub = np.vstack(A_ub) if A_ub else None
-    b_ub = np.array(b_ub) if b_ub else None
-
-    A_eq = np.vstack(A_eq) if A_eq else None
-    b_eq = np.array(b_eq) if b_eq else None
-
-    # minimise c @ x
-    # A_ub @ x <= b_ub
-    # A_eq @ x == b_eq
-    res = linprog(
-        c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=bounds, method="highs"
-    )
-    if res.status != 0:
-        raise RuntimeError(
-            f"LP did not solve successfully for symbol: {symbol}\n"
-            f"Error Message: {res.message}"
-        ) 
-
-    xsol = res.x[:num_edges]
-    A_prime = res.x[Ap_idx]
-    B_prime = res.x[Bp_idx]
-    L_prime = res.x[Lp_idx]
+    edge_range = np.arange(num_edges)
+    positive = gain > 0
+    A_coef = np.where(positive & ~long_term, gain, 0.0)
+    B_coef = np.where(positive & long_term, gain, 0.0)
+    L_coef = np.where(positive, 0.0, -gain)  # positive number
+    ones = np.ones(num_edges)
+
+    def form_row(row, coef):
+        return np.full(num_edges, row), edge_range, coef
+
+    def solution_variable(row, idx):
+        return np.array([row]), np.array([idx]), np.array([1.0])
+
+    # Inequalities:
+    # (1) Buy capacities: sum_j x_ij <= qty_i
+    # Ensures that the sum of sell units linked to a buy doesn't exceed the buy quantity
+    # (2) A, B, L >= 0, negated because upper bound cannot be infinity
+    A_ub = _sparse_rows(
+        [
+            (edge_buy, edge_range, ones),
+            form_row(num_buys, -A_coef),
+            form_row(num_buys + 1, -B_coef),
+            form_row(num_buys + 2, -L_coef),
+        ],
+        shape=(num_buys + 3, num_edges + 3),
+    )
+    # The LP is solved in shares, which keeps its coefficients well scaled
+    b_ub = np.concatenate(
+        [to_shares(model.buys["qty_avail"].to_numpy()[buys]), np.zeros(3)]
+    )
+
+    # Equality constraints: for each sell, sum x_e = qty
+    # Ensures that the sum of buy units linked to a sell equals the sell quantity
+    # Then enforce that the result is stored in the solution variables
+    A_eq = _sparse_rows(
+        [
+            (edge_sell, edge_range, ones),
+            solution_variable(num_sells, Ap_idx),
+            form_row(num_sells, -A_coef),
+            solution_variable(num_sells + 1, Bp_idx),
+            form_row(num_sells + 1, -B_coef),
+            solution_variable(num_sells + 2, Lp_idx),
+            form_row(num_sells + 2, -L_coef),
+        ],
+        shape=(num_sells + 3, num_edges + 3),
+    )
+    b_eq = np.concatenate(
+        [to_shares(model.sells["quantity"].to_numpy()[sells]), np.zeros(3)]
+    )
+
+    # Minimise A' + 0.5 B', then break its ties (see DUAL_TOLERANCE) by
+    # maximising L', then A'
+    stages = [
+        (objective(1.0, 0.0, 0.5), None),
+        (objective(0.0, -1.0, 0.0), L_coef),
+        (objective(-1.0, 0.0, 0.0), A_coef),
+    ]
+    diagnostics = dict(
+        method=method,
+        status=0,
+        message=None,
+        iterations=0,
+        solve_seconds=0.0,
+        rows=A_ub.shape[0] + A_eq.shape[0],
+        columns=num_edges + 3,
+        nonzeros=A_ub.nnz + A_eq.nnz,
+    )
+    for c, coef in stages:
+        # A tie break is only solved if some optimal match could change it
+        if coef is not None and not coef[bounds[:num_edges, 1] > 0].any():
+            continue
+
+        # minimise c @ x
+        # A_ub @ x <= b_ub
+        # A_eq @ x == b_eq
+        started = time.perf_counter()
+        res = linprog(
+            c,
+            A_ub=A_ub if A_ub.shape[0] else None,
+            b_ub=b_ub if A_ub.shape[0] else None,
+            A_eq=A_eq,
+            b_eq=b_eq,
+            bounds=bounds,
+            method=method,
+            options=options or None,
+        )
+        diagnostics.update(
+            status=int(res.status),
+            message=res.message,
+            iterations=diagnostics["iterations"] + int(res.nit),
+            solve_seconds=diagnostics["solve_seconds"] + time.perf_counter() - started,
+        )
+        if res.status != 0:
+            raise LPSolveError(symbol, res.message)
+
+        # Restrict the next stage to this stage's optimal matchings
+        bounds[res.lower.marginals > DUAL_TOLERANCE, 1] = 0
+        used_up = res.ineqlin.marginals < -DUAL_TOLERANCE
+        if used_up.any():
+            A_ub = sparse.csr_array(A_ub)
+            A_eq = sparse.vstack([A_eq, A_ub[used_up]], format="csc")
+            b_eq = np.concatenate([b_eq, b_ub[used_up]])
+            A_ub, b_ub = A_ub[~used_up], b_ub[~used_up]
+
+    # Supplies and demands are whole units and the objective only depends on the
+    # matches, so the optimal vertex is integral up to solver tolerance
+    return np.rint(res.x[:num_edges] * QUANTITY_SCALE).astype(np.int64), diagnostics
+
+
+def solve_symbol_year_model(model, symbol, solver_options=None):
+    """
+    solver_options: optional dict of "method" (one of SOLVER_METHODS), "decompose"
+    (default True) to solve independent parts of the model as separate LPs,
+    "workers" to solve those parts on that many threads, and linprog HiGHS
+    options such as presolve, time_limit, primal_feasibility_tolerance,
+    dual_feasibility_tolerance and ipm_optimality_tolerance.
+    Returns dict with optimal taxable gain and breakdown, parcel assignments in
+    integer units, and diagnostics of the solve (None when nothing was solved).
+    """
+    empty_result = dict(
+        short_term=0.0,
+        long_term=0.0,
+        loss=0.0,
+        x=pd.DataFrame(columns=["buy_id", "sell_id", "quantity"]),
+        diagnostics=None,
+    )
+    if model.sells.empty:
+        return empty_result
+
+    options = dict(solver_options or {})
+    method = options.pop("method", "highs")
+    if method not in SOLVER_METHODS:
+        raise ValueError(f"Unknown solver method: {method}")
+    decompose = options.pop("decompose", True)
+    workers = options.pop("workers", None)
+
+    # The objective is a sum over matches, so parts sharing no buy or sell can
+    # be optimised on their own. Parts without units to sell need no LP.
+    if decompose:
+        components = list(_components(model))
+    else:
+        components = [
+            (np.arange(len(model.buys)), np.arange(len(model.sells)), np.arange(len(model.gain)))
+        ]
+    sell_units = model.sells["quantity"].to_numpy(dtype=np.int64)
+    components = [
+        component for component in components if sell_units[component[1]].sum() > 0
+    ]
+    if not components:
+        return empty_result
+
+    def solve(component):
+        return _solve_lp(model, *component, symbol, method, options)
+
+    started = time.perf_counter()
+    if workers and workers > 1 and len(components) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            solutions = list(executor.map(solve, components))
+    else:
+        solutions = [solve(component) for component in components]
+    solve_seconds = time.perf_counter() - started
+
+    units = np.zeros(len(model.gain), dtype=np.int64)
+    for (_, _, edges), (edge_units, _) in zip(components, solutions):
+        units[edges] = edge_units
+    shares = to_shares(units)
+    positive = model.gain > 0
+    A_prime = np.where(positive & ~model.long_term, model.gain, 0.0) @ shares
+    B_prime = np.where(positive & model.long_term, model.gain, 0.0) @ shares
+    L_prime = np.where(positive, 0.0, -model.gain) @ shares
 
     # Build assignment DataFrame
-    rows = []
-    for k, (buy_id, sell_id, gain, long_term) in enumerate(edges):
-        quantity = xsol[k]
-        if quantity > 1e-9:
-            rows.append(
-                dict(
-                    buy_id=buy_id,
-                    sell_id=sell_id,
-                    quantity=quantity,
-                    per_unit_gain=gain,
-                    long_term=bool(long_term),
-                )
-            )
-    x_df = pd.DataFrame(rows)
+    used = units > 0
+    x_df = pd.DataFrame(
+        dict(
+            buy_id=model.buys["id"].to_numpy()[model.edge_buy[used]],
+            sell_id=model.sells["id"].to_numpy()[model.edge_sell[used]],
+            quantity=units[used],
+            per_unit_gain=model.gain[used],
+            long_term=model.long_term[used],
+        )
+    )
+
+    parts = [diagnostics for _, diagnostics in solutions]
+    diagnostics = dict(
+        method=method,
+        status=0,
+        message=parts[-1]["message"],
+        iterations=sum(part["iterations"] for part in parts),
+        solve_seconds=solve_seconds,
+        rows=sum(part["rows"] for part in parts),
+        columns=sum(part["columns"] for part in parts),
+        nonzeros=sum(part["nonzeros"] for part in parts),
+        components=len(parts),
+        largest_component_columns=max(part["columns"] for part in parts),
+    )
 
     return dict(
         short_term=A_prime,  # gain from short term
         long_term=B_prime,  # gain from long term
         loss=L_prime,
         x=x_df,
+        diagnostics=diagnostics,
+    )
+
+
+def summarise_solve_log(solve_log, slowest=5):
+    """Totals of a list of per-solve diagnostics, and the slowest solves"""
+    return dict(
+        solves=len(solve_log),
+        solve_seconds=sum(entry["solve_seconds"] for entry in solve_log),
+        iterations=sum(entry["iterations"] for entry in solve_log),
+        slowest=sorted(
+            solve_log, key=lambda entry: entry["solve_seconds"], reverse=True
+        )[:slowest],
+    )
+
+
+def minimise_tax_for_symbol_year(buys, sells, symbol, solver_options=None):
+    """
+    buys: DataFrame with columns [id, trade_date, qty_avail, unit_price] for parcels with buy_date <= latest sell
+    sells: DataFrame with columns [id, trade_date, quantity, unit_price]
+    Returns dict with optimal taxable gain and breakdown, plus parcel assignments.
+    """
+    return solve_symbol_year_model(
+        build_symbol_year_model(buys, sells), symbol, solver_options
     )
@@ -1,3 +1,4 @@
+from fractions import Fraction
 import math
 from pathlib import Path
 import time
@@ -6,9 +7,10 @@ from datetime import datetime
 import pandas as pd
 import requests
 import os
+import threading
+from fixed_point import QUANTITY_SCALE
 
-SPLITS_URL = "https://www.alphavantage.co/query?function=SPLITS"
-OVERVIEW_URL = "https://www.alphavantage.co/query?function=OVERVIEW"
+ALPHAVANTAGE_BASE_URL = "https://www.alphavantage.co"
 
 TICKER_CHANGES_DF = pd.read_csv(Path(__file__).parent / "ticker_change_data.csv")
 TICKER_CHANGES_DF["date"] = pd.to_datetime(TICKER_CHANGES_DF["date"], dayfirst=True)
@@ -17,11 +19,164 @@ def get_alpha_vantage_api_key():
     load_dotenv()
     return os.getenv("ALPHAVANTAGE_API_KEY")
 
+def get_alpha_vantage_base_url():
+    # Can point at a local stand-in of the API, e.g. for load testing
+    load_dotenv()
+    return os.getenv("ALPHAVANTAGE_BASE_URL", ALPHAVANTAGE_BASE_URL).rstrip("/")
+
 def get_splits_api_url(symbol):
-    return f"{SPLITS_URL}&symbol={symbol}&apikey={get_alpha_vantage_api_key()}"
+    return (
+        f"{get_alpha_vantage_base_url()}/query?function=SPLITS"
+        f"&symbol={symbol}&apikey={get_alpha_vantage_api_key()}"
+    )
 
 def get_company_overview_api_url(symbol):
-    return f"{OVERVIEW_URL}&symbol={symbol}&apikey={get_alpha_vantage_api_key()}"
+    return (
+        f"{get_alpha_vantage_base_url()}/query?function=OVERVIEW"
+        f"&symbol={symbol}&apikey={get_alpha_vantage_api_key()}"
+    )
+
+
+# Split responses keyed by symbol, the symbols being looked up, and when the next
+# Alpha Vantage request may be sent. Worker processes which should share them
+# (e.g. the batch CLI) install state made by a Manager with set_market_data_state.
+_splits_cache = {}
+_splits_in_flight = {}
+_splits_condition = threading.Condition()
+
+# Alpha Vantage requests are spaced out across all threads to stay under the rate limit
+REQUEST_INTERVAL_SECONDS = float(os.getenv("ALPHAVANTAGE_REQUEST_INTERVAL", 0.25))
+
+
+class _Value:
+    """Stands in for a Manager's Value within one process"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+_rate_limit_lock = threading.Lock()
+_next_request_time = _Value(0.0)
+
+
+def shared_market_data_state(manager):
+    """
+    Split cache, in-flight symbols and rate limiter state held by manager, to be
+    installed in each worker process with set_market_data_state
+    """
+    lock = manager.Lock()
+    return (
+        manager.dict(),
+        manager.dict(),
+        manager.Condition(lock),
+        manager.Lock(),
+        manager.Value("d", 0.0),
+    )
+
+
+def set_market_data_state(state, require_splits=False):
+    global _splits_cache, _splits_in_flight, _splits_condition
+    global _rate_limit_lock, _next_request_time, _require_splits
+    (
+        _splits_cache,
+        _splits_in_flight,
+        _splits_condition,
+        _rate_limit_lock,
+        _next_request_time,
+    ) = state
+    _require_splits = require_splits
+
+
+def fetch_stock_splits(symbol):
+    if symbol in _splits_cache:
+        return _splits_cache[symbol]
+
+    # Concurrent calculations needing the same symbol wait on a single lookup
+    with _splits_condition:
+        while symbol in _splits_in_flight and symbol not in _splits_cache:
+            _splits_condition.wait(1.0)
+        if symbol in _splits_cache:
+            return _splits_cache[symbol]
+        _splits_in_flight[symbol] = True
+    try:
+        return _request_stock_splits(symbol)
+    finally:
+        with _splits_condition:
+            del _splits_in_flight[symbol]
+            _splits_condition.notify_all()
+
+
+def uncached_symbols(symbols):
+    """Symbols whose splits would need an Alpha Vantage request"""
+    return [symbol for symbol in symbols if symbol not in _splits_cache]
+
+
+class MarketDataUnavailable(Exception):
+    pass
+
+
+# Rate limited split lookups are retried after 2s, then 4s
+SPLITS_REQUEST_ATTEMPTS = 3
+SPLITS_RETRY_SECONDS = 2.0
+RATE_LIMIT_KEYS = ("Note", "Information")
+NO_SPLITS = {"data": []}
+
+# Whether a symbol still rate limited after the retries fails the calculation
+# rather than being calculated without splits, e.g. for the batch CLI
+_require_splits = False
+
+
+def _wait_for_rate_limit():
+    # CLOCK_MONOTONIC is shared by all processes of the machine
+    with _rate_limit_lock:
+        now = time.monotonic()
+        wait = _next_request_time.value - now
+        _next_request_time.value = (
+            max(now, _next_request_time.value) + REQUEST_INTERVAL_SECONDS
+        )
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _request_stock_splits(symbol):
+    """
+    Look up a symbol's splits, retrying rate limit responses and connection
+    errors. Other responses without data, e.g. for unknown or delisted symbols,
+    are cached as no splits. If every attempt is rate limited the symbol is
+    calculated without splits, uncached, unless splits are required, in which
+    case MarketDataUnavailable is raised.
+    """
+    problem = None
+    for attempt in range(SPLITS_REQUEST_ATTEMPTS):
+        if attempt:
+            time.sleep(SPLITS_RETRY_SECONDS * 2 ** (attempt - 1))
+        _wait_for_rate_limit()
+        try:
+            response_object = requests.get(get_splits_api_url(symbol)).json()
+        except (requests.RequestException, ValueError) as e:
+            problem = str(e)
+            continue
+        if not isinstance(response_object, dict):
+            response_object = {}
+        rate_limit = [
+            response_object[key] for key in RATE_LIMIT_KEYS if key in response_object
+        ]
+        if rate_limit:
+            problem = " ".join(map(str, rate_limit))
+            continue
+        if "data" not in response_object:
+            # e.g. {} or {"Error Message": "..."}
+            response_object = NO_SPLITS
+        _splits_cache[symbol] = response_object
+        return response_object
+
+    if _require_splits:
+        raise MarketDataUnavailable(
+            f"Could not look up the stock splits of {symbol}, please try again later "
+            f"({problem})"
+        )
+    print(f"Calculating {symbol} without stock splits, the lookup failed: {problem}")
+    return NO_SPLITS
 
 
 def apply_ticker_changes(trades_df, symbol, earliest_trade_date):
@@ -52,9 +207,13 @@ def apply_ticker_changes(trades_df, symbol, earliest_trade_date):
             ].empty
 
             if change_applies:
-                old_symbol_df = trades_df[trades_df["symbol"] == symbol]
-                for index in old_symbol_df.index:
-                    trades_df.loc[index, "symbol"] = new_ticker
+                symbols = trades_df["symbol"]
+                if (
+                    isinstance(symbols.dtype, pd.CategoricalDtype)
+                    and new_ticker not in symbols.cat.categories
+                ):
+                    trades_df["symbol"] = symbols.cat.add_categories([new_ticker])
+                trades_df.loc[trades_df["symbol"] == symbol, "symbol"] = new_ticker
 
         # Now only look for renames after this change occurred
         relevant = relevant[relevant["date"] >= row["date"]]
@@ -62,11 +221,8 @@ def apply_ticker_changes(trades_df, symbol, earliest_trade_date):
 
 def apply_stock_splits(trades_df, symbol, sorted_trade_dates):
 
-    response = requests.get(get_splits_api_url(symbol))
-    response_object = response.json()
-
-    if response_object and "data" in response_object:
-        splits = response_object["data"]
+    splits = fetch_stock_splits(symbol)["data"]
+    if splits:
         earliest_split = len(splits) - 1
         trade_date_index = 0
         while trade_date_index < len(sorted_trade_dates):
@@ -79,18 +235,21 @@ def apply_stock_splits(trades_df, symbol, sorted_trade_dates):
             if effective_date < trade_date:
                 earliest_split -= 1
             else:
-                split_factor = 1
+                # Exact, so e.g. a 1.5 split of 100 shares is 150 rather than 150.00000000000003
+                split_factor = Fraction(1)
                 for i in range(earliest_split, -1, -1):
-                    split_factor *= float(splits[i]["split_factor"])
+                    split_factor *= Fraction(splits[i]["split_factor"])
 
                 row_index = trades_df[
                     (trades_df["trade_date"] == trade_date)
                     & (trades_df["symbol"] == symbol)
                 ].index[0]
-                # multiply the quantity to reflect all splits which occurred after trade date
-                trades_df.loc[row_index, "quantity"] *= split_factor
+                # multiply the quantity (in units) to reflect all splits which occurred after trade date
                 # assume partial shares are rounded up to ensure solution exists
-                trades_df.loc[row_index, "quantity"] = math.ceil(trades_df.loc[row_index, "quantity"])
+                units = int(trades_df.loc[row_index, "quantity"])
+                trades_df.loc[row_index, "quantity"] = (
+                    math.ceil(units * split_factor / QUANTITY_SCALE) * QUANTITY_SCALE
+                )
                 trade_date_index += 1
 
 
@@ -109,4 +268,3 @@ def handle_splits_and_ticker_changes(trades_df, nabtrade=False):
         # In future a different finance service would have to be used and exchange
         # codes would be kept for each symbol.
         apply_stock_splits(trades_df, symbol, trade_dates)
-        time.sleep(0.25)
@@ -0,0 +1,163 @@
+"""
+Opt-in memory accounting of a calculation's stages.
+
+Each stage records the Python allocations tracemalloc saw (held at its end and
+at their peak) and the process's resident memory (at its end and at its peak,
+by resetting the kernel's high water mark where Linux allows it). Stages nest,
+so a stage's peaks include those of the stages inside it. When a stage's
+traced peak passes top_sites_mb, the allocation sites still holding the most
+memory at its end are kept and printed.
+
+tracemalloc and the peak RSS are per process, so stages of concurrent runs in
+one process inflate each other's figures.
+"""
+
+from contextlib import contextmanager, nullcontext
+import re
+import resource
+import threading
+import time
+import tracemalloc
+
+MB = 2**20
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0:
+            tracemalloc.stop()
+
+
+def _rss():
+    """Current and peak resident memory in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            status = f.read()
+        rss, peak = (
+            int(re.search(rf"{key}:\s+(\d+) kB", status).group(1)) * 1024
+            for key in ("VmRSS", "VmHWM")
+        )
+        return rss, peak
+    except (OSError, AttributeError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return peak, peak
+
+
+def _reset_peaks():
+    tracemalloc.reset_peak()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")  # resets VmHWM
+    except OSError:
+        pass  # the peak RSS stays the process's lifetime peak
+
+
+def profile_stage(profile, name, **labels):
+    """A stage of profile, or a no-op when profiling is off"""
+    return nullcontext() if profile is None else profile.stage(name, **labels)
+
+
+class MemoryProfile:
+    def __init__(self, top_sites_mb=None, top_sites=10):
+        self.top_sites_mb = top_sites_mb
+        self.top_sites = top_sites
+        self.stages = []
+        self._open = []  # [traced peak, rss peak] of the stages entered, innermost last
+
+    @contextmanager
+    def stage(self, name, **labels):
+        record = dict(stage=name, **labels)
+        self._enter()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 4)
+            self._exit(record)
+
+    def _enter(self):
+        if not self._open:
+            _start_tracing()
+        else:
+            self._fold_peaks(self._open[-1])
+        _reset_peaks()
+        self._open.append([0, 0])
+
+    def _exit(self, record):
+        peaks = self._open.pop()
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        rss, rss_peak = _rss()
+        traced_peak = max(traced_peak, peaks[0])
+        rss_peak = max(rss_peak, peaks[1])
+        record.update(
+            traced_mb=round(traced / MB, 1),
+            traced_peak_mb=round(traced_peak / MB, 1),
+            rss_mb=round(rss / MB, 1),
+            rss_peak_mb=round(rss_peak / MB, 1),
+        )
+        if self.top_sites_mb is not None and traced_peak > self.top_sites_mb * MB:
+            record["top_allocations"] = self._top_allocations()
+            print(f"Top allocations held after {record['stage']}:")
+            for site in record["top_allocations"]:
+                print(f"  {site['size_mb']:>8.1f} MB {site['count']:>8} {site['site']}")
+        self.stages.append(record)
+
+        _reset_peaks()
+        if self._open:
+            parent = self._open[-1]
+            parent[0] = max(parent[0], traced_peak)
+            parent[1] = max(parent[1], rss_peak)
+        else:
+            _stop_tracing()
+
+    def _fold_peaks(self, peaks):
+        peaks[0] = max(peaks[0], tracemalloc.get_traced_memory()[1])
+        peaks[1] = max(peaks[1], _rss()[1])
+
+    def _top_allocations(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+        )
+        return [
+            dict(
+                site=f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                size_mb=round(stat.size / MB, 2),
+                count=stat.count,
+            )
+            for stat in snapshot.statistics("lineno")[: self.top_sites]
+        ]
+
+    def to_dict(self, top_solves=10):
+        """
+        The stages recorded, with only the top_solves symbol-year solves
+        by traced peak, for storing with a job
+        """
+        solves = [record for record in self.stages if record["stage"] == "solve"]
+        return dict(
+            stages=[record for record in self.stages if record["stage"] != "solve"],
+            solves=len(solves),
+            largest_solves=sorted(
+                solves, key=lambda record: record["traced_peak_mb"], reverse=True
+            )[:top_solves],
+            rss_peak_mb=max((record["rss_peak_mb"] for record in self.stages), default=None),
+            traced_peak_mb=max(
+                (record["traced_peak_mb"] for record in self.stages), default=None
+            ),
+        )
+
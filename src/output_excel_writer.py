@@ -1,7 +1,9 @@
 import xlsxwriter
 
 
-def export_capital_gains_to_excel(data_dict, filename="capital_gains_report.xlsx"):
+def export_capital_gains_to_excel(
+    data_dict, filename="capital_gains_report.xlsx", financial_years=None
+):
     """
     Export capital gains data to a multi-sheet Excel file.
 
@@ -9,7 +11,8 @@ def export_capital_gains_to_excel(data_dict, filename="capital_gains_report.xlsx
         data_dict: Dictionary with structure:
             { financial_year: {
                 buy_and_sell_pairs: {
-                    symbol: [(buy_date, sell_date, sold_quantity, per_unit_gain), ...]
+                    symbol: BuySellPairs (columns of buy_date, sell_date,
+                        sold_quantity and per_unit_gain)
                 },
                 total_capital_gain: float,
                 losses: float,
@@ -18,139 +21,173 @@ def export_capital_gains_to_excel(data_dict, filename="capital_gains_report.xlsx
                 taxable_capital_gain: float
             }}
         filename: Output Excel filename
+        financial_years: Years to render, all years in data_dict when None.
+            Pairs of other years are never read.
     """
 
-    workbook = xlsxwriter.Workbook(filename)
-
-    # Define formats
-    header_format = workbook.add_format(
-        {
-            "bold": True,
-            "bg_color": "#4472C4",
-            "font_color": "white",
-            "border": 1,
-            "align": "center",
-            "valign": "vcenter",
-        }
-    )
-
-    symbol_header_format = workbook.add_format(
-        {
-            "bold": True,
-            "bg_color": "#D9E1F2",
-            "border": 1,
-            "align": "center",
-            "valign": "vcenter",
-            "font_size": 11,
-        }
-    )
-
-    data_format = workbook.add_format(
-        {"border": 1, "align": "left", "valign": "vcenter"}
-    )
-
-    number_format = workbook.add_format(
-        {"border": 1, "align": "right", "valign": "vcenter", "num_format": "#,##0.00"}
-    )
-
-    date_format = workbook.add_format(
-        {
-            "border": 1,
-            "align": "center",
-            "valign": "vcenter",
-            "num_format": "dd/mm/yyyy",
-        }
-    )
-
-    summary_label_format = workbook.add_format(
-        {
-            "bold": True,
-            "bg_color": "#F2F2F2",
-            "border": 1,
-            "align": "left",
-            "valign": "vcenter",
-        }
-    )
-
-    summary_value_format = workbook.add_format(
-        {
-            "bold": True,
-            "bg_color": "#F2F2F2",
-            "border": 1,
-            "align": "right",
-            "valign": "vcenter",
-            "num_format": "$#,##0.00",
-        }
-    )
-
     # Process each financial year
-    for fy, fy_data in sorted(data_dict.items()):
-        # Create worksheet for this financial year
-        worksheet = workbook.add_worksheet(str(fy))
-
-        # Set column widths
-        worksheet.set_column("A:A", 18)  # Buy Date
-        worksheet.set_column("B:B", 18)  # Sell Date
-        worksheet.set_column("C:C", 18)  # Quantity
-        worksheet.set_column("D:D", 18)  # Per Unit Gain
-
-        current_row = 0
+    if financial_years is None:
+        financial_years = data_dict.keys()
 
+    writer = ReportWriter(filename)
+    for fy in sorted(financial_years):
+        fy_data = data_dict[fy]
         # Process each symbol
         sell_and_buy_pairs = fy_data.get("buy_and_sell_pairs", {})
-
         for symbol in sorted(sell_and_buy_pairs.keys()):
-            trades = sell_and_buy_pairs[symbol]
+            writer.add_symbol(fy, symbol, sell_and_buy_pairs[symbol])
+        writer.finish_year(fy, fy_data)
+    writer.close()
 
-            # Symbol header
-            worksheet.merge_range(
-                current_row,
-                0,
-                current_row,
-                3,
-                f"Symbol: {symbol}",
-                symbol_header_format,
-            )
-            current_row += 1
 
-            # Column headers
-            worksheet.write(current_row, 0, "Buy Date", header_format)
-            worksheet.write(current_row, 1, "Sell Date", header_format)
-            worksheet.write(current_row, 2, "Sold Quantity", header_format)
-            worksheet.write(current_row, 3, "Per Unit Gain", header_format)
-            current_row += 1
+class ReportWriter:
+    """
+    Writes the report one symbol at a time, as the calculation finishes them.
+    Years must be written in order, each year's symbols before its summary, and
+    rows are flushed to disk as they are written so a large report is never
+    held in memory.
+    """
 
-            # Trade data
-            for trade in trades:
-                buy_date, sell_date, sold_quantity, per_unit_gain = trade
+    def __init__(self, filename="capital_gains_report.xlsx"):
+        self.filename = filename
+        self.workbook = xlsxwriter.Workbook(filename, {"constant_memory": True})
+        self._worksheet = None
+        self._fy = None
+        self._row = 0
+
+        # Define formats
+        self.header_format = self.workbook.add_format(
+            {
+                "bold": True,
+                "bg_color": "#4472C4",
+                "font_color": "white",
+                "border": 1,
+                "align": "center",
+                "valign": "vcenter",
+            }
+        )
 
-                # Handle buy_date (can be None for short selling)
-                if buy_date is None:
-                    worksheet.write(current_row, 0, "Short Sell", data_format)
-                else:
-                    worksheet.write_datetime(current_row, 0, buy_date, date_format)
+        self.symbol_header_format = self.workbook.add_format(
+            {
+                "bold": True,
+                "bg_color": "#D9E1F2",
+                "border": 1,
+                "align": "center",
+                "valign": "vcenter",
+                "font_size": 11,
+            }
+        )
 
-                # Sell date
-                worksheet.write_datetime(current_row, 1, sell_date, date_format)
+        self.data_format = self.workbook.add_format(
+            {"border": 1, "align": "left", "valign": "vcenter"}
+        )
 
-                # Quantity and gain
-                worksheet.write(current_row, 2, sold_quantity, number_format)
-                worksheet.write(current_row, 3, per_unit_gain, number_format)
+        self.number_format = self.workbook.add_format(
+            {"border": 1, "align": "right", "valign": "vcenter", "num_format": "#,##0.00"}
+        )
 
-                current_row += 1
+        self.date_format = self.workbook.add_format(
+            {
+                "border": 1,
+                "align": "center",
+                "valign": "vcenter",
+                "num_format": "dd/mm/yyyy",
+            }
+        )
+
+        self.summary_label_format = self.workbook.add_format(
+            {
+                "bold": True,
+                "bg_color": "#F2F2F2",
+                "border": 1,
+                "align": "left",
+                "valign": "vcenter",
+            }
+        )
+
+        self.summary_value_format = self.workbook.add_format(
+            {
+                "bold": True,
+                "bg_color": "#F2F2F2",
+                "border": 1,
+                "align": "right",
+                "valign": "vcenter",
+                "num_format": "$#,##0.00",
+            }
+        )
+
+    def _year_sheet(self, fy):
+        if fy != self._fy:
+            if self._fy is not None and fy < self._fy:
+                raise ValueError(f"Financial year {fy} written after {self._fy}")
+            # Create worksheet for this financial year
+            self._worksheet = self.workbook.add_worksheet(str(fy))
+            self._fy = fy
+            self._row = 0
+
+            # Set column widths
+            self._worksheet.set_column("A:A", 18)  # Buy Date
+            self._worksheet.set_column("B:B", 18)  # Sell Date
+            self._worksheet.set_column("C:C", 18)  # Quantity
+            self._worksheet.set_column("D:D", 18)  # Per Unit Gain
+        return self._worksheet
+
+    def add_symbol(self, fy, symbol, trades):
+        """Write a symbol's BuySellPairs of a financial year"""
+        worksheet = self._year_sheet(fy)
+        current_row = self._row
+
+        # Symbol header
+        worksheet.merge_range(
+            current_row,
+            0,
+            current_row,
+            3,
+            f"Symbol: {symbol}",
+            self.symbol_header_format,
+        )
+        current_row += 1
+
+        # Column headers
+        worksheet.write(current_row, 0, "Buy Date", self.header_format)
+        worksheet.write(current_row, 1, "Sell Date", self.header_format)
+        worksheet.write(current_row, 2, "Sold Quantity", self.header_format)
+        worksheet.write(current_row, 3, "Per Unit Gain", self.header_format)
+        current_row += 1
+
+        # Trade data
+        for buy_date, sell_date, sold_quantity, per_unit_gain in trades.rows():
+            # Handle buy_date (can be None for short selling)
+            if buy_date is None:
+                worksheet.write(current_row, 0, "Short Sell", self.data_format)
+            else:
+                worksheet.write_datetime(current_row, 0, buy_date, self.date_format)
+
+            # Sell date
+            worksheet.write_datetime(current_row, 1, sell_date, self.date_format)
+
+            # Quantity and gain
+            worksheet.write(current_row, 2, sold_quantity, self.number_format)
+            worksheet.write(current_row, 3, per_unit_gain, self.number_format)
 
-            # Add spacing after each symbol
             current_row += 1
 
+        # Add spacing after each symbol
+        self._row = current_row + 1
+
+    def finish_year(self, fy, fy_data):
+        """Write the summary of a financial year below its symbols"""
+        worksheet = self._year_sheet(fy)
+
         # Add summary section at the bottom
-        current_row += 1
+        current_row = self._row + 1
         worksheet.merge_range(
             current_row,
             0,
             current_row,
             3,
             f"Financial Year {fy} Summary",
-            symbol_header_format,
+            self.symbol_header_format,
         )
         current_row += 1
 
@@ -163,11 +200,13 @@ def export_capital_gains_to_excel(data_dict, filename="capital_gains_report.xlsx
         ]
 
         for label, value in summary_items:
-            worksheet.write(current_row, 0, label, summary_label_format)
+            worksheet.write(current_row, 0, label, self.summary_label_format)
             worksheet.merge_range(
-                current_row, 1, current_row, 3, value, summary_value_format
+                current_row, 1, current_row, 3, value, self.summary_value_format
             )
             current_row += 1
+        self._row = current_row
 
-    workbook.close()
-    print(f"Excel file '{filename}' created successfully!")
+    def close(self):
+        self.workbook.close()
+        print(f"Excel file '{self.filename}' created successfully!")
@@ -0,0 +1,159 @@
+import math
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from cgt_calculator import summarise_financial_year
+from fixed_point import QUANTITY_SCALE, to_shares, to_units
+from lp_solver import (
+    LPSolveError,
+    add_sell,
+    build_symbol_year_model,
+    solve_symbol_year_model,
+)
+
+
+def financial_year_of(date):
+    # FY runs 1 Jul–30 Jun; FY label is the year ending (e.g., 30/06/2025 -> 2025)
+    return date.year + (date.month >= 7)
+
+
+class SellPlanner:
+    """
+    Answers "what if I sold N units of a symbol on a date" against the final
+    financial year of a CGTCalculator run. Each symbol's LP for that year is
+    kept from the run, so a hypothetical sell only re-solves that one LP with
+    the sell appended, rather than every symbol and year.
+    """
+
+    def __init__(self, planning_state):
+        self.financial_year = planning_state["fy"]
+        self.symbols = planning_state["symbols"]
+        self.totals = planning_state["totals"]
+        self._future_models = {}  # key: symbol, value: model of parcels left after the final year
+        self.quantity_scale = QUANTITY_SCALE  # of the units in the kept models
+
+    @classmethod
+    def from_context(cls, context):
+        """Planner over the RunContext of a finished CGTCalculator.execute run"""
+        return cls(context.planning_state)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """Raises ValueError for planners saved with other units, see fixed_point"""
+        with open(path, "rb") as f:
+            planner = pickle.load(f)
+        if getattr(planner, "quantity_scale", None) != QUANTITY_SCALE:
+            raise ValueError(
+                "This session was calculated by an older version, please upload again"
+            )
+        return planner
+
+    def _future_model(self, symbol):
+        """Parcels of a symbol still held after the final year, with no sells yet"""
+        if symbol not in self._future_models:
+            state = self.symbols[symbol]
+            buys = state["model"].buys.copy()
+            allocations = state["result"]["x"]
+            if not allocations.empty:
+                used = allocations.groupby("buy_id")["quantity"].sum()
+                buys["qty_avail"] -= (
+                    buys["id"].map(used).fillna(0).to_numpy(dtype=np.int64)
+                )
+            buys = buys[buys["qty_avail"] > 0]
+            self._future_models[symbol] = build_symbol_year_model(
+                buys, state["model"].sells.iloc[:0]
+            )
+        return self._future_models[symbol]
+
+    def plan(self, symbol, quantity, sell_date, unit_price):
+        """
+        Taxable capital gain of the sell's financial year if quantity units of
+        symbol were sold on sell_date at unit_price, next to the baseline.
+        """
+        sell_date = pd.Timestamp(sell_date)
+        fy = financial_year_of(sell_date)
+        if self.financial_year is None or fy < self.financial_year:
+            raise ValueError(
+                f"Sells can only be planned from FY{self.financial_year} onwards"
+            )
+        if symbol not in self.symbols:
+            raise ValueError(f"No trades found for symbol: {symbol}")
+        if not (math.isfinite(quantity) and math.isfinite(unit_price)):
+            raise ValueError("Quantity and unit price must be finite numbers")
+        if quantity <= 0:
+            raise ValueError("Quantity to sell must be positive")
+
+        if fy == self.financial_year:
+            base_model = self.symbols[symbol]["model"]
+            base_result = self.symbols[symbol]["result"]
+            fy_results = dict(self.totals)
+        else:
+            base_model = self._future_model(symbol)
+            base_result = dict(short_term=0.0, long_term=0.0, loss=0.0)
+            fy_results = dict(short_term=0.0, long_term=0.0, loss=0.0, short_sell_gain=0.0)
+            summarise_financial_year(fy_results)
+        baseline_taxable_gain = fy_results["taxable_capital_gain"]
+
+        units = int(to_units(quantity))
+        units_held = int(
+            base_model.buys["qty_avail"].sum() - base_model.sells["quantity"].sum()
+        )
+        if units > units_held:
+            raise ValueError(
+                f"Cannot sell {quantity:g} units of {symbol}, "
+                f"only {units_held / QUANTITY_SCALE:g} held"
+            )
+
+        model = add_sell(base_model, -1, sell_date, units, unit_price)
+        try:
+            result = solve_symbol_year_model(model, symbol)
+        except LPSolveError:
+            raise ValueError(
+                f"Not enough units of {symbol} held on {sell_date.date()} "
+                f"to sell {quantity:g}"
+            )
+
+        for key in ("short_term", "long_term", "loss"):
+            fy_results[key] += result[key] - base_result[key]
+        summarise_financial_year(fy_results)
+
+        allocations = result["x"]
+        allocations = allocations[allocations["sell_id"] == -1]
+        buy_dates = model.buys.set_index("id")["trade_date"]
+        parcels = [
+            dict(
+                buy_date=buy_dates[buy_id].strftime("%Y-%m-%d"),
+                quantity=float(parcel_shares),
+                per_unit_gain=float(per_unit_gain),
+                long_term=bool(long_term),
+            )
+            for buy_id, parcel_shares, per_unit_gain, long_term in zip(
+                allocations["buy_id"],
+                to_shares(allocations["quantity"]),
+                allocations["per_unit_gain"],
+                allocations["long_term"],
+            )
+        ]
+
+        return dict(
+            financial_year=int(fy),
+            symbol=symbol,
+            quantity=float(quantity),
+            sell_date=sell_date.strftime("%Y-%m-%d"),
+            unit_price=float(unit_price),
+            short_term=float(fy_results["short_term"]),
+            long_term=float(fy_results["long_term"]),
+            loss=float(fy_results["loss"]),
+            taxable_capital_gain=float(fy_results["taxable_capital_gain"]),
+            baseline_taxable_capital_gain=float(baseline_taxable_gain),
+            additional_taxable_capital_gain=float(
+                fy_results["taxable_capital_gain"] - baseline_taxable_gain
+            ),
+            parcels=parcels,
+        )
@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+
+from cgt_calculator import RunContext
+from memory_profile import profile_stage
+from output_excel_writer import ReportWriter
+from planner import SellPlanner
+from results import ResultsWriter
+
+# Symbols the calculation may finish ahead of the report writer
+RESULTS_QUEUE_SIZE = 64
+
+
+def _write_results_as_solved(results_queue, excel_path, report_years, results_writer):
+    """
+    Write each symbol into the report, if there is an excel_path, and into
+    results_writer as soon as it is solved, then let its pairs go. Only the
+    report_years are written, all when None.
+    """
+    finished = False
+    try:
+        writer = ReportWriter(excel_path) if excel_path else None
+        while (item := results_queue.get()) is not None:
+            kind, fy, *rest = item
+            if report_years is not None and fy not in report_years:
+                continue
+            if kind == "symbol":
+                symbol, build_pairs = rest
+                pairs = build_pairs()
+                if writer is not None:
+                    writer.add_symbol(fy, symbol, pairs)
+                results_writer.add(fy, symbol, pairs)
+            elif writer is not None:
+                writer.finish_year(fy, rest[0])
+        finished = True
+        if writer is not None:
+            writer.close()
+    except BaseException:
+        # Keep taking results so the calculation is never blocked on a full queue
+        while not finished and results_queue.get() is not None:
+            pass
+        raise
+
+
+def write_report(
+    calculator,
+    session_id,
+    allow_short_selling,
+    output_folder,
+    target_fy=None,
+    memory_profile=None,
+    export_format="xlsx",
+):
+    """
+    Calculate the optimal CGT of a calculator's trades and write the report, the
+    compact results and the what-if planner of the session to output_folder.
+    The report is written by a second thread as symbols are solved, so it is
+    finished soon after the last solve. With the "csv" export_format no report
+    is written, the zip of CSVs is generated from the results when downloaded.
+    With a target_fy only the years up to it are calculated and only it is reported.
+    Returns the paths written, the financial years calculated and memory_profile,
+    with the calculation, each solve and the end of the export recorded in it if given.
+    """
+    # Report every calculated year when the history has no trades in the target year
+    report_years = None
+    if target_fy is not None and (calculator.trades_df["fy"] == target_fy).any():
+        report_years = [target_fy]
+
+    if export_format == "csv":
+        excel_filename, excel_path = f"cgt_report_{session_id}.zip", ""
+    else:
+        excel_filename = f"cgt_report_{session_id}.xlsx"
+        excel_path = os.path.join(output_folder, excel_filename)
+    # Compact results for the summary API, written as symbols are solved
+    results_path = os.path.join(output_folder, f"cgt_results_{session_id}.npz")
+    results_writer = ResultsWriter(results_path)
+    results_queue = queue.Queue(maxsize=RESULTS_QUEUE_SIZE)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        writing = executor.submit(
+            _write_results_as_solved,
+            results_queue,
+            excel_path,
+            report_years,
+            results_writer,
+        )
+
+        def discard():
+            """Remove what was written of a failed report"""
+            results_writer.abort()
+            if excel_path and os.path.exists(excel_path):
+                os.remove(excel_path)
+
+        context = RunContext(memory_profile=memory_profile, results_queue=results_queue)
+        try:
+            with profile_stage(memory_profile, "execute"):
+                data_dict = calculator.execute(
+                    allow_short_selling, target_fy=target_fy, context=context
+                )
+        except BaseException:
+            results_queue.put(None)
+            writing.exception()
+            discard()
+            raise
+        results_queue.put(None)
+        with profile_stage(memory_profile, "export"):
+            try:
+                writing.result()
+            except BaseException:
+                discard()
+                raise
+    results_writer.close(data_dict, pair_years=report_years)
+
+    # Keep the final year's solved state for what-if sells
+    plan_path = os.path.join(output_folder, f"cgt_plan_{session_id}.pkl")
+    SellPlanner.from_context(context).save(plan_path)
+
+    return dict(
+        excel_path=excel_path,
+        excel_filename=excel_filename,
+        results_path=results_path,
+        plan_path=plan_path,
+        financial_years=[int(fy) for fy in data_dict.keys()],
+        memory_profile=memory_profile,
+    )
@@ -0,0 +1,345 @@
+import os
+import shutil
+import struct
+import zipfile
+from collections.abc import Mapping
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True, eq=False)
+class BuySellPairs:
+    """
+    Buy and sell pairs of one symbol in one financial year, stored as columns.
+    Short sells have no matching buy, their buy_date is NaT.
+    """
+
+    buy_date: np.ndarray  # datetime64[ns]
+    sell_date: np.ndarray  # datetime64[ns]
+    quantity: np.ndarray  # float64
+    per_unit_gain: np.ndarray  # float64
+
+    @classmethod
+    def from_columns(cls, buy_date, sell_date, quantity, per_unit_gain):
+        return cls(
+            buy_date=np.asarray(buy_date, dtype="datetime64[ns]"),
+            sell_date=np.asarray(sell_date, dtype="datetime64[ns]"),
+            quantity=np.asarray(quantity, dtype=np.float64),
+            per_unit_gain=np.asarray(per_unit_gain, dtype=np.float64),
+        )
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (buy_date, sell_date, quantity, per_unit_gain) tuples"""
+        rows = list(rows)
+        if not rows:
+            return cls.from_columns([], [], [], [])
+        buy_date, sell_date, quantity, per_unit_gain = zip(*rows)
+        return cls.from_columns(
+            [np.datetime64("NaT") if d is None else d for d in buy_date],
+            sell_date,
+            quantity,
+            per_unit_gain,
+        )
+
+    @classmethod
+    def concat(cls, parts):
+        parts = list(parts)
+        if not parts:
+            return cls.from_columns([], [], [], [])
+        return cls(
+            buy_date=np.concatenate([part.buy_date for part in parts]),
+            sell_date=np.concatenate([part.sell_date for part in parts]),
+            quantity=np.concatenate([part.quantity for part in parts]),
+            per_unit_gain=np.concatenate([part.per_unit_gain for part in parts]),
+        )
+
+    def __len__(self):
+        return len(self.quantity)
+
+    def __eq__(self, other):
+        if not isinstance(other, BuySellPairs):
+            return NotImplemented
+        return (
+            np.array_equal(self.buy_date, other.buy_date, equal_nan=True)
+            and np.array_equal(self.sell_date, other.sell_date)
+            and np.array_equal(self.quantity, other.quantity)
+            and np.array_equal(self.per_unit_gain, other.per_unit_gain)
+        )
+
+    def rows(self):
+        """
+        Iterate (buy_date, sell_date, quantity, per_unit_gain) tuples with
+        Timestamps for dates and None as the buy date of short sells.
+        """
+        buy_dates = pd.DatetimeIndex(self.buy_date)
+        sell_dates = pd.DatetimeIndex(self.sell_date)
+        for buy_date, sell_date, quantity, per_unit_gain in zip(
+            buy_dates, sell_dates, self.quantity.tolist(), self.per_unit_gain.tolist()
+        ):
+            yield (
+                None if pd.isna(buy_date) else buy_date,
+                sell_date,
+                quantity,
+                per_unit_gain,
+            )
+
+
+class LazyBuySellPairs(Mapping):
+    """
+    BuySellPairs of one financial year keyed by symbol. Each symbol's pairs are
+    built from the solver output by a zero-argument builder the first time
+    they are looked up.
+    """
+
+    def __init__(self):
+        self._builders = {}
+        self._pairs = {}
+
+    def add(self, symbol, builder):
+        self._builders[symbol] = builder
+
+    def __getitem__(self, symbol):
+        if symbol not in self._pairs:
+            self._pairs[symbol] = self._builders[symbol]()
+        return self._pairs[symbol]
+
+    def __iter__(self):
+        return iter(self._builders)
+
+    def __len__(self):
+        return len(self._builders)
+
+
+class CalculationResults(Mapping):
+    """
+    Results of CGTCalculator.execute keyed by financial year. A year's totals
+    are summarised the first time it is looked up, and its pairs are only built
+    for the symbols which are then read.
+    """
+
+    def __init__(self, summarise):
+        self._summarise = summarise
+        self._accumulated = {}
+        self._results = {}
+
+    def add_year(self, fy, fy_results):
+        """fy_results holds a LazyBuySellPairs and the year's accumulated gains"""
+        self._accumulated[fy] = fy_results
+
+    def __getitem__(self, fy):
+        if fy not in self._results:
+            fy_results = dict(self._accumulated[fy])
+            self._summarise(fy_results)
+            self._results[fy] = fy_results
+        return self._results[fy]
+
+    def __iter__(self):
+        return iter(self._accumulated)
+
+    def __len__(self):
+        return len(self._accumulated)
+
+
+RESULTS_FORMAT_VERSION = 1
+SUMMARY_FIELDS = (
+    "short_term",
+    "long_term",
+    "total_capital_gain",
+    "capital_gain_discount",
+    "loss",
+    "short_sell_gain",
+    "taxable_capital_gain",
+)
+PAIR_COLUMNS = ("buy_date", "sell_date", "quantity", "per_unit_gain")
+
+
+class ResultsWriter:
+    """
+    Writes a results file as pairs are produced. Each group's pair columns are
+    appended to temporary column files next to path, and close assembles the
+    uncompressed .npz from them, so the pairs are never all held in memory.
+    The file holds one array per summary field indexed by financial year, and
+    the pairs as flat columns with group_offsets marking where each
+    (group_fy, group_symbol) group starts.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._column_files = {
+            column: open(f"{self.path}.{column}.tmp", "wb+") for column in PAIR_COLUMNS
+        }
+        self._dtypes = {
+            column: getattr(BuySellPairs.from_columns([], [], [], []), column).dtype
+            for column in PAIR_COLUMNS
+        }
+        self._group_fy = []
+        self._group_symbol = []
+        self._group_offsets = [0]
+
+    def add(self, fy, symbol, pairs):
+        """Append the pairs of one symbol in one financial year"""
+        for column, f in self._column_files.items():
+            f.write(np.ascontiguousarray(getattr(pairs, column)).tobytes())
+        self._group_fy.append(fy)
+        self._group_symbol.append(str(symbol))
+        self._group_offsets.append(self._group_offsets[-1] + len(pairs))
+
+    def close(self, results_per_fy, pair_years=None):
+        """
+        Write the file with the totals of results_per_fy, recording pair_years
+        (all years when None) as the years whose pairs it holds
+        """
+        financial_years = sorted(results_per_fy)
+        if pair_years is None:
+            pair_years = financial_years
+        arrays = dict(
+            format_version=np.array(RESULTS_FORMAT_VERSION, dtype=np.int16),
+            fy=np.array(financial_years, dtype=np.int16),
+            pair_fy=np.array(sorted(pair_years), dtype=np.int16),
+            group_fy=np.array(self._group_fy, dtype=np.int16),
+            group_symbol=np.array(self._group_symbol, dtype=str),
+            group_offsets=np.array(self._group_offsets),
+        )
+        for field in SUMMARY_FIELDS:
+            arrays[field] = np.array(
+                [results_per_fy[fy][field] for fy in financial_years], dtype=np.float64
+            )
+
+        try:
+            # Laid out as np.savez lays out an .npz, so load_results can memory-map it
+            with zipfile.ZipFile(self.path, "w", allowZip64=True) as archive:
+                for name, array in arrays.items():
+                    with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                        np.lib.format.write_array(member, array)
+                for column, f in self._column_files.items():
+                    with archive.open(f"{column}.npy", "w", force_zip64=True) as member:
+                        np.lib.format.write_array_header_1_0(
+                            member,
+                            dict(
+                                descr=np.lib.format.dtype_to_descr(self._dtypes[column]),
+                                fortran_order=False,
+                                shape=(self._group_offsets[-1],),
+                            ),
+                        )
+                        f.seek(0)
+                        shutil.copyfileobj(f, member, 1024 * 1024)
+        except BaseException:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            raise
+        finally:
+            self._remove_column_files()
+
+    def abort(self):
+        """Discard the pairs written so far"""
+        self._remove_column_files()
+
+    def _remove_column_files(self):
+        for f in self._column_files.values():
+            f.close()
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+
+def save_results(results_per_fy, path, pair_years=None):
+    """
+    Write calculator results to an uncompressed .npz file, keeping the pairs of
+    the pair_years only (all years when None). See ResultsWriter.
+    """
+    writer = ResultsWriter(path)
+    try:
+        for fy in sorted(results_per_fy if pair_years is None else pair_years):
+            for symbol, pairs in results_per_fy[fy]["buy_and_sell_pairs"].items():
+                writer.add(fy, symbol, pairs)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close(results_per_fy, pair_years)
+
+
+def _check_format_version(npz):
+    version = int(npz["format_version"])
+    if version != RESULTS_FORMAT_VERSION:
+        raise ValueError(f"Unsupported results format version {version}")
+
+
+def load_summary(path):
+    """Per financial year totals of a results file, without reading any pairs"""
+    with np.load(path, allow_pickle=False) as npz:
+        _check_format_version(npz)
+        financial_years = npz["fy"].tolist()
+        fields = {field: npz[field].tolist() for field in SUMMARY_FIELDS}
+    return {
+        fy: {field: fields[field][i] for field in SUMMARY_FIELDS}
+        for i, fy in enumerate(financial_years)
+    }
+
+
+def load_pair_years(path):
+    """Financial years whose pairs a results file holds"""
+    with np.load(path, allow_pickle=False) as npz:
+        _check_format_version(npz)
+        return npz["pair_fy"].tolist()
+
+
+def _memmap_member(path, zip_file, name):
+    """Memory-map an array stored uncompressed in an .npz archive"""
+    info = zip_file.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"{name} is compressed and cannot be memory-mapped")
+    with open(path, "rb") as f:
+        # The local file header is 30 bytes followed by the name and extra field
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", f.read(4))
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if not shape or 0 in shape:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(
+        path,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C",
+    )
+
+
+def load_results(path, mmap=True):
+    """
+    Read a results file back into the structure returned by
+    CGTCalculator.execute. With mmap the pair columns are memory-mapped
+    read-only rather than read into memory.
+    """
+    summary = load_summary(path)
+    with np.load(path, allow_pickle=False) as npz:
+        group_fy = npz["group_fy"].tolist()
+        group_symbol = npz["group_symbol"].tolist()
+        group_offsets = npz["group_offsets"].tolist()
+        if mmap:
+            with zipfile.ZipFile(path) as zip_file:
+                columns = {
+                    column: _memmap_member(path, zip_file, f"{column}.npy")
+                    for column in PAIR_COLUMNS
+                }
+        else:
+            columns = {column: npz[column] for column in PAIR_COLUMNS}
+
+    results_per_fy = {
+        fy: dict(buy_and_sell_pairs={}, **totals) for fy, totals in summary.items()
+    }
+    for fy, symbol, start, end in zip(
+        group_fy, group_symbol, group_offsets, group_offsets[1:]
+    ):
+        results_per_fy[fy]["buy_and_sell_pairs"][symbol] = BuySellPairs(
+            **{column: columns[column][start:end] for column in PAIR_COLUMNS}
+        )
+    return results_per_fy
@@ -0,0 +1,280 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+sqlite3.register_adapter(datetime, lambda val: val.isoformat())
+
+
+class SessionStore:
+    """
+    SQLite store for report sessions.
+    Connections are reused per thread (and re-opened after a fork), the database
+    runs in WAL mode so readers never block the writer, and expiry is indexed.
+    """
+
+    def __init__(self, database, busy_timeout_ms=5000, delete_batch_size=500):
+        self.database = database
+        self.busy_timeout_ms = busy_timeout_ms
+        self.delete_batch_size = delete_batch_size
+        self._local = threading.local()
+
+    def connection(self):
+        """Return this thread's connection, opening and tuning it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout_ms / 1000)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL only needs syncing at checkpoints to stay consistent after a crash
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8192")  # 8MB page cache
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def init_schema(self):
+        """
+        Create the sessions and jobs tables, their expiry indexes and the leases
+        table, and add columns missing from databases created by older versions
+        """
+        conn = self.connection()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    excel_path TEXT NOT NULL,
+                    excel_filename TEXT NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    results_path TEXT,
+                    plan_path TEXT,
+                    export_format TEXT,
+                    paid_at TIMESTAMP
+                )
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(sessions)")}
+            for column in ("results_path", "plan_path", "export_format"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} TEXT")
+            if "paid_at" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN paid_at TIMESTAMP")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sessions_created_at "
+                "ON sessions (created_at)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    updated_at TIMESTAMP NOT NULL,
+                    estimate TEXT,
+                    eta_seconds REAL,
+                    result TEXT,
+                    memory TEXT
+                )
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "memory" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN memory TEXT")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def store(
+        self,
+        session_id,
+        excel_path,
+        excel_filename,
+        results_path=None,
+        plan_path=None,
+        export_format="xlsx",
+    ):
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                """INSERT INTO sessions (session_id, excel_path, excel_filename,
+                   created_at, results_path, plan_path, export_format)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    session_id,
+                    excel_path,
+                    excel_filename,
+                    datetime.now(),
+                    results_path,
+                    plan_path,
+                    export_format,
+                ),
+            )
+
+    def get(self, session_id):
+        row = (
+            self.connection()
+            .execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,))
+            .fetchone()
+        )
+        return dict(row) if row else None
+
+    def exists(self, session_id):
+        row = (
+            self.connection()
+            .execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,))
+            .fetchone()
+        )
+        return row is not None
+
+    def mark_paid(self, session_id):
+        """Record that the session's report has been paid for"""
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "UPDATE sessions SET paid_at = COALESCE(paid_at, ?) WHERE session_id = ?",
+                (datetime.now(), session_id),
+            )
+
+    def expired(self, cutoff_time, limit=-1):
+        """Sessions created before the cutoff, found through the created_at index"""
+        cursor = self.connection().execute(
+            "SELECT session_id, excel_path, results_path, plan_path FROM sessions "
+            "WHERE created_at < ? "
+            "ORDER BY created_at LIMIT ?",
+            (cutoff_time, limit),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    def delete(self, session_ids):
+        """Delete sessions in batches so the write lock is only held briefly"""
+        session_ids = list(session_ids)
+        conn = self.connection()
+        deleted = 0
+        for start in range(0, len(session_ids), self.delete_batch_size):
+            batch = session_ids[start : start + self.delete_batch_size]
+            placeholders = ", ".join("?" * len(batch))
+            with conn:
+                cursor = conn.execute(
+                    f"DELETE FROM sessions WHERE session_id IN ({placeholders})", batch
+                )
+            deleted += cursor.rowcount
+        return deleted
+
+    def create_job(self, job_id, estimate=None, status="queued"):
+        now = datetime.now()
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                """INSERT INTO jobs (job_id, status, created_at, updated_at, estimate)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (job_id, status, now, now, json.dumps(estimate)),
+            )
+
+    def update_job(self, job_id, status=None, eta_seconds=None, result=None, memory=None):
+        """Set the given fields of a job, leaving the others as they are"""
+        fields = dict(
+            status=status,
+            eta_seconds=eta_seconds,
+            result=None if result is None else json.dumps(result),
+            memory=None if memory is None else json.dumps(memory),
+        )
+        fields = {column: value for column, value in fields.items() if value is not None}
+        fields["updated_at"] = datetime.now()
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in fields)} "
+                "WHERE job_id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def get_job(self, job_id):
+        row = (
+            self.connection()
+            .execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+            .fetchone()
+        )
+        if not row:
+            return None
+        job = dict(row)
+        for column in ("estimate", "result", "memory"):
+            job[column] = json.loads(job[column]) if job[column] else None
+        return job
+
+    def touch_jobs(self, job_ids):
+        """Mark queued or running jobs as still held by a live worker"""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return
+        placeholders = ", ".join("?" * len(job_ids))
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE job_id IN ({placeholders}) "
+                "AND status IN ('queued', 'running')",
+                (datetime.now(), *job_ids),
+            )
+
+    def fail_stale_jobs(self, cutoff_time, result):
+        """
+        Fail queued or running jobs not updated since the cutoff, whose worker
+        has died, recording result as their outcome
+        """
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'failed', result = ?, updated_at = ? "
+                "WHERE status IN ('queued', 'running') AND updated_at < ?",
+                (json.dumps(result), datetime.now(), cutoff_time),
+            )
+        return cursor.rowcount
+
+    def delete_jobs_before(self, cutoff_time):
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE created_at < ?", (cutoff_time,))
+        return cursor.rowcount
+
+    def ping(self):
+        self.connection().execute("SELECT 1").fetchone()
+
+    def acquire_lease(self, name, holder, ttl_seconds):
+        """
+        Take or renew the named lease for ttl_seconds.
+        Returns False while another holder's lease has not yet expired.
+        """
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute(
+                """INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                   ON CONFLICT (name) DO UPDATE
+                   SET holder = excluded.holder, expires_at = excluded.expires_at
+                   WHERE leases.holder = excluded.holder OR leases.expires_at < ?""",
+                (name, holder, now + ttl_seconds, now),
+            )
+        return cursor.rowcount == 1
+
+    def release_lease(self, name, holder):
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder)
+            )
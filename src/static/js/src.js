@@ -32,15 +32,49 @@ function toggleDropdown(element) {
   dropdown.classList.toggle("active");
 }
 
+// Gzip CSVs before uploading where the browser can, text exports shrink 5-10x
+async function compressUpload(file) {
+  if (!("CompressionStream" in window) || !file.name.toLowerCase().endsWith(".csv")) {
+    return file;
+  }
+  const compressed = file.stream().pipeThrough(new CompressionStream("gzip"));
+  const blob = await new Response(compressed).blob();
+  return new File([blob], `${file.name}.gz`, { type: "application/gzip" });
+}
+
 document
   .getElementById("fileInput")
-  .addEventListener("change", function (e) {
+  .addEventListener("change", async function (e) {
     const file = e.target.files[0];
     if (!file) return;
 
-    uploadFile(e, file);
+    uploadFile(e, await compressUpload(file));
   });
 
+// Poll a queued calculation until it finishes, showing its ETA meanwhile.
+// Gives up once it has taken well over its first ETA.
+async function waitForJob(job, uploadBtnLabel) {
+  let data = job;
+  const deadline = Date.now() + Math.max((job.eta_seconds || 0) * 3, 300) * 1000;
+  while (data.status === "queued" || data.status === "running") {
+    if (Date.now() > deadline) {
+      return {
+        error: "The calculation is taking much longer than expected, please try again later",
+      };
+    }
+    const eta = data.eta_seconds == null ? "" : ` about ${Math.ceil(data.eta_seconds)}s`;
+    uploadBtnLabel.innerHTML = `<div class="spinner-container">
+                                  <div class="spinner"></div>Calculating...${eta}
+                                </div>`;
+    const delay = Math.min(Math.max((data.eta_seconds || 0) * 250, 500), 3000);
+    await new Promise((resolve) => setTimeout(resolve, delay));
+    const response = await fetch(`/api/jobs/${data.job_id}`);
+    data = await response.json();
+    if (!response.ok) break;
+  }
+  return data;
+}
+
 async function uploadFile(e, file, allow_short_selling="") {
   const uploadBtn = document.getElementById("fileInput");
   const uploadBtnLabel = document.getElementsByClassName("import-button")[0];
@@ -51,6 +85,7 @@ async function uploadFile(e, file, allow_short_selling="") {
   const formData = new FormData();
   formData.append("file", file);
   formData.append("allow_short_selling", allow_short_selling);
+  formData.append("export_format", document.getElementById("exportFormat").value);
 
   try {
     const response = await fetch("/api/upload", {
@@ -58,9 +93,12 @@ async function uploadFile(e, file, allow_short_selling="") {
       body: formData,
     });
 
-    const data = await response.json();
+    let data = await response.json();
+    if (response.status === 202) {
+      data = await waitForJob(data, uploadBtnLabel);
+    }
 
-    if (response.ok) {
+    if (data.success) {
       sessionId = data.session_id;
       document.getElementById("successMessage").innerHTML = `
         <p>${data.message}</p>
@@ -1,11 +1,21 @@
 from cgt_calculator import CGTCalculator
+from memory_profile import profile_stage
 from test.test_helpers import mock_handle_splits_and_ticker_changes
 
 class MockCGTCalculator(CGTCalculator):
 
-    def __init__(self, trade_history_csv_path):
+    def __init__(self, trade_history_csv_path, handle_market_data=True, memory_profile=None):
 
         # Initialise the trades data frame
-        self.trades_df = self._parse_trade_history_file(trade_history_csv_path)
-        self._initialise_trades_df()
-        mock_handle_splits_and_ticker_changes(self.trades_df)
\ No newline at end of file
+        with profile_stage(memory_profile, "parse"):
+            self._initialise_trades_df(
+                self._parse_trade_history_file(trade_history_csv_path)
+            )
+        if handle_market_data:
+            with profile_stage(memory_profile, "market_data"):
+                self.handle_splits_and_ticker_changes()
+
+    def handle_splits_and_ticker_changes(self):
+        trades_df = self.trades_df.copy()
+        mock_handle_splits_and_ticker_changes(trades_df)
+        self.trades_df = trades_df
@@ -0,0 +1,215 @@
+import io
+from pathlib import Path
+import time
+import uuid
+import zipfile
+
+import pytest
+import requests
+import stripe
+
+import app as app_module
+from loadtest.stub_servers import AlphaVantageHandler, StripeHandler, start_stub_server
+from lp_solver import LPSolveError
+import market_data_api
+
+TRADE_HISTORY = Path(__file__).parent / "trade_history_test.csv"
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("app")
+    alpha_vantage = start_stub_server(AlphaVantageHandler, 0)
+    stripe_server = start_stub_server(StripeHandler, 0)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(stripe, "api_key", "sk_test_stub")
+        monkeypatch.setattr(
+            stripe, "api_base", f"http://127.0.0.1:{stripe_server.server_port}"
+        )
+        monkeypatch.setenv(
+            "ALPHAVANTAGE_BASE_URL", f"http://127.0.0.1:{alpha_vantage.server_port}"
+        )
+        monkeypatch.setattr(market_data_api, "REQUEST_INTERVAL_SECONDS", 0.0)
+        app = app_module.create_app(
+            {
+                "TESTING": True,
+                "DATABASE": str(folder / "sessions.db"),
+                "UPLOAD_FOLDER": str(folder / "uploads"),
+                "OUTPUT_FOLDER": str(folder / "outputs"),
+                "CALCULATION_PROCESSES": 1,
+            }
+        )
+        yield app.test_client()
+    app_module.calculation_pool.shutdown()
+    alpha_vantage.shutdown()
+    stripe_server.shutdown()
+
+
+def wait_for_job(client, job_id, timeout=120):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/api/jobs/{job_id}").get_json()
+        if job["status"] not in ("queued", "running") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.2)
+
+
+def calculate(client):
+    """Upload the test trade history and return its session once calculated"""
+    response = client.post(
+        "/api/upload",
+        data={
+            "file": (TRADE_HISTORY.open("rb"), "trades.csv"),
+            "allow_short_selling": "True",
+        },
+    )
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()["job_id"])
+    assert job["status"] == "done", job
+    return job["session_id"]
+
+
+def pay(client, session_id, paid_session_id=None):
+    """Pay for paid_session_id (session_id by default), then verify it for session_id"""
+    intent = client.post(
+        "/api/create-payment-intent", json={"session_id": paid_session_id or session_id}
+    ).get_json()
+    payment_intent_id = intent["clientSecret"].split("_secret_")[0]
+    # Stands in for the browser confirming payment with Stripe.js
+    requests.post(f"{stripe.api_base}/v1/payment_intents/{payment_intent_id}/confirm")
+    return client.post(
+        "/api/verify-payment",
+        json={"payment_intent_id": payment_intent_id, "session_id": session_id},
+    )
+
+
+def test_results_require_payment(client):
+    session_id = calculate(client)
+    other_session_id = calculate(client)
+
+    assert client.get(f"/api/summary/{session_id}").status_code == 402
+    assert client.get(f"/api/download/{session_id}").status_code == 402
+
+    # Paying for one session does not unlock another
+    assert pay(client, session_id, paid_session_id=other_session_id).status_code == 400
+    assert client.get(f"/api/summary/{session_id}").status_code == 402
+
+    response = pay(client, session_id)
+    assert response.status_code == 200
+    assert response.get_json()["download_url"] == f"/api/download/{session_id}"
+
+    summary = client.get(f"/api/summary/{session_id}")
+    assert summary.status_code == 200
+    assert summary.get_json()["financial_years"]
+    assert client.get(f"/api/download/{session_id}").status_code == 200
+    assert client.get(f"/api/summary/{other_session_id}").status_code == 402
+
+
+def test_plan_requires_payment(client):
+    session_id = calculate(client)
+    plan = dict(
+        session_id=session_id,
+        symbol="UBER",
+        quantity=100,
+        sell_date="2026-02-01",
+        unit_price=90,
+    )
+
+    response = client.post("/api/plan", json=plan)
+    assert response.status_code == 402
+    assert "taxable_capital_gain" not in response.get_json()
+
+    assert pay(client, session_id).status_code == 200
+    response = client.post("/api/plan", json=plan)
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["success"]
+
+    # Non-finite numbers are rejected rather than solved with
+    for field in ["quantity", "unit_price"]:
+        for value in ["nan", "inf", "-Infinity"]:
+            response = client.post("/api/plan", json={**plan, field: value})
+            assert response.status_code == 400
+            assert "finite" in response.get_json()["error"]
+
+
+def test_upload_batch_queues_each_portfolio(client):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.write(TRADE_HISTORY, "clients/zipped.csv")
+    archive.seek(0)
+
+    response = client.post(
+        "/api/upload-batch",
+        data={
+            "allow_short_selling": "True",
+            "files": [
+                (TRADE_HISTORY.open("rb"), "plain.csv"),
+                (io.BytesIO(b"not,a,trade,history\n1,2,3,4\n"), "broken.csv"),
+                (archive, "clients.zip"),
+            ],
+        },
+    )
+
+    assert response.status_code == 202
+    batch = response.get_json()
+    assert batch["summary"] == {"portfolios": 3, "queued": 2, "invalid": 1, "rejected": 0}
+    portfolios = {portfolio["filename"]: portfolio for portfolio in batch["portfolios"]}
+    assert portfolios["broken.csv"]["status"] == "invalid"
+    assert portfolios["broken.csv"]["parse_error"]
+    assert "short_sell_warning" not in portfolios["broken.csv"]
+
+    for filename in ["plain.csv", "zipped.csv"]:
+        assert portfolios[filename]["status"] == "queued"
+        job = wait_for_job(client, portfolios[filename]["job_id"])
+        assert job["status"] == "done", job
+        assert job["success"] and job["session_id"]
+    assert not list(Path(app_module.app.config["UPLOAD_FOLDER"]).iterdir())
+
+
+def test_upload_batch_rejects_unreadable_batches(client):
+    response = client.post(
+        "/api/upload-batch",
+        data={"files": [(io.BytesIO(b"nothing useful"), "broken.csv")]},
+    )
+    assert response.status_code == 400
+    assert response.get_json()["portfolios"][0]["status"] == "invalid"
+
+    response = client.post(
+        "/api/upload-batch", data={"files": [(io.BytesIO(b""), "notes.txt")]}
+    )
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+    assert client.post("/api/upload-batch", data={}).status_code == 400
+
+
+class _FailingCalculator:
+    def __init__(self, error):
+        self.error = error
+
+    def handle_splits_and_ticker_changes(self):
+        raise self.error
+
+
+def test_failed_jobs_report_their_error(client):
+    errors = [
+        (
+            LPSolveError("UBER", "The problem is infeasible."),
+            {
+                "symbol_error": "LP did not solve successfully for symbol: UBER",
+                "lp_error": "Error Message: The problem is infeasible.",
+            },
+        ),
+        # Single line errors, e.g. from the calculation pool
+        (
+            RuntimeError("The calculation pool has shut down"),
+            {"error": "The calculation pool has shut down"},
+        ),
+    ]
+    for error, expected in errors:
+        job_id = str(uuid.uuid4())
+        app_module.session_store.create_job(job_id, status="running")
+        app_module.run_report_job(job_id, _FailingCalculator(error), "session", True)
+        job = client.get(f"/api/jobs/{job_id}").get_json()
+        assert job["status"] == "failed"
+        assert {key: job[key] for key in expected} == expected
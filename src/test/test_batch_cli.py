@@ -0,0 +1,78 @@
+from collections import Counter
+import os
+from pathlib import Path
+import shutil
+import time
+
+from batch_cli import assign_report_paths, find_trade_histories, run_batch
+from loadtest.stub_servers import AlphaVantageHandler, start_stub_server
+import market_data_api
+
+TRADE_HISTORY = Path(__file__).parent / "trade_history_test.csv"
+
+
+def test_find_trade_histories(tmp_path):
+    for name in ["a.csv", "b.XLSX", "c.csv.gz", "d.zip", "notes.txt", "e.xls"]:
+        (tmp_path / name).write_text("")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "f.csv").write_text("")
+
+    found = find_trade_histories([str(tmp_path), str(tmp_path / "**" / "*.csv")])
+
+    expected = ["a.csv", "b.XLSX", "c.csv.gz", "d.zip", "e.xls", "nested/f.csv"]
+    assert found == sorted(str(tmp_path / name) for name in expected)
+    assert find_trade_histories([str(tmp_path / "missing")]) == []
+
+
+def test_assign_report_paths_keeps_names_unique():
+    paths = ["/in/a/trades.csv", "/in/b/trades.xlsx", "/in/c/trades.csv.gz", "/in/x.zip"]
+
+    report_paths = assign_report_paths(paths, "out")
+
+    assert [report_paths[path] for path in paths] == [
+        os.path.join("out", "trades_cgt_report.xlsx"),
+        os.path.join("out", "trades_2_cgt_report.xlsx"),
+        os.path.join("out", "trades_3_cgt_report.xlsx"),
+        os.path.join("out", "x_cgt_report.xlsx"),
+    ]
+
+
+def test_run_batch_shares_market_data_across_workers(tmp_path, monkeypatch):
+    requests = []
+
+    class CountingHandler(AlphaVantageHandler):
+        def do_GET(self):
+            symbol = self.path.split("symbol=")[1].split("&")[0]
+            requests.append((time.monotonic(), symbol))
+            super().do_GET()
+
+    server = start_stub_server(CountingHandler, 0)
+    monkeypatch.setenv("ALPHAVANTAGE_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    # Worker processes are forked and inherit the interval
+    monkeypatch.setattr(market_data_api, "REQUEST_INTERVAL_SECONDS", 0.05)
+    for name in ["a.csv", "b.csv"]:
+        shutil.copy(TRADE_HISTORY, tmp_path / name)
+    (tmp_path / "broken.csv").write_text("not,a,trade,history\n1,2,3,4\n")
+    paths = find_trade_histories([str(tmp_path)])
+
+    try:
+        summary = run_batch(paths, str(tmp_path / "out"), workers=2, allow_short_selling=True)
+    finally:
+        server.shutdown()
+
+    assert (summary["files_processed"], summary["succeeded"], summary["failed"]) == (3, 2, 1)
+    records = {Path(record["file"]).name: record for record in summary["files"]}
+    assert records["broken.csv"]["status"] == "failed"
+    assert records["broken.csv"]["error"]
+    for name in ["a.csv", "b.csv"]:
+        assert os.path.exists(records[name]["report"])
+        assert records[name]["solver"]["solves"] > 0
+
+    # Both histories hold the same symbols, each is looked up once between them,
+    # and requests from both workers are spaced out by the one rate limiter
+    counts = Counter(symbol for _, symbol in requests)
+    assert set(counts.values()) == {1}
+    assert summary["cached_split_symbols"] == len(counts)
+    times = sorted(requested_at for requested_at, _ in requests)
+    assert min(b - a for a, b in zip(times, times[1:])) > 0.025
+    assert times[-1] - times[0] > 0.9 * 0.05 * (len(times) - 1)
@@ -0,0 +1,51 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from calculation_pool import CalculationCrashed, CalculationPool
+from reports import write_report
+from test.mock_cgt_calculator import MockCGTCalculator
+
+TRADE_HISTORY = str(Path(__file__).parent / "trade_history_test.csv")
+
+
+@pytest.fixture
+def pool():
+    pool = CalculationPool(processes=1, max_jobs=2, memory_limit_mb=1024, preload=[])
+    yield pool
+    pool.shutdown()
+
+
+def test_processes_are_recycled(pool):
+    pids = [pool.submit(os.getpid).result(timeout=60) for _ in range(5)]
+    # Each process runs two jobs before it is replaced
+    assert pids[0] == pids[1] != pids[2] == pids[3] != pids[4]
+    assert pool.retired == 2
+    assert pool.pids() == [pids[4]]
+
+
+def test_jobs_over_the_memory_limit_fail_alone(pool):
+    with pytest.raises(MemoryError):
+        pool.submit(bytearray, 2 * 1024**3).result(timeout=60)
+    # The process retired after the MemoryError and the pool carries on
+    assert pool.submit(len, "abc").result(timeout=60) == 3
+    assert pool.retired == 1
+
+
+def test_crashed_process_fails_its_job(pool):
+    with pytest.raises(CalculationCrashed):
+        pool.submit(os._exit, 1).result(timeout=60)
+    assert pool.submit(len, "abcd").result(timeout=60) == 4
+
+
+def test_write_report_in_pool(pool, tmp_path):
+    calculator = MockCGTCalculator(TRADE_HISTORY)
+    report = pool.submit(
+        write_report, calculator, "session", True, str(tmp_path), 2023
+    ).result(timeout=120)
+
+    assert max(report["financial_years"]) == 2023
+    for key in ("excel_path", "results_path", "plan_path"):
+        assert os.path.exists(report[key])
+    assert report["excel_filename"] == "cgt_report_session.xlsx"
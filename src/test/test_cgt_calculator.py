@@ -1,9 +1,17 @@
+import csv
+from datetime import datetime
+import gzip
 from pathlib import Path
+import shutil
+import zipfile
 
 import numpy as np
+import openpyxl
+import pandas as pd
 from pandas import Timestamp
 import pytest
 
+from cgt_calculator import CGTCalculator, RunContext
 from test.mock_cgt_calculator import MockCGTCalculator
 
 
@@ -21,7 +29,236 @@ def test_cgt_calculator(path_to_csv):
     results_per_fy = MockCGTCalculator(str(path_to_csv)).execute(
         allow_short_selling=True
     )
-    assert results_per_fy == TEST_RESULT
+    assert results_per_fy.keys() == TEST_RESULT.keys()
+    for fy, expected in TEST_RESULT.items():
+        result = results_per_fy[fy]
+        assert result.keys() == expected.keys()
+        pairs = result["buy_and_sell_pairs"]
+        assert pairs.keys() == expected["buy_and_sell_pairs"].keys()
+        for symbol, expected_rows in expected["buy_and_sell_pairs"].items():
+            rows = [tuple(row) for row in pairs[symbol].rows()]
+            assert rows == [tuple(row) for row in expected_rows], (fy, symbol)
+        for key, value in expected.items():
+            if key == "buy_and_sell_pairs":
+                continue
+            if isinstance(value, float):
+                # Gains are summed from trade amounts in cents, which can move
+                # a total by its last ulp, e.g. FY2023 short_term
+                assert result[key] == pytest.approx(value, rel=1e-9), (fy, key)
+            else:
+                assert result[key] == value, (fy, key)
+
+
+def test_target_fy_stops_after_that_year(path_to_csv):
+    results_per_fy = MockCGTCalculator(str(path_to_csv)).execute(
+        allow_short_selling=True, target_fy=2022
+    )
+    assert list(results_per_fy) == [2019, 2020, 2021, 2022]
+    for fy in results_per_fy:
+        assert results_per_fy[fy]["taxable_capital_gain"] == pytest.approx(
+            TEST_RESULT[fy]["taxable_capital_gain"], rel=1e-9
+        )
+
+
+def test_fractional_shares_are_kept(tmp_path):
+    history = tmp_path / "fractional.csv"
+    history.write_text(
+        "trade_date,symbol,quantity,side,transaction_amount\n"
+        "1/8/2023,VTI.NYS,2.5,Buy,500.00\n"
+        "1/9/2023,VTI.NYS,1.25,Sell,300.00\n"
+    )
+    results_per_fy = MockCGTCalculator(str(history)).execute()
+
+    [(_, _, quantity, per_unit_gain)] = results_per_fy[2024]["buy_and_sell_pairs"][
+        "VTI"
+    ].rows()
+    assert quantity == 1.25
+    assert per_unit_gain == pytest.approx(40.0)
+    assert results_per_fy[2024]["short_term"] == pytest.approx(50.0)
+
+
+def test_crypto_quantities_keep_8_decimal_places(tmp_path):
+    history = tmp_path / "crypto.csv"
+    history.write_text(
+        "trade_date,symbol,quantity,side,transaction_amount\n"
+        "1/8/2023,BTC,0.00004,Buy,1.00\n"
+        "1/9/2023,BTC,0.00004,Sell,102.00\n"
+        "1/8/2023,ETH,0.123456,Buy,400.00\n"
+        "1/9/2023,ETH,0.123456,Sell,500.00\n"
+    )
+    results_per_fy = MockCGTCalculator(str(history)).execute()
+
+    pairs = results_per_fy[2024]["buy_and_sell_pairs"]
+    [(_, _, quantity, per_unit_gain)] = pairs["BTC"].rows()
+    assert quantity == 0.00004
+    assert quantity * per_unit_gain == pytest.approx(101.0)
+    [(_, _, quantity, per_unit_gain)] = pairs["ETH"].rows()
+    assert quantity == 0.123456
+    assert quantity * per_unit_gain == pytest.approx(100.0)
+    assert results_per_fy[2024]["short_term"] == pytest.approx(201.0)
+
+    history.write_text(
+        "trade_date,symbol,quantity,side,transaction_amount\n"
+        "1/8/2023,BTC,0.000000001,Buy,1.00\n"
+    )
+    with pytest.raises(ValueError, match="too small"):
+        MockCGTCalculator(str(history))
+
+
+def write_workbook(path, sheets):
+    """Save sheets of rows, each under a title row as in the broker exports"""
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for i, rows in enumerate(sheets):
+        sheet = workbook.create_sheet(f"Sheet{i}")
+        sheet.append([f"Export {i}"])
+        for row in rows:
+            sheet.append(row)
+    workbook.save(path)
+
+
+def test_xlsx_histories_are_streamed(path_to_csv, tmp_path, monkeypatch):
+    # A generic history reads the same as its CSV, in chunks
+    with open(path_to_csv) as f:
+        rows = [
+            [float(value) if value.replace(".", "").isdigit() else value for value in row]
+            for row in csv.reader(f)
+        ]
+    write_workbook(tmp_path / "generic.xlsx", [rows])
+    from_csv = CGTCalculator(str(path_to_csv), handle_market_data=False)
+    monkeypatch.setattr(CGTCalculator, "csv_chunk_rows", 7)
+    from_xlsx = CGTCalculator(str(tmp_path / "generic.xlsx"), handle_market_data=False)
+    pd.testing.assert_frame_equal(from_xlsx.trades_df, from_csv.trades_df)
+    assert not from_xlsx.nabtrade
+
+    # NabTrade's trades are read from its fourth and fifth sheets, pruned to
+    # the columns used, and give the same trades as reading the sheets whole
+    movements = [
+        ["Narrative", "Date", "Movement Type", "Code", "Brokerage", "Quantity",
+         "Settlement Amount (AUD)"],
+        ["x", datetime(2021, 8, 2), "BUY", "ABC", 9.5, 100, 1000.0],
+        ["x", datetime(2021, 9, 1), "DIVIDEND", "ABC", None, None, 12.0],
+        ["x", datetime(2021, 10, 1), "CHANGE_SECURITY_CODE", "ABC", None, 100, None],
+        ["x", datetime(2021, 10, 1), "CHANGE_SECURITY_CODE", "XYZ", None, 100, None],
+        [None] * 7,
+        ["x", datetime(2022, 1, 4), "SELL", "XYZ", 9.5, 40, 600.0],
+    ]
+    other_sheet = [["Account Name", "Balance"], ["NABTRADE 123", 5.0]]
+    write_workbook(
+        tmp_path / "nabtrade.xlsx",
+        [other_sheet, other_sheet, other_sheet, movements, movements[:2]],
+    )
+    nabtrade = CGTCalculator(str(tmp_path / "nabtrade.xlsx"), handle_market_data=False)
+    assert nabtrade.nabtrade
+
+    expected = CGTCalculator.__new__(CGTCalculator)
+    expected._initialise_trades_df(
+        CGTCalculator._transform_nabtrade_sheet(df).dropna(axis=0)
+        for df in pd.read_excel(
+            tmp_path / "nabtrade.xlsx", sheet_name=[3, 4], skiprows=1
+        ).values()
+    )
+    pd.testing.assert_frame_equal(nabtrade.trades_df, expected.trades_df)
+    assert list(nabtrade.trades_df["symbol"]) == ["XYZ", "XYZ", "ABC"]
+
+
+def test_compressed_histories_are_streamed(path_to_csv, tmp_path, monkeypatch):
+    from_csv = CGTCalculator(str(path_to_csv), handle_market_data=False)
+    with open(path_to_csv, "rb") as src, gzip.open(tmp_path / "trades.csv.gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    with open(path_to_csv) as f:
+        rows = [
+            [float(value) if value.replace(".", "").isdigit() else value for value in row]
+            for row in csv.reader(f)
+        ]
+    write_workbook(tmp_path / "generic.xlsx", [rows])
+    with zipfile.ZipFile(tmp_path / "csv.zip", "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.write(path_to_csv, "exports/trades.csv")
+        archive.writestr("__MACOSX/exports/._trades.csv", b"")
+    with zipfile.ZipFile(tmp_path / "xlsx.zip", "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.write(tmp_path / "generic.xlsx", "generic.xlsx")
+
+    shutil.copy(tmp_path / "trades.csv.gz", tmp_path / "TRADES.CSV.GZ")
+    shutil.copy(tmp_path / "csv.zip", tmp_path / "CSV.ZIP")
+
+    monkeypatch.setattr(CGTCalculator, "csv_chunk_rows", 7)
+    for name in ("trades.csv.gz", "csv.zip", "xlsx.zip", "TRADES.CSV.GZ", "CSV.ZIP"):
+        calculator = CGTCalculator(str(tmp_path / name), handle_market_data=False)
+        pd.testing.assert_frame_equal(calculator.trades_df, from_csv.trades_df)
+    # The workbook decompressed to be read is removed
+    assert not list(tmp_path.glob("*.zip.xlsx"))
+
+    monkeypatch.setattr(CGTCalculator, "max_decompressed_bytes", 1000)
+    for name in ("trades.csv.gz", "csv.zip", "xlsx.zip"):
+        with pytest.raises(ValueError, match="larger than .* once decompressed"):
+            CGTCalculator(str(tmp_path / name), handle_market_data=False)
+    assert not list(tmp_path.glob("*.zip.xlsx"))
+
+    with zipfile.ZipFile(tmp_path / "two.zip", "w") as archive:
+        archive.write(path_to_csv, "a.csv")
+        archive.write(path_to_csv, "b.csv")
+    with pytest.raises(ValueError, match="exactly one"):
+        CGTCalculator(str(tmp_path / "two.zip"), handle_market_data=False)
+
+
+def test_short_sells_are_found_before_solving(tmp_path):
+    history = tmp_path / "short.csv"
+    history.write_text(
+        "trade_date,symbol,quantity,side,transaction_amount\n"
+        "1/8/2022,VTI.NYS,10,Buy,100.00\n"
+        "1/9/2022,VTI.NYS,4,Sell,20.00\n"
+        "1/8/2023,VTI.NYS,4,Sell,12.00\n"
+        "1/9/2023,VTI.NYS,6,Sell,12.00\n"
+    )
+    calculator = MockCGTCalculator(str(history))
+    context = RunContext()
+    with pytest.raises(ValueError, match="Short selling detected on symbols: VTI"):
+        calculator.execute(context=context)
+    assert context.solve_log == []
+
+    # 6 units are carried into FY2024, which sells 10: the 4 short sold units
+    # come from the cheapest sell
+    results_per_fy = calculator.execute(allow_short_selling=True)
+    assert results_per_fy[2023]["short_sell_gain"] == 0
+    assert results_per_fy[2024]["short_sell_gain"] == pytest.approx(8.0)
+    pairs = list(results_per_fy[2024]["buy_and_sell_pairs"]["VTI"].rows())
+    assert pairs[0] == (None, Timestamp("2023-09-01"), 4.0, 2.0)
+    assert sum(quantity for _, _, quantity, _ in pairs) == 10.0
+
+
+def test_fingerprint_is_stable_and_tracks_trades(path_to_csv, tmp_path):
+    fingerprint = MockCGTCalculator(str(path_to_csv)).fingerprint()
+    assert MockCGTCalculator(str(path_to_csv)).fingerprint() == fingerprint
+
+    changed = tmp_path / "changed.csv"
+    changed.write_text(path_to_csv.read_text().replace("7891.59", "7891.60", 1))
+    assert MockCGTCalculator(str(changed)).fingerprint() != fingerprint
+
+
+def test_solver_options_and_solve_log(path_to_csv):
+    calculator = MockCGTCalculator(str(path_to_csv))
+    context = RunContext()
+    results_per_fy = calculator.execute(
+        allow_short_selling=True,
+        solver_options=dict(method="highs-ipm", presolve=False, time_limit=10.0),
+        context=context,
+    )
+
+    for fy in results_per_fy:
+        assert results_per_fy[fy]["taxable_capital_gain"] == pytest.approx(
+            TEST_RESULT[fy]["taxable_capital_gain"], rel=1e-9
+        )
+    assert context.solve_log
+    for entry in context.solve_log:
+        assert entry["method"] == "highs-ipm"
+        assert entry["status"] == 0
+        assert entry["nonzeros"] > 0
+        assert entry["rows"] > 0 and entry["columns"] > 0
+
+    with pytest.raises(ValueError, match="Unknown solver method"):
+        MockCGTCalculator(str(path_to_csv)).execute(
+            allow_short_selling=True, solver_options=dict(method="simplex")
+        )
 
 
 TEST_RESULT = {
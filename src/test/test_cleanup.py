@@ -0,0 +1,45 @@
+import os
+import time
+from datetime import timedelta
+
+from cleanup import run_cleanup, sweep_stale_files
+from session_store import SessionStore
+
+
+def _write(path, size, age_seconds):
+    path.write_bytes(b"x" * size)
+    mtime = time.time() - age_seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_sweep_stale_files_only_removes_old_files(tmp_path):
+    _write(tmp_path / "orphan_1.csv", 100, age_seconds=7200)
+    _write(tmp_path / "orphan_2.csv", 50, age_seconds=7200)
+    _write(tmp_path / "in_progress.csv", 10, age_seconds=5)
+
+    metrics = sweep_stale_files(tmp_path, timedelta(hours=1), batch_size=1)
+
+    assert metrics["files_deleted"] == 2
+    assert metrics["bytes_reclaimed"] == 150
+    assert os.listdir(tmp_path) == ["in_progress.csv"]
+
+
+def test_only_lease_holder_runs_cleanup(tmp_path):
+    uploads = tmp_path / "uploads"
+    outputs = tmp_path / "outputs"
+    uploads.mkdir()
+    outputs.mkdir()
+    _write(uploads / "orphan.csv", 100, age_seconds=7200)
+
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    store.init_schema()
+    store.acquire_lease("cleanup", "another-worker", ttl_seconds=60)
+
+    assert run_cleanup(store, str(uploads), str(outputs)) is None
+    assert os.listdir(uploads) == ["orphan.csv"]
+
+    store.release_lease("cleanup", "another-worker")
+    metrics = run_cleanup(store, str(uploads), str(outputs))
+    assert metrics["uploads"]["files_deleted"] == 1
+    assert metrics["bytes_reclaimed"] == 100
+    assert os.listdir(uploads) == []
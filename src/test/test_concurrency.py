@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from cgt_calculator import RunContext
+from test.mock_cgt_calculator import MockCGTCalculator
+
+TRADE_HISTORY = str(Path(__file__).parent / "trade_history_test.csv")
+TARGET_FYS = [None, 2021, 2023]
+
+
+def snapshot(results_per_fy):
+    return {
+        fy: (
+            {key: value for key, value in fy_results.items() if key != "buy_and_sell_pairs"},
+            {
+                symbol: list(pairs.rows())
+                for symbol, pairs in fy_results["buy_and_sell_pairs"].items()
+            },
+        )
+        for fy, fy_results in results_per_fy.items()
+    }
+
+
+def test_concurrent_runs_match_sequential_runs():
+    expected = {}
+    for target_fy in TARGET_FYS:
+        context = RunContext()
+        results_per_fy = MockCGTCalculator(TRADE_HISTORY).execute(
+            True, target_fy=target_fy, context=context
+        )
+        expected[target_fy] = (snapshot(results_per_fy), len(context.solve_log))
+
+    shared = MockCGTCalculator(TRADE_HISTORY)
+
+    def run(i):
+        target_fy = TARGET_FYS[i % len(TARGET_FYS)]
+        # Half the runs share one calculator, the others parse their own
+        calculator = shared if i % 2 else MockCGTCalculator(TRADE_HISTORY)
+        if i % 4 == 3:
+            context = RunContext()
+            with pytest.raises(ValueError, match="Short selling detected"):
+                calculator.execute(False, target_fy=target_fy, context=context)
+            return None, context
+        context = RunContext()
+        results_per_fy = calculator.execute(True, target_fy=target_fy, context=context)
+        return (target_fy, snapshot(results_per_fy)), context
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        outcomes = list(executor.map(run, range(12)))
+
+    for outcome, context in outcomes:
+        if outcome is None:
+            assert context.solve_log == []
+            continue
+        target_fy, results = outcome
+        assert results == expected[target_fy][0]
+        assert len(context.solve_log) == expected[target_fy][1]
+        assert context.planning_state["fy"] == max(results)
+    # Nothing of a run is left on the calculator for another to read
+    assert not hasattr(shared, "context") and not hasattr(shared, "solve_log")
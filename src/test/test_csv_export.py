@@ -0,0 +1,99 @@
+import csv
+import io
+import os
+import time
+import zipfile
+from pathlib import Path
+
+from pandas import Timestamp
+
+from csv_export import CSV_HEADER, iter_results_csv_zip
+from reports import write_report
+from results import BuySellPairs, save_results
+from test.mock_cgt_calculator import MockCGTCalculator
+
+TRADE_HISTORY = str(Path(__file__).parent / "trade_history_test.csv")
+
+
+def _totals(value):
+    return dict(
+        short_term=value,
+        long_term=value,
+        total_capital_gain=value,
+        capital_gain_discount=value,
+        loss=value,
+        short_sell_gain=value,
+        taxable_capital_gain=value,
+    )
+
+
+def _zip_csvs(results_path, **kwargs):
+    data = b"".join(iter_results_csv_zip(results_path, **kwargs))
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        return {
+            name: list(csv.reader(io.StringIO(archive.read(name).decode())))
+            for name in archive.namelist()
+        }
+
+
+def test_csv_zip_holds_pairs_and_summary_of_each_pair_year(tmp_path):
+    results = {
+        2023: dict(buy_and_sell_pairs={}, **_totals(1.0)),
+        2024: dict(
+            buy_and_sell_pairs={
+                "BHP": BuySellPairs.from_rows(
+                    [
+                        (Timestamp("2021-03-01"), Timestamp("2023-08-01"), 100.0, 3.0),
+                        (None, Timestamp("2023-09-01"), 5.0, -2.0),
+                        (Timestamp("2022-03-01"), Timestamp("2023-10-01"), 7.0, 1.5),
+                    ]
+                ),
+            },
+            **_totals(2.5),
+        ),
+    }
+    path = tmp_path / "results.npz"
+    save_results(results, path, pair_years=[2024])
+
+    # Batches smaller than a symbol's pairs are written as separate chunks
+    csvs = _zip_csvs(path, batch_rows=2)
+
+    assert list(csvs) == ["cgt_2024.csv"]
+    assert csvs["cgt_2024.csv"] == [
+        CSV_HEADER,
+        ["BHP", "2021-03-01", "2023-08-01", "100.0", "3.0"],
+        ["BHP", "", "2023-09-01", "5.0", "-2.0"],
+        ["BHP", "2022-03-01", "2023-10-01", "7.0", "1.5"],
+        [],
+        ["Total Capital Gain", "2.5"],
+        ["Loss", "2.5"],
+        ["Capital Gains Discount", "2.5"],
+        ["Taxable Capital Gain", "2.5"],
+    ]
+
+
+def test_csv_zip_of_the_same_results_is_identical(tmp_path):
+    path = tmp_path / "results.npz"
+    save_results({2024: dict(buy_and_sell_pairs={}, **_totals(1.0))}, path)
+    os.utime(path, (1_700_000_000, 1_700_000_000))
+
+    # Its ETag is derived from the results file, so members are dated by it
+    first = b"".join(iter_results_csv_zip(path))
+    assert b"".join(iter_results_csv_zip(path)) == first
+    with zipfile.ZipFile(io.BytesIO(first)) as archive:
+        assert archive.getinfo("cgt_2024.csv").date_time == (
+            time.localtime(1_700_000_000)[:6]
+        )
+
+
+def test_csv_report_writes_no_workbook(tmp_path):
+    calculator = MockCGTCalculator(TRADE_HISTORY)
+    report = write_report(calculator, "csv", True, str(tmp_path), export_format="csv")
+
+    assert report["excel_filename"] == "cgt_report_csv.zip"
+    assert not list(tmp_path.glob("*.xlsx"))
+    csvs = _zip_csvs(report["results_path"])
+    assert list(csvs) == [f"cgt_{fy}.csv" for fy in report["financial_years"]]
+    for rows in csvs.values():
+        assert rows[0] == CSV_HEADER
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+from flask import Flask
+
+from downloads import ReportCache, file_etag, send_report
+
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+@pytest.fixture
+def report(tmp_path):
+    path = tmp_path / "outputs" / "cgt_report_abc.xlsx"
+    path.parent.mkdir()
+    path.write_bytes(bytes(range(256)) * 4)
+    return path
+
+
+def client(report, **kwargs):
+    app = Flask(__name__)
+    app.testing = True
+
+    @app.route("/download")
+    def download():
+        return send_report(report, XLSX, "cgt_report_abc.xlsx", **kwargs)
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_etag_and_range_requests(report, cached):
+    cache = ReportCache(max_file_bytes=4096, max_total_bytes=8192) if cached else None
+    downloads = client(report, cache=cache)
+
+    response = downloads.get("/download")
+    assert response.status_code == 200
+    assert response.data == report.read_bytes()
+    etag = response.headers["ETag"]
+    assert etag == f'"{file_etag(os.stat(report))}"'
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert "attachment; filename=cgt_report_abc.xlsx" in response.headers["Content-Disposition"]
+
+    response = downloads.get("/download", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    response = downloads.get("/download", headers={"Range": "bytes=1000-"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 1000-1023/1024"
+    assert response.data == report.read_bytes()[1000:]
+    assert len(cache or []) == cached
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    paths = []
+    for name in "abc":
+        path = tmp_path / name
+        path.write_bytes(name.encode() * 10)
+        paths.append(str(path))
+    cache = ReportCache(max_file_bytes=10, max_total_bytes=20)
+
+    for path in paths[:2]:
+        assert cache.get(path, os.stat(path)) == open(path, "rb").read()
+    cache.get(paths[0], os.stat(paths[0]))
+    cache.get(paths[2], os.stat(paths[2]))
+
+    assert len(cache) == 2
+    assert (paths[1], os.stat(paths[1]).st_mtime_ns, 10) not in cache._entries
+
+    large = tmp_path / "large"
+    large.write_bytes(b"x" * 11)
+    assert not cache.cacheable(os.stat(large))
+
+
+def test_offloaded_downloads(report):
+    response = client(report, offload="x-sendfile").get("/download")
+    assert response.headers["X-Sendfile"] == str(report)
+    assert response.data == b""
+
+    downloads = client(
+        report,
+        offload="x-accel-redirect",
+        output_folder=str(report.parent),
+        accel_prefix="/protected-outputs/",
+    )
+    response = downloads.get("/download")
+    assert response.headers["X-Accel-Redirect"] == "/protected-outputs/cgt_report_abc.xlsx"
+    assert response.data == b""
+
+    response = downloads.get("/download", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert "X-Accel-Redirect" not in response.headers
+
+
+def test_missing_report(report):
+    report.unlink()
+    with pytest.raises(FileNotFoundError):
+        client(report).get("/download")
@@ -0,0 +1,137 @@
+from pathlib import Path
+import threading
+import time
+
+import pytest
+
+from job_scheduler import JobEstimate, JobScheduler, SchedulerFull, estimate_job
+from test.mock_cgt_calculator import MockCGTCalculator
+
+
+def make_estimate(seconds):
+    return JobEstimate(
+        trades=0,
+        symbols=0,
+        financial_years=0,
+        solves=0,
+        lp_edges=0,
+        uncached_symbols=0,
+        seconds=seconds,
+    )
+
+
+def test_estimate_job(tmp_path):
+    history = tmp_path / "history.csv"
+    history.write_text(
+        "trade_date,symbol,quantity,side,transaction_amount\n"
+        "1/8/2022,VTI.NYS,10,Buy,100.00\n"
+        "1/9/2022,VTI.NYS,5,Buy,50.00\n"
+        "1/10/2022,VTI.NYS,4,Sell,60.00\n"
+        "1/8/2023,VTI.NYS,4,Sell,60.00\n"
+        "1/9/2023,VTI.NYS,2,Sell,30.00\n"
+        "1/9/2023,IVV.NYS,2,Buy,30.00\n"
+    )
+    trades_df = MockCGTCalculator(str(history)).trades_df
+
+    estimate = estimate_job(trades_df, uncached_symbols=1)
+    assert (estimate.trades, estimate.symbols, estimate.financial_years) == (6, 2, 2)
+    assert estimate.solves == 2
+    # FY2023 has 2 buys for 1 sell, FY2024 the same 2 buys for 2 sells
+    assert estimate.lp_edges == 2 * 1 + 2 * 2
+    assert estimate.uncached_symbols == 1
+
+    estimate = estimate_job(trades_df, target_fy=2023)
+    assert (estimate.trades, estimate.solves, estimate.lp_edges) == (3, 1, 2)
+    assert estimate.seconds < estimate_job(trades_df).seconds
+
+
+def test_estimate_of_test_history():
+    trades_df = MockCGTCalculator(
+        str(Path(__file__).parent / "trade_history_test.csv")
+    ).trades_df
+    estimate = estimate_job(trades_df)
+    assert estimate.trades == len(trades_df)
+    assert 0 < estimate.seconds < 30
+
+
+def test_shortest_job_runs_first():
+    scheduler = JobScheduler(workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    finished = threading.Event()
+    order = []
+
+    def blocker():
+        started.set()
+        release.wait()
+
+    def job(name):
+        order.append(name)
+        if len(order) == 3:
+            finished.set()
+
+    scheduler.submit("blocker", make_estimate(1), blocker)
+    started.wait()
+    _, long_eta = scheduler.submit("long", make_estimate(10), lambda: job("long"))
+    _, short_eta = scheduler.submit("short", make_estimate(2), lambda: job("short"))
+    scheduler.submit("medium", make_estimate(5), lambda: job("medium"))
+    assert short_eta < long_eta
+    # The long job now waits for the short and medium ones too
+    assert scheduler.eta("long") > long_eta
+    assert scheduler.eta("missing") is None
+
+    release.set()
+    assert finished.wait(5)
+    assert order == ["short", "medium", "long"]
+
+
+def test_large_jobs_have_their_own_bounded_lane():
+    scheduler = JobScheduler(
+        workers=1, large_workers=1, large_job_seconds=60, max_large_queued=1
+    )
+    started = threading.Event()
+    release = threading.Event()
+    small_done = threading.Event()
+
+    def whale():
+        started.set()
+        release.wait()
+
+    lane, _ = scheduler.submit("whale", make_estimate(600), whale)
+    assert lane == "large"
+    started.wait()
+    scheduler.submit("queued whale", make_estimate(600), release.wait)
+    with pytest.raises(SchedulerFull):
+        scheduler.submit("another whale", make_estimate(600), release.wait)
+
+    # Small jobs are not held up by the running whale
+    lane, eta = scheduler.submit("small", make_estimate(1), small_done.set)
+    assert lane == "small" and eta == 1
+    assert small_done.wait(5)
+    release.set()
+
+
+def test_waiting_jobs_age_ahead_of_newer_shorter_ones():
+    scheduler = JobScheduler(workers=1, aging=1000)
+    started = threading.Event()
+    release = threading.Event()
+    finished = threading.Event()
+    order = []
+
+    def job(name):
+        order.append(name)
+        if len(order) == 2:
+            finished.set()
+
+    scheduler.submit("blocker", make_estimate(1), lambda: (started.set(), release.wait()))
+    started.wait()
+    scheduler.submit("medium", make_estimate(5), lambda: job("medium"))
+    # 50ms of waiting is worth 50s of estimate
+    time.sleep(0.05)
+    scheduler.submit("short", make_estimate(2), lambda: job("short"))
+    assert sorted(scheduler.job_ids()) == ["blocker", "medium", "short"]
+
+    release.set()
+    assert finished.wait(5)
+    assert order == ["medium", "short"]
+    assert scheduler.job_ids() == []
@@ -0,0 +1,104 @@
+import pandas as pd
+import pytest
+
+from fixed_point import to_units
+from lp_solver import SOLVER_METHODS, build_symbol_year_model, solve_symbol_year_model
+
+
+def make_model(buys, sells):
+    buys = pd.DataFrame(buys, columns=["id", "trade_date", "qty_avail", "unit_price"])
+    sells = pd.DataFrame(sells, columns=["id", "trade_date", "quantity", "unit_price"])
+    buys["trade_date"] = pd.to_datetime(buys["trade_date"])
+    sells["trade_date"] = pd.to_datetime(sells["trade_date"])
+    buys["qty_avail"] = to_units(buys["qty_avail"])
+    sells["quantity"] = to_units(sells["quantity"])
+    return build_symbol_year_model(buys, sells)
+
+
+def test_flat_positions_split_the_lp():
+    model = make_model(
+        buys=[
+            [0, "2023-08-01", 10, 5.0],
+            [1, "2023-08-02", 10, 9.0],
+            # The position is flat after 2023-09-01 and again after 2023-11-01
+            [3, "2023-10-01", 5, 2.0],
+            [5, "2024-01-10", 5, 1.0],
+        ],
+        sells=[
+            [2, "2023-09-01", 20, 8.0],
+            [4, "2023-11-01", 5, 3.0],
+            [6, "2024-02-01", 2, 4.0],
+        ],
+    )
+    decomposed = solve_symbol_year_model(model, "SYM")
+    whole = solve_symbol_year_model(model, "SYM", dict(decompose=False))
+
+    assert decomposed["diagnostics"]["components"] == 3
+    assert (
+        decomposed["diagnostics"]["largest_component_columns"]
+        < whole["diagnostics"]["columns"]
+    )
+    for key in ("short_term", "long_term", "loss"):
+        assert decomposed[key] == pytest.approx(whole[key])
+    # 20 units sold at 8 from parcels bought at 5 and 9, then each later sell
+    # from the one parcel bought since the position was last flat
+    assert decomposed["short_term"] == pytest.approx(30 + 5 + 6)
+    assert decomposed["loss"] == pytest.approx(10)
+
+    used = decomposed["x"].groupby("sell_id")["buy_id"].apply(set).to_dict()
+    assert used == {2: {0, 1}, 4: {3}, 6: {5}}
+
+
+def test_parallel_components_and_infeasible_part():
+    model = make_model(
+        buys=[[0, "2023-08-01", 10, 5.0], [2, "2023-10-01", 10, 5.0]],
+        sells=[[1, "2023-09-01", 10, 6.0], [3, "2023-11-01", 10, 7.0]],
+    )
+    result = solve_symbol_year_model(model, "SYM", dict(workers=2))
+    assert result["diagnostics"]["components"] == 2
+    assert result["short_term"] == pytest.approx(10 + 20)
+
+    # The second sell has nothing left to match once the position was flat
+    model = make_model(
+        buys=[[0, "2023-08-01", 10, 5.0]],
+        sells=[[1, "2023-09-01", 10, 6.0], [3, "2023-11-01", 10, 7.0]],
+    )
+    with pytest.raises(RuntimeError, match="LP did not solve successfully"):
+        solve_symbol_year_model(model, "SYM")
+
+
+def test_ties_are_broken_alike_whole_or_decomposed():
+    # Several matchings reach the least A' + 0.5 B' with different losses, which
+    # the whole and the decomposed LPs used to pick between differently
+    model = make_model(
+        buys=[
+            [0, "2021-01-02", 10, 10.0],
+            [1, "2021-01-03", 10, 4.0],
+            [2, "2021-01-03", 5, 10.0],
+            [3, "2021-01-02", 5, 6.0],
+            [4, "2021-01-03", 5, 4.0],
+            [7, "2022-02-07", 5, 10.0],
+            [8, "2022-02-07", 10, 6.0],
+            [9, "2022-02-08", 5, 10.0],
+            [10, "2022-02-06", 10, 4.0],
+            [11, "2022-02-07", 10, 4.0],
+        ],
+        sells=[
+            [5, "2021-01-11", 10, 7.0],
+            [6, "2022-01-16", 25, 11.0],
+            [12, "2022-02-15", 15, 7.0],
+            [13, "2023-02-20", 25, 9.0],
+        ],
+    )
+    for method in SOLVER_METHODS:
+        decomposed = solve_symbol_year_model(model, "SYM", dict(method=method))
+        whole = solve_symbol_year_model(
+            model, "SYM", dict(method=method, decompose=False)
+        )
+
+        assert decomposed["diagnostics"]["components"] == 2
+        for result in (decomposed, whole):
+            # The most loss, and of what is left the most short term gain
+            assert result["loss"] == pytest.approx(35)
+            assert result["short_term"] == pytest.approx(15)
+            assert result["long_term"] == pytest.approx(215)
@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+import market_data_api
+from fixed_point import to_units
+
+
+def test_split_adjustment_is_exact_and_rounds_up_partial_shares(monkeypatch):
+    monkeypatch.setattr(
+        market_data_api,
+        "_splits_cache",
+        {
+            "XYZ": {
+                "data": [
+                    {"effective_date": "2022-06-06", "split_factor": "1.5000"},
+                    {"effective_date": "2021-01-01", "split_factor": "3.0000"},
+                ]
+            }
+        },
+    )
+    trades_df = pd.DataFrame(
+        dict(
+            symbol="XYZ",
+            trade_date=pd.to_datetime(["2020-01-01", "2021-06-01", "2023-01-01"]),
+            quantity=to_units([101, 100, 7]),
+        )
+    )
+
+    market_data_api.apply_stock_splits(
+        trades_df, "XYZ", sorted(trades_df["trade_date"].to_list())
+    )
+
+    # 101 * 4.5 = 454.5 is rounded up, 100 * 1.5 is exactly 150
+    assert trades_df["quantity"].tolist() == to_units([455, 150, 7]).tolist()
+
+
+class _Response:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def test_only_rate_limited_split_lookups_are_retried(monkeypatch):
+    monkeypatch.setattr(market_data_api, "_splits_cache", {})
+    monkeypatch.setattr(market_data_api, "REQUEST_INTERVAL_SECONDS", 0.0)
+    monkeypatch.setattr(market_data_api, "SPLITS_RETRY_SECONDS", 0.0)
+    rate_limited = {"Information": "Please observe the rate limit"}
+    attempts = market_data_api.SPLITS_REQUEST_ATTEMPTS
+    responses = {
+        "ABC": [rate_limited, {"symbol": "ABC", "data": []}],
+        "GONE": [{"Error Message": "Invalid API call"}],
+        "NONE": [{}],
+        "XYZ": [{"Note": "Please observe the rate limit"}] * attempts * 2,
+    }
+    requested = []
+
+    def get(url):
+        symbol = url.split("symbol=")[1].split("&")[0]
+        requested.append(symbol)
+        return _Response(responses[symbol].pop(0))
+
+    monkeypatch.setattr(market_data_api.requests, "get", get)
+
+    assert market_data_api.fetch_stock_splits("ABC") == {"symbol": "ABC", "data": []}
+    assert market_data_api.fetch_stock_splits("ABC")["data"] == []
+    assert requested == ["ABC", "ABC"]
+
+    # Unknown and delisted symbols have no splits, without retrying
+    for symbol in ["GONE", "NONE", "GONE"]:
+        assert market_data_api.fetch_stock_splits(symbol)["data"] == []
+    assert requested[2:] == ["GONE", "NONE"]
+
+    # Calculated without splits, but looked up again next time
+    assert market_data_api.fetch_stock_splits("XYZ")["data"] == []
+    assert market_data_api.uncached_symbols(["ABC", "GONE", "XYZ"]) == ["XYZ"]
+    assert requested.count("XYZ") == attempts
+
+    monkeypatch.setattr(market_data_api, "_require_splits", True)
+    with pytest.raises(market_data_api.MarketDataUnavailable, match="XYZ.*rate limit"):
+        market_data_api.fetch_stock_splits("XYZ")
+    assert requested.count("XYZ") == attempts * 2
+    assert "XYZ" not in market_data_api._splits_cache
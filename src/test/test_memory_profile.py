@@ -0,0 +1,48 @@
+from pathlib import Path
+
+import numpy as np
+
+from memory_profile import MemoryProfile
+from reports import write_report
+from test.mock_cgt_calculator import MockCGTCalculator
+
+TRADE_HISTORY = str(Path(__file__).parent / "trade_history_test.csv")
+
+
+def test_nested_stages_include_inner_peaks():
+    profile = MemoryProfile(top_sites_mb=10)
+    with profile.stage("outer"):
+        with profile.stage("inner", step=1):
+            scratch = np.ones(4 * 2**20)  # 32 MB, freed before the stage ends
+            del scratch
+        kept = np.ones(2**20)  # 8 MB
+
+    inner, outer = profile.stages
+    assert (inner["stage"], inner["step"]) == ("inner", 1)
+    assert inner["traced_peak_mb"] >= 32 and inner["traced_mb"] < 1
+    assert outer["traced_peak_mb"] >= inner["traced_peak_mb"]
+    assert outer["traced_mb"] >= 8
+    assert outer["rss_peak_mb"] >= inner["rss_peak_mb"]
+    # Stages peaking over 10 MB dump the sites still holding memory
+    assert outer["top_allocations"][0]["size_mb"] >= 8
+    del kept
+
+
+def test_calculation_stages(tmp_path):
+    profile = MemoryProfile()
+    calculator = MockCGTCalculator(TRADE_HISTORY, memory_profile=profile)
+    report = write_report(calculator, "session", True, str(tmp_path), 2023, profile)
+
+    stages = [record["stage"] for record in profile.stages]
+    assert stages[:2] == ["parse", "market_data"]
+    assert stages[-2:] == ["execute", "export"]
+    solves = [record for record in profile.stages if record["stage"] == "solve"]
+    assert solves and all(record["fy"] <= 2023 for record in solves)
+
+    summary = report["memory_profile"].to_dict(top_solves=3)
+    assert summary["solves"] == len(solves)
+    assert len(summary["largest_solves"]) == 3
+    assert [record["stage"] for record in summary["stages"]] == [
+        "parse", "market_data", "execute", "export"
+    ]
+    assert summary["rss_peak_mb"] > 0
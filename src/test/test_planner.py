@@ -0,0 +1,74 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from cgt_calculator import RunContext
+from fixed_point import QUANTITY_SCALE
+from planner import SellPlanner
+from test.mock_cgt_calculator import MockCGTCalculator
+
+TRADE_HISTORY = Path(__file__).parent / "trade_history_test.csv"
+
+
+@pytest.fixture(scope="module")
+def planner():
+    calculator = MockCGTCalculator(str(TRADE_HISTORY))
+    context = RunContext()
+    calculator.execute(allow_short_selling=True, context=context)
+    return SellPlanner.from_context(context)
+
+
+@pytest.mark.parametrize(
+    "symbol, quantity, sell_date, unit_price",
+    [
+        ("QQQM", 50, "2025-05-01", 300.0),  # Final year of the history
+        ("UBER", 100, "2026-02-01", 90.0),  # Year after the history ends
+    ],
+)
+def test_plan_matches_recalculating_with_the_sell(
+    planner, tmp_path, symbol, quantity, sell_date, unit_price
+):
+    plan = planner.plan(symbol, quantity, sell_date, unit_price)
+
+    history = tmp_path / "trade_history.csv"
+    shutil.copy(TRADE_HISTORY, history)
+    year, month, day = sell_date.split("-")
+    with open(history, "a") as f:
+        f.write(
+            f"\n{int(day)}/{int(month)}/{year},1,{symbol}.ASX,{quantity},Sell,"
+            f"{unit_price},0,{quantity * unit_price}\n"
+        )
+    results_per_fy = MockCGTCalculator(str(history)).execute(allow_short_selling=True)
+
+    assert plan["taxable_capital_gain"] == pytest.approx(
+        results_per_fy[plan["financial_year"]]["taxable_capital_gain"], rel=1e-9
+    )
+    assert sum(parcel["quantity"] for parcel in plan["parcels"]) == quantity
+
+
+def test_plan_rejects_selling_more_than_held(planner):
+    with pytest.raises(ValueError, match="only 369 held"):
+        planner.plan("QQQM", 1000, "2025-05-01", 300.0)
+    with pytest.raises(ValueError, match="from FY2025"):
+        planner.plan("QQQM", 1, "2024-05-01", 300.0)
+    with pytest.raises(ValueError, match="finite"):
+        planner.plan("QQQM", float("nan"), "2025-05-01", 300.0)
+    with pytest.raises(ValueError, match="finite"):
+        planner.plan("QQQM", 1, "2025-05-01", float("inf"))
+
+
+
+def test_saved_planners_must_use_the_current_units(planner, tmp_path):
+    path = tmp_path / "plan.pkl"
+    planner.save(path)
+    loaded = SellPlanner.load(path)
+    assert loaded.plan("QQQM", 50, "2025-05-01", 300.0) == planner.plan(
+        "QQQM", 50, "2025-05-01", 300.0
+    )
+
+    # e.g. saved before quantities kept 8 decimal places
+    loaded.quantity_scale = QUANTITY_SCALE // 10_000
+    loaded.save(path)
+    with pytest.raises(ValueError, match="older version"):
+        SellPlanner.load(path)
@@ -0,0 +1,65 @@
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+import pytest
+
+from output_excel_writer import ReportWriter, export_capital_gains_to_excel
+from reports import write_report
+from results import save_results
+from test.mock_cgt_calculator import MockCGTCalculator
+
+TRADE_HISTORY = str(Path(__file__).parent / "trade_history_test.csv")
+
+
+def workbook_values(path):
+    workbook = openpyxl.load_workbook(path)
+    return {
+        sheet.title: (
+            [tuple(cell.value for cell in row) for row in sheet.iter_rows()],
+            sorted(str(cells) for cells in sheet.merged_cells.ranges),
+        )
+        for sheet in workbook.worksheets
+    }
+
+
+@pytest.mark.parametrize("target_fy", [None, 2023, 2030])
+def test_pipelined_report_matches_sequential_export(tmp_path, target_fy):
+    calculator = MockCGTCalculator(TRADE_HISTORY)
+    report = write_report(calculator, "piped", True, str(tmp_path), target_fy)
+
+    results_per_fy = calculator.execute(True, target_fy=target_fy)
+    report_years = [target_fy] if target_fy in results_per_fy else None
+    export_capital_gains_to_excel(results_per_fy, tmp_path / "sequential.xlsx", report_years)
+    save_results(results_per_fy, tmp_path / "sequential.npz", pair_years=report_years)
+
+    assert workbook_values(report["excel_path"]) == workbook_values(
+        tmp_path / "sequential.xlsx"
+    )
+    with np.load(report["results_path"]) as piped, np.load(
+        tmp_path / "sequential.npz"
+    ) as sequential:
+        assert sorted(piped.files) == sorted(sequential.files)
+        for name in piped.files:
+            np.testing.assert_array_equal(piped[name], sequential[name])
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_failed_calculation_leaves_no_report(tmp_path):
+    calculator = MockCGTCalculator(TRADE_HISTORY)
+    with pytest.raises(ValueError, match="Short selling detected"):
+        write_report(calculator, "short", False, str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_report_writing_leaves_no_report(tmp_path, monkeypatch):
+    close = ReportWriter.close
+
+    def close_then_fail(self):
+        close(self)
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(ReportWriter, "close", close_then_fail)
+    with pytest.raises(OSError, match="No space left"):
+        write_report(MockCGTCalculator(TRADE_HISTORY), "full", True, str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
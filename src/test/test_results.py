@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+from pandas import Timestamp
+
+from results import (
+    BuySellPairs,
+    CalculationResults,
+    LazyBuySellPairs,
+    ResultsWriter,
+    load_results,
+    load_summary,
+    save_results,
+)
+
+
+def _results():
+    totals = dict(
+        short_term=120.5,
+        long_term=300.0,
+        total_capital_gain=420.5,
+        capital_gain_discount=150.0,
+        loss=0.0,
+        short_sell_gain=-10.0,
+        taxable_capital_gain=270.5,
+    )
+    return {
+        2024: dict(
+            buy_and_sell_pairs={
+                "BHP": BuySellPairs.from_rows(
+                    [
+                        (Timestamp("2021-03-01"), Timestamp("2023-08-01"), 100.0, 3.0),
+                        (None, Timestamp("2023-09-01"), 5.0, -2.0),
+                    ]
+                ),
+                "CBA": BuySellPairs.from_rows(
+                    [(Timestamp("2023-01-10"), Timestamp("2023-10-10"), 10.0, 12.05)]
+                ),
+            },
+            **totals,
+        ),
+        2025: dict(buy_and_sell_pairs={}, **{key: 0.0 for key in totals}),
+    }
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_results_round_trip(tmp_path, mmap):
+    path = tmp_path / "results.npz"
+    results = _results()
+    save_results(results, path)
+
+    loaded = load_results(path, mmap=mmap)
+
+    assert loaded.keys() == results.keys()
+    for fy, expected in results.items():
+        assert list(loaded[fy]) == list(expected)
+        assert loaded[fy]["buy_and_sell_pairs"] == expected["buy_and_sell_pairs"]
+        for key, value in expected.items():
+            if key != "buy_and_sell_pairs":
+                assert loaded[fy][key] == value
+    if mmap:
+        assert isinstance(loaded[2024]["buy_and_sell_pairs"]["BHP"].quantity, np.memmap)
+    assert list(loaded[2024]["buy_and_sell_pairs"]["BHP"].rows())[1][0] is None
+
+
+def test_results_writer_streams_groups(tmp_path):
+    path = tmp_path / "results.npz"
+    results = _results()
+    writer = ResultsWriter(path)
+    for symbol, pairs in results[2024]["buy_and_sell_pairs"].items():
+        writer.add(2024, symbol, pairs)
+    writer.close(results)
+
+    loaded = load_results(path)
+    assert loaded[2024]["buy_and_sell_pairs"] == results[2024]["buy_and_sell_pairs"]
+    assert list(tmp_path.iterdir()) == [path]
+
+    aborted = ResultsWriter(tmp_path / "aborted.npz")
+    aborted.add(2024, "BHP", results[2024]["buy_and_sell_pairs"]["BHP"])
+    aborted.abort()
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_load_summary_rejects_other_versions(tmp_path):
+    path = tmp_path / "results.npz"
+    save_results(_results(), path)
+
+    summary = load_summary(path)
+    assert summary[2024]["taxable_capital_gain"] == 270.5
+    assert summary[2025]["loss"] == 0.0
+
+    with np.load(path) as npz:
+        arrays = dict(npz)
+    arrays["format_version"] = np.array(99, dtype=np.int16)
+    np.savez(path, **arrays)
+    with pytest.raises(ValueError, match="version 99"):
+        load_summary(path)
+
+
+
+def test_calculation_results_summarise_and_build_pairs_on_first_read():
+    expected_pairs = _results()[2024]["buy_and_sell_pairs"]
+    built = []
+
+    def builder(symbol):
+        def build():
+            built.append(symbol)
+            return expected_pairs[symbol]
+
+        return build
+
+    pairs = LazyBuySellPairs()
+    pairs.add("BHP", builder("BHP"))
+    pairs.add("CBA", builder("CBA"))
+    results = CalculationResults(lambda fy_results: fy_results.update(summarised=True))
+    results.add_year(2024, dict(buy_and_sell_pairs=pairs, short_term=1.0))
+
+    assert list(results) == [2024]
+    assert results[2024]["summarised"]
+    assert list(results[2024]["buy_and_sell_pairs"]) == ["BHP", "CBA"]
+    assert built == []
+    assert results[2024]["buy_and_sell_pairs"]["CBA"] == expected_pairs["CBA"]
+    results[2024]["buy_and_sell_pairs"]["CBA"]
+    assert built == ["CBA"]
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import time
+
+import pytest
+
+from session_store import SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"), delete_batch_size=2)
+    store.init_schema()
+    return store
+
+
+def test_store_get_and_exists(store):
+    store.store("abc", "outputs/cgt_report_abc.xlsx", "cgt_report_abc.xlsx")
+
+    assert store.exists("abc")
+    assert not store.exists("missing")
+    assert store.get("missing") is None
+    session = store.get("abc")
+    assert session["excel_path"] == "outputs/cgt_report_abc.xlsx"
+    assert session["excel_filename"] == "cgt_report_abc.xlsx"
+
+
+def test_sessions_are_unpaid_until_marked(store):
+    store.store("abc", "outputs/cgt_report_abc.xlsx", "cgt_report_abc.xlsx")
+    assert store.get("abc")["paid_at"] is None
+
+    store.mark_paid("abc")
+    paid_at = store.get("abc")["paid_at"]
+    store.mark_paid("abc")
+
+    assert paid_at is not None
+    assert store.get("abc")["paid_at"] == paid_at
+
+
+def test_wal_mode_and_expiry_index(store):
+    conn = store.connection()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT session_id FROM sessions WHERE created_at < ?",
+        (datetime.now(),),
+    ).fetchall()
+    assert any("idx_sessions_created_at" in row[-1] for row in plan)
+
+
+def test_expired_sessions_deleted_in_batches(store):
+    for i in range(5):
+        store.store(f"s{i}", f"outputs/s{i}.xlsx", f"s{i}.xlsx")
+
+    expired = store.expired(datetime.now() + timedelta(seconds=1))
+    assert len(expired) == 5
+    assert store.delete(session["session_id"] for session in expired) == 5
+    assert store.expired(datetime.now() + timedelta(seconds=1)) == []
+
+
+def test_connections_are_reused_per_thread(store):
+    assert store.connection() is store.connection()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        other_thread_conn = executor.submit(store.connection).result()
+    assert other_thread_conn is not store.connection()
+
+
+def test_lease_has_a_single_holder_until_expiry(store):
+    assert store.acquire_lease("cleanup", "worker-1", ttl_seconds=60)
+    assert not store.acquire_lease("cleanup", "worker-2", ttl_seconds=60)
+    # The holder can renew its own lease
+    assert store.acquire_lease("cleanup", "worker-1", ttl_seconds=60)
+
+    store.release_lease("cleanup", "worker-1")
+    assert store.acquire_lease("cleanup", "worker-2", ttl_seconds=-1)
+    # An expired lease can be taken over
+    assert store.acquire_lease("cleanup", "worker-1", ttl_seconds=60)
+
+
+def test_init_schema_adds_new_columns_to_old_databases(tmp_path):
+    database = str(tmp_path / "sessions.db")
+    old = sqlite3.connect(database)
+    old.execute(
+        "CREATE TABLE sessions (session_id TEXT PRIMARY KEY, excel_path TEXT NOT NULL, "
+        "excel_filename TEXT NOT NULL, created_at TIMESTAMP NOT NULL)"
+    )
+    old.execute("INSERT INTO sessions VALUES ('old', 'a.xlsx', 'a.xlsx', '2024-01-01')")
+    old.commit()
+    old.close()
+
+    store = SessionStore(database)
+    store.init_schema()
+    store.store("new", "b.xlsx", "b.xlsx", "b.npz")
+
+    assert store.get("old")["results_path"] is None
+    assert store.get("old")["plan_path"] is None
+    assert store.get("old")["export_format"] is None
+    assert store.get("old")["paid_at"] is None
+    assert store.get("new")["results_path"] == "b.npz"
+    assert store.get("new")["export_format"] == "xlsx"
+
+
+def test_jobs(store):
+    store.create_job("j1", dict(seconds=1.5))
+    job = store.get_job("j1")
+    assert job["status"] == "queued"
+    assert job["estimate"] == dict(seconds=1.5)
+    assert job["result"] is None
+
+    store.update_job("j1", eta_seconds=3.0)
+    store.update_job(
+        "j1", status="done", result=dict(session_id="abc"), memory=dict(rss_peak_mb=1.0)
+    )
+    job = store.get_job("j1")
+    assert (job["status"], job["eta_seconds"]) == ("done", 3.0)
+    assert job["result"] == dict(session_id="abc")
+    assert job["memory"] == dict(rss_peak_mb=1.0)
+    assert store.get_job("missing") is None
+
+    assert store.delete_jobs_before(datetime.now() - timedelta(hours=1)) == 0
+    assert store.delete_jobs_before(datetime.now() + timedelta(seconds=1)) == 1
+    assert store.get_job("j1") is None
+
+
+def test_jobs_left_by_a_dead_worker_are_failed(store):
+    for job_id in ("done", "alive", "lost"):
+        store.create_job(job_id)
+    store.update_job("done", status="done", result=dict(session_id="abc"))
+    cutoff_time = datetime.now()
+    time.sleep(0.01)
+    # The live worker marks its job, a dead one cannot
+    store.touch_jobs(["alive", "done"])
+
+    assert store.fail_stale_jobs(cutoff_time, dict(error="interrupted")) == 1
+    assert store.get_job("lost")["status"] == "failed"
+    assert store.get_job("lost")["result"] == dict(error="interrupted")
+    assert store.get_job("alive")["status"] == "queued"
+    assert store.get_job("done")["result"] == dict(session_id="abc")